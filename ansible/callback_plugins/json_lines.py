@@ -0,0 +1,77 @@
+"""
+Stdout callback that prints one json object per line for every event, so
+that the resource pool cli can parse ansible output as it streams in,
+instead of scraping human readable output or writing --tree files.
+
+Every line has an "event" key, which is one of:
+  task_start - a task is starting, with its name
+  runner     - a task finished on a host, with its status, result and duration
+  stats      - the playbook finished, with the per host summary
+"""
+
+import json
+import time
+
+from ansible.parsing.ajson import AnsibleJSONEncoder
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "stdout"
+    CALLBACK_NAME = "json_lines"
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self._task_start_times = {}
+
+    def _emit(self, event):
+        event["time"] = time.time()
+        self._display.display(json.dumps(event, cls=AnsibleJSONEncoder, sort_keys=True))
+
+    def _emit_result(self, status, result):
+        host = result._host.get_name()
+        start_time = self._task_start_times.pop((host, result._task._uuid), None)
+        self._emit(
+            {
+                "event": "runner",
+                "status": status,
+                "host": host,
+                "task": result._task.get_name(),
+                "duration": time.time() - start_time if start_time else None,
+                "result": self._clean_results_copy(result._result),
+            }
+        )
+
+    def _clean_results_copy(self, result):
+        result = dict(result)
+        self._clean_results(result, None)
+        return result
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._emit({"event": "task_start", "task": task.get_name()})
+
+    def v2_runner_on_start(self, host, task):
+        self._task_start_times[(host.get_name(), task._uuid)] = time.time()
+
+    def v2_runner_on_ok(self, result):
+        self._emit_result("ok", result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._emit_result("failed", result)
+
+    def v2_runner_on_unreachable(self, result):
+        self._emit_result("unreachable", result)
+
+    def v2_runner_on_skipped(self, result):
+        self._emit_result("skipped", result)
+
+    def v2_playbook_on_stats(self, stats):
+        self._emit(
+            {
+                "event": "stats",
+                "hosts": {
+                    host: stats.summarize(host) for host in sorted(stats.processed)
+                },
+            }
+        )
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+"""
+Measures how long the cli spends per ansible step on the control plane,
+with every step running as its own ansible process, and with the steps
+sent to long lived ansible workers.
+
+Every step is a trivial command against local connection hosts, so the
+time measured is almost entirely start-up, plugin loading, inventory
+parsing and result handling, not work done on the servers.
+
+    python3 benchmarks/ansible_step_overhead.py --steps 20 --hosts 10
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import click
+from prettytable import PrettyTable
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "resource_pool_cli"))
+
+import executor
+
+CALLBACK_PLUGINS_DIR = os.path.join(REPO_DIR, "ansible", "callback_plugins")
+
+PLAYBOOK = """
+- hosts: all
+  gather_facts: no
+  tasks:
+    - name: noop
+      raw: "true"
+"""
+
+
+def write_fixtures(work_dir, host_count):
+    inventory_file = os.path.join(work_dir, "hosts.yml")
+    with open(inventory_file, "w") as f:
+        f.write("all:\n  hosts:\n")
+        for index in range(host_count):
+            f.write("    127.0.0.{}:\n".format(index + 1))
+            f.write("      ansible_connection: local\n")
+            f.write("      ansible_python_interpreter: {}\n".format(sys.executable))
+
+    playbook_file = os.path.join(work_dir, "noop.yml")
+    with open(playbook_file, "w") as f:
+        f.write(PLAYBOOK)
+
+    return inventory_file, playbook_file
+
+
+def time_steps(start_step, steps):
+    durations = []
+    for _ in range(steps):
+        start = time.monotonic()
+        run = start_step().run()
+        durations.append(time.monotonic() - start)
+        if run.returncode != 0:
+            raise click.ClickException("A step failed, see the output above")
+    return durations
+
+
+@click.command()
+@click.option("--steps", default=10, help="Number of steps per measurement")
+@click.option("--hosts", default=5, help="Number of local hosts in the inventory")
+def main(steps, hosts):
+    output_table = PrettyTable(
+        ["Backend", "Step", "First (s)", "Median (s)", "Mean (s)", "Total (s)"]
+    )
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        inventory_file, playbook_file = write_fixtures(work_dir, hosts)
+
+        for backend in (executor.SUBPROCESS_BACKEND, executor.WORKER_BACKEND):
+            ansible_executor = executor.AnsibleExecutor(CALLBACK_PLUGINS_DIR, backend)
+            step_kinds = (
+                (
+                    "ad-hoc",
+                    lambda: ansible_executor.adhoc([inventory_file], "raw", "true"),
+                ),
+                (
+                    "playbook",
+                    lambda: ansible_executor.playbook(playbook_file, [inventory_file]),
+                ),
+            )
+
+            try:
+                for step_name, start_step in step_kinds:
+                    durations = time_steps(start_step, steps)
+                    output_table.add_row(
+                        [
+                            backend,
+                            step_name,
+                            "{:.3f}".format(durations[0]),
+                            "{:.3f}".format(statistics.median(durations)),
+                            "{:.3f}".format(statistics.mean(durations)),
+                            "{:.2f}".format(sum(durations)),
+                        ]
+                    )
+            finally:
+                ansible_executor.close()
+
+            if ansible_executor.backend != backend:
+                click.echo("The {} backend was not available".format(backend), err=True)
+
+    click.echo(output_table)
+
+
+if __name__ == "__main__":
+    main()
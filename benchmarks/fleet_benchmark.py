@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+"""
+Runs the real cli commands against fake fleets of different sizes, and
+reports the wall time, the number of ansible runs and processes started,
+and the peak memory of every command. Nothing runs against real servers,
+so changes to the performance of the cli can be checked offline.
+
+Every fleet gets its own temporary ANSIBLE_DIR, set up by fake_fleet, and
+the cli is run with RP_ANSIBLE_BACKEND=fake. The ansible runs, processes
+and memory are read from the trace each command saves.
+
+    python3 benchmarks/fleet_benchmark.py --sizes 10,100,1000,10000
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+from prettytable import PrettyTable
+
+REPO_DIR = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+CLI_DIR = os.path.join(REPO_DIR, "resource_pool_cli")
+sys.path.insert(0, CLI_DIR)
+
+import capacity
+import fake_fleet
+
+CLI = os.path.join(CLI_DIR, "resource_pool_cli.py")
+CONFIRMATION_PROMPT = "please type out the following string:"
+
+
+def get_fleet_capacity(host_count):
+    policy = capacity.CapacityPolicy()
+    specs = [
+        policy.get_specs(fake_fleet.get_fake_server_specs(server))
+        for server in fake_fleet.get_fake_server_names(host_count)
+    ]
+    cores = sum(server_specs["cores"] for server_specs in specs)
+    mem = sum(server_specs["mem"] for server_specs in specs)
+    return cores, mem
+
+
+def get_scenario(host_count):
+    """
+    Returns the commands to run against a fleet, as (name, args) tuples.
+    The pool is created with a tenth of the fleet, grown to a fifth of it,
+    shrunk back and destroyed.
+    """
+    cores, mem = get_fleet_capacity(host_count)
+    small = ["-c", str(max(cores // 10, 1)), "-m", str(max(mem // 10, 1))]
+    large = ["-c", str(max(cores // 5, 2)), "-m", str(max(mem // 5, 2))]
+
+    return [
+        ("list (cold)", ["list"]),
+        ("list (cached)", ["list"]),
+        ("create", ["create", "bench"] + small),
+        ("resize up", ["resize", "bench"] + large),
+        ("resize down", ["resize", "bench"] + small),
+        ("destroy", ["destroy", "bench"]),
+    ]
+
+
+def run_command(args, env):
+    """
+    Runs the cli, answering its confirmation prompt. Returns the exit code,
+    the wall time and the output.
+    """
+    start = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, CLI] + args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=env,
+    )
+
+    output = []
+    for line in process.stdout:
+        line = line.decode(errors="replace")
+        output.append(line)
+        if CONFIRMATION_PROMPT in line:
+            process.stdin.write((line.split()[-1] + "\n").encode())
+            process.stdin.flush()
+
+    returncode = process.wait()
+    return returncode, time.monotonic() - start, "".join(output)
+
+
+def get_latest_trace(trace_dir):
+    trace_files = sorted(
+        (os.path.join(trace_dir, name) for name in os.listdir(trace_dir)),
+        key=os.path.getmtime,
+    )
+    with open(trace_files[-1]) as f:
+        return json.load(f)
+
+
+@click.command()
+@click.option(
+    "--sizes", default="10,100,1000,10000", help="Comma separated fleet sizes"
+)
+@click.option("--latency", default=0.0, help="Seconds every fake task takes on a host")
+@click.option("--failure-rate", default=0.0, help="Chance of a host failing a run")
+@click.option("--output", type=click.Path(), help="Also save the results as json")
+def main(sizes, latency, failure_rate, output):
+    output_table = PrettyTable(
+        [
+            "Hosts",
+            "Command",
+            "Exit",
+            "Wall (s)",
+            "Ansible runs",
+            "Processes",
+            "Max RSS (MB)",
+        ]
+    )
+    results = []
+
+    for host_count in [int(size) for size in sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as ansible_dir:
+            fake_fleet.write_ansible_dir(
+                ansible_dir, os.path.join(REPO_DIR, "ansible"), host_count
+            )
+            trace_dir = os.path.join(ansible_dir, "traces")
+
+            env = dict(os.environ)
+            env.update(
+                {
+                    "RP_ANSIBLE_DIR": ansible_dir,
+                    "RP_ANSIBLE_BACKEND": "fake",
+                    "RP_FAKE_LATENCY": str(latency),
+                    "RP_FAKE_FAILURE_RATE": str(failure_rate),
+                    "RP_FAKE_SEED": "0",
+                    "RP_TRACE_DIR": trace_dir,
+                    "PYTHONUNBUFFERED": "1",
+                }
+            )
+
+            for name, args in get_scenario(host_count):
+                returncode, wall, command_output = run_command(args, env)
+                if returncode != 0:
+                    click.echo(command_output, err=True)
+
+                attributes = get_latest_trace(trace_dir)["attributes"]
+                result = {
+                    "hosts": host_count,
+                    "command": name,
+                    "exit": returncode,
+                    "wall": wall,
+                    "ansible_runs": attributes.get("ansible_runs", 0),
+                    "processes": attributes.get("processes_started", 0),
+                    "max_rss_mb": attributes["max_rss_kb"] / 1024.0,
+                }
+                results.append(result)
+                output_table.add_row(
+                    [
+                        host_count,
+                        name,
+                        returncode,
+                        "{:.2f}".format(wall),
+                        result["ansible_runs"],
+                        result["processes"],
+                        "{:.1f}".format(result["max_rss_mb"]),
+                    ]
+                )
+
+    click.echo(output_table)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+"""
+Measures how the reconciler heals a pool on fake fleets of different sizes.
+For every fleet, a pool is created with half of the fleet, some of its
+workers are marked down, and `reconcile --once` is run until the pool is
+healed. It reports how many passes it took to notice and heal the pool,
+the most workers probed by a single pass, the wall time of the passes, and
+the detection to replacement latency a reconciler running every interval
+seconds would have.
+
+    python3 benchmarks/heal_benchmark.py --sizes 100,1000,10000 --check-budget 50
+"""
+
+import json
+import os
+import tempfile
+
+import click
+from prettytable import PrettyTable
+
+from fleet_benchmark import REPO_DIR, get_fleet_capacity, run_command
+
+import fake_fleet
+import inventory
+
+
+def read_gauges(metrics_file):
+    gauges = {}
+    with open(metrics_file) as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            name, value = line.rsplit(" ", 1)
+            gauges[name] = float(value)
+    return gauges
+
+
+def read_events(events_file):
+    if not os.path.exists(events_file):
+        return []
+    with open(events_file) as f:
+        return [json.loads(line) for line in f]
+
+
+@click.command()
+@click.option("--sizes", default="100,1000,10000", help="Comma separated fleet sizes")
+@click.option("--down", default=1, help="Workers to mark down in the pool")
+@click.option("--check-budget", default=50, help="Most workers to check per pass")
+@click.option("--failures", default=3, help="Failed checks before a worker is down")
+@click.option("--interval", default=30, help="Seconds between passes to assume")
+@click.option("--max-passes", default=1000, help="Give up after this many passes")
+def main(sizes, down, check_budget, failures, interval, max_passes):
+    output_table = PrettyTable(
+        [
+            "Hosts",
+            "Workers",
+            "Passes",
+            "Max checked",
+            "Pass wall (s)",
+            "Latency (s)",
+            "Bound (s)",
+        ]
+    )
+
+    for host_count in [int(size) for size in sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as ansible_dir:
+            fake_fleet.write_ansible_dir(
+                ansible_dir, os.path.join(REPO_DIR, "ansible"), host_count
+            )
+            metrics_dir = os.path.join(ansible_dir, "metrics")
+            events_file = os.path.join(ansible_dir, "events.log")
+
+            env = dict(os.environ)
+            env.update(
+                {
+                    "RP_ANSIBLE_DIR": ansible_dir,
+                    "RP_ANSIBLE_BACKEND": "fake",
+                    "RP_FAKE_SEED": "0",
+                    "RP_TRACE_DIR": os.path.join(ansible_dir, "traces"),
+                    "RP_METRICS_TEXTFILE_DIR": metrics_dir,
+                    "RP_EVENTS_FILE": events_file,
+                    "PYTHONUNBUFFERED": "1",
+                }
+            )
+
+            cores, mem = get_fleet_capacity(host_count)
+            returncode, _, output = run_command(
+                ["create", "heal", "-c", str(cores // 2), "-m", str(mem // 2)], env
+            )
+            if returncode != 0:
+                click.echo(output, err=True)
+                continue
+
+            # Every worker is probed before any of them goes down, like a
+            # reconciler that has been running for a while would have done.
+            args = [
+                "reconcile",
+                "--once",
+                "--check-budget",
+                str(check_budget),
+                "--failures",
+                str(failures),
+                "--interval",
+                str(interval),
+            ]
+            store = inventory.InventoryStore(
+                os.path.join(ansible_dir, "pools", ".inventory.db")
+            )
+            workers = store.get_servers("heal", inventory.WORKERS_ROLE)
+            while len(store.get_cached_probes(workers, None)) < len(workers):
+                run_command(args, env)
+
+            fake_fleet.mark_down(
+                os.path.join(ansible_dir, ".fake_fleet.json"), workers[:down]
+            )
+
+            passes = 0
+            max_checked = 0
+            wall = 0.0
+            while passes < max_passes:
+                passes += 1
+                _, pass_wall, _ = run_command(args, env)
+                wall += pass_wall
+                gauges = read_gauges(
+                    os.path.join(metrics_dir, "resource_pool_cli_reconciler.prom")
+                )
+                max_checked = max(
+                    max_checked, gauges["resource_pool_cli_reconciler_workers_checked"]
+                )
+                if any(
+                    event["event"] == "healed" for event in read_events(events_file)
+                ):
+                    break
+
+            output_table.add_row(
+                [
+                    host_count,
+                    len(workers),
+                    passes,
+                    int(max_checked),
+                    "{:.2f}".format(wall),
+                    passes * interval,
+                    int(gauges["resource_pool_cli_reconciler_detection_bound_seconds"]),
+                ]
+            )
+
+    click.echo(output_table)
+
+
+if __name__ == "__main__":
+    main()
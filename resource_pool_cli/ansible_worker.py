@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+"""
+A long lived ansible process, started by the executor module. It imports
+ansible and loads its plugins once, and then runs one playbook or ad-hoc
+command per request, so that every step of an operation does not pay for
+starting a new interpreter, loading plugins and parsing the inventory.
+
+Requests are read from stdin, one json object per line. Results are
+printed to stdout by the json_lines callback, exactly as they are by
+ansible-playbook, and every request ends with a "worker_exit" event that
+holds the return code.
+
+Ansible can only run on the main thread of a process, which is why this is
+a separate process rather than running inside the cli, whose phases run on
+threads.
+"""
+
+import json
+import os
+import sys
+
+from ansible import constants as C
+from ansible import context
+from ansible.executor.playbook_executor import PlaybookExecutor
+from ansible.executor.task_queue_manager import TaskQueueManager
+from ansible.inventory.manager import InventoryManager
+from ansible.module_utils.common.collections import ImmutableDict
+from ansible.parsing.dataloader import DataLoader
+from ansible.parsing.splitter import parse_kv
+from ansible.playbook.play import Play
+from ansible.vars.manager import VariableManager
+
+try:
+    from ansible.plugins.loader import init_plugin_loader
+except ImportError:
+    # Ansible before 2.15 loads its plugins on first use
+    init_plugin_loader = None
+
+
+def _send(event):
+    print(json.dumps(event), flush=True)
+
+
+class Worker:
+    def __init__(self):
+        # Inventories are kept by their list of files, along with the
+        # modification times they were parsed at, so they are only parsed
+        # again after they were rendered again.
+        self._inventory_loader = DataLoader()
+        self._inventories = {}
+
+        context.CLIARGS = ImmutableDict(
+            connection="smart",
+            module_path=None,
+            forks=C.DEFAULT_FORKS,
+            become=None,
+            become_method=None,
+            become_user=None,
+            check=False,
+            diff=False,
+            syntax=False,
+            listhosts=False,
+            listtasks=False,
+            listtags=False,
+            start_at_task=None,
+            verbosity=0,
+        )
+
+    def _get_inventory(self, inventory_files, limit):
+        sources = tuple(inventory_files)
+        versions = tuple(
+            os.stat(source).st_mtime_ns if os.path.exists(source) else None
+            for source in sources
+        )
+
+        cached = self._inventories.get(sources)
+        if cached is None or cached[0] != versions:
+            inventory = InventoryManager(self._inventory_loader, sources=list(sources))
+            cached = (versions, inventory)
+            self._inventories[sources] = cached
+
+        inventory = cached[1]
+        inventory.subset(",".join(limit) if limit else None)
+        inventory.clear_pattern_cache()
+        return inventory
+
+    def run(self, request):
+        """
+        Runs a single request, and returns the ansible return code
+        """
+        # Playbooks are read fresh for every request, since some of them,
+        # like the join playbook of a pool, are rewritten between runs.
+        loader = DataLoader()
+        inventory = self._get_inventory(request["inventory"], request.get("limit"))
+        variable_manager = VariableManager(loader=loader, inventory=inventory)
+        variable_manager._extra_vars = request.get("extra_vars") or {}
+
+        try:
+            if request["kind"] == "playbook":
+                return PlaybookExecutor(
+                    playbooks=[request["playbook"]],
+                    inventory=inventory,
+                    variable_manager=variable_manager,
+                    loader=loader,
+                    passwords={},
+                ).run()
+
+            return self._run_adhoc(request, inventory, variable_manager, loader)
+        finally:
+            loader.cleanup_all_tmp_files()
+
+    def _run_adhoc(self, request, inventory, variable_manager, loader):
+        module = request["module"]
+        play = Play().load(
+            {
+                "name": "ansible ad-hoc command",
+                "hosts": "all",
+                "gather_facts": "no",
+                "tasks": [
+                    {
+                        "action": {
+                            "module": module,
+                            "args": parse_kv(
+                                request["args"],
+                                check_raw=module in C.MODULE_REQUIRE_ARGS,
+                            ),
+                        }
+                    }
+                ],
+            },
+            variable_manager=variable_manager,
+            loader=loader,
+        )
+
+        tqm = TaskQueueManager(
+            inventory=inventory,
+            variable_manager=variable_manager,
+            loader=loader,
+            passwords={},
+        )
+        try:
+            return tqm.run(play)
+        finally:
+            tqm.cleanup()
+
+
+def main():
+    if init_plugin_loader is not None:
+        init_plugin_loader()
+
+    worker = Worker()
+    _send({"event": "worker_ready"})
+
+    for line in sys.stdin:
+        try:
+            returncode = worker.run(json.loads(line))
+        except Exception as error:
+            # Printed the same way ansible-playbook prints its own errors,
+            # so it shows up in the log of the run.
+            print("ERROR! {}".format(error), flush=True)
+            returncode = 1
+        _send({"event": "worker_exit", "returncode": returncode})
+
+
+if __name__ == "__main__":
+    main()
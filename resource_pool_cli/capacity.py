@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+"""
+The capacity model of a server, built from the results of a capacity
+probe: its sockets, physical cores, vCPUs and memory, and what is left of
+them for pods once kubelet and the system took their share.
+
+A CapacityPolicy decides which of these numbers count as the cores and
+memory of a server, which is what get_total_cores_mem() adds up and what
+placement fills requests with:
+
+  physical - every core of every socket, ignoring hyperthreads
+  vcpus    - every hardware thread, as the kernel and kubernetes see them
+  socket   - the cores of a single socket, as older versions counted
+
+With allocatable set, the reservations are taken off every server, like
+kubelet does with --kube-reserved, --system-reserved and --eviction-hard,
+so that a pool gets enough servers for what its pods can actually use.
+"""
+
+PHYSICAL = "physical"
+VCPUS = "vcpus"
+SOCKET = "socket"
+
+CPU_ACCOUNTINGS = (PHYSICAL, VCPUS, SOCKET)
+
+
+class CapacityError(Exception):
+    """
+    Raised when a capacity policy is not valid. The message is meant to be
+    shown to the user as it is.
+    """
+
+
+def parse_reserved(value):
+    """
+    Parses reservations in the style of kubelet flags, such as
+    "cpu=1,memory=2", with cpu in cores and memory in GB, and returns them
+    as a dictionary
+    """
+    reserved = {"cpu": 0.0, "memory": 0.0}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        resource, _, amount = item.partition("=")
+        if resource.strip() not in reserved:
+            raise CapacityError(
+                "Cannot reserve {}, only cpu and memory can be reserved".format(
+                    resource.strip()
+                )
+            )
+        try:
+            reserved[resource.strip()] += float(amount)
+        except ValueError:
+            raise CapacityError(
+                "The {} reservation is not a number: {}".format(
+                    resource.strip(), amount
+                )
+            )
+    return reserved
+
+
+def get_hardware(probe):
+    """
+    Returns the sockets, physical cores, vCPUs and GB of memory of a server,
+    from the results of its capacity probe. Virtual machines often do not
+    report sockets or cores per socket, and are then assumed to have a
+    single socket, with one core per vCPU.
+    """
+    vcpus = probe["vcpus"]
+    sockets = probe["sockets"] or 1
+    physical_cores = sockets * probe["cores_per_socket"] or vcpus
+    return {
+        "sockets": sockets,
+        "physical_cores": physical_cores,
+        "vcpus": vcpus or physical_cores,
+        "total_mem": round(probe["mem_kb"] / 1024.0 / 1024.0),
+    }
+
+
+class CapacityPolicy:
+    def __init__(
+        self,
+        cpu_accounting=PHYSICAL,
+        allocatable=True,
+        kube_reserved=None,
+        system_reserved=None,
+        eviction_hard=None,
+    ):
+        if cpu_accounting not in CPU_ACCOUNTINGS:
+            raise CapacityError(
+                "Unknown cpu accounting {}, it can be one of: {}".format(
+                    cpu_accounting, ", ".join(CPU_ACCOUNTINGS)
+                )
+            )
+        self.cpu_accounting = cpu_accounting
+        self.allocatable = allocatable
+
+        self.reserved = {"cpu": 0.0, "memory": 0.0}
+        for reservations in (kube_reserved, system_reserved, eviction_hard):
+            for resource, amount in parse_reserved(reservations).items():
+                self.reserved[resource] += amount
+
+    def get_specs(self, probe):
+        """
+        Turns the results of a capacity probe into the specs used everywhere
+        else, a dictionary with the cores and GB of memory of the server
+        under this policy, along with its hardware and allocatable capacity
+        """
+        specs = get_hardware(probe)
+
+        if self.cpu_accounting == PHYSICAL:
+            cores = specs["physical_cores"]
+        elif self.cpu_accounting == VCPUS:
+            cores = specs["vcpus"]
+        else:
+            cores = probe["cores_per_socket"] or specs["vcpus"]
+
+        specs["allocatable_cores"] = _round(max(cores - self.reserved["cpu"], 0))
+        specs["allocatable_mem"] = _round(
+            max(specs["total_mem"] - self.reserved["memory"], 0)
+        )
+
+        if self.allocatable:
+            specs["cores"] = specs["allocatable_cores"]
+            specs["mem"] = specs["allocatable_mem"]
+        else:
+            specs["cores"] = cores
+            specs["mem"] = specs["total_mem"]
+        return specs
+
+
+def _round(amount):
+    # Whole amounts are kept as integers, so that they show as before
+    amount = round(amount, 2)
+    return int(amount) if amount == int(amount) else amount
@@ -0,0 +1,516 @@
+#!/usr/bin/python3
+
+"""
+Execution layer for every ansible and ansible-playbook command the cli runs.
+
+Ansible is run with the json_lines stdout callback, so each task result
+arrives as one line of json. Runs are streamed line by line: callers can
+react to every host and task as it finishes, failures are shown as soon
+as they happen, and the output is never buffered as a whole.
+
+By default, commands are sent to long lived ansible_worker processes, that
+keep ansible loaded and the inventory parsed between the steps of an
+operation. Each one runs a single command at a time, so phases that run in
+parallel each get their own. If the workers cannot be started, such as when
+ansible cannot be imported by this interpreter, every command falls back to
+running as its own ansible or ansible-playbook process.
+
+Other backends, such as the fake fleet used by the benchmarks, subclass
+AnsibleExecutor and override run_lines(), as well as the checks that reach
+the servers without ansible, is_apiserver_healthy(), check_hosts() and
+keep_warm(). When the fleet is split into sites, the SiteCoordinator of
+the sites module stands in for the executor, and runs every command on
+the executors of the sites it reaches.
+"""
+
+import collections
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import click
+
+import health
+import readiness
+import ssh_mux
+import tracing
+
+WORKER_BACKEND = "worker"
+SUBPROCESS_BACKEND = "subprocess"
+
+WORKER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "ansible_worker.py"
+)
+
+
+class AnsibleExecutor:
+    """
+    Starts ansible commands with the json_lines callback from the given
+    directory, on the given backend. With an ssh control directory, ssh
+    connections are shared through it, and kept open for ssh_persist after
+    they were last used.
+
+    controller is a command that every ansible command and worker is run
+    through, such as docker exec into a container of a remote site, and
+    forks overrides how many hosts ansible works on at once.
+    """
+
+    def __init__(
+        self,
+        callback_plugins_dir,
+        backend=WORKER_BACKEND,
+        ssh_control_dir=None,
+        ssh_persist="60",
+        controller=(),
+        forks=None,
+    ):
+        self.env = json_lines_env(callback_plugins_dir)
+        self.backend = backend
+        self.ssh_control_dir = ssh_control_dir
+        self.ssh_persist = ssh_persist
+        if ssh_control_dir is not None:
+            self.env.update(ssh_mux.ansible_env(ssh_control_dir, ssh_persist))
+        if forks is not None:
+            self.env["ANSIBLE_FORKS"] = str(forks)
+
+        # The environment does not go through the controller command, so
+        # what this executor sets is passed on the command line instead
+        self.controller = list(controller)
+        if self.controller:
+            self.controller += ["env"] + [
+                "{}={}".format(key, value)
+                for key, value in sorted(self.env.items())
+                if os.environ.get(key) != value
+            ]
+        self._idle_workers = []
+        self._lock = threading.Lock()
+
+        # Counted for the benchmarks
+        self.runs_started = 0
+        self.processes_started = 0
+
+    def playbook(
+        self,
+        playbook_file,
+        inventory_files,
+        limit=None,
+        extra_vars=None,
+        capture=(),
+        echo_failures=True,
+    ):
+        """
+        Returns an AnsibleRun of a playbook, optionally limited to some of
+        the hosts and with extra variables
+        """
+        cmd = ["ansible-playbook", playbook_file]
+        cmd += _common_args(inventory_files, limit)
+        if extra_vars is not None:
+            cmd += ["--extra-vars", json.dumps(extra_vars)]
+
+        request = {
+            "kind": "playbook",
+            "playbook": playbook_file,
+            "inventory": list(inventory_files),
+            "limit": limit,
+            "extra_vars": extra_vars,
+        }
+        return AnsibleRun(self, cmd, request, capture, echo_failures)
+
+    def adhoc(
+        self, inventory_files, module, args, limit=None, capture=(), echo_failures=True
+    ):
+        """
+        Returns an AnsibleRun of an ad-hoc command against all hosts of the
+        given inventory files, optionally limited to some of them
+        """
+        cmd = ["ansible", "all"] + _common_args(inventory_files, limit)
+        cmd += ["-m", module, "-a", args]
+
+        request = {
+            "kind": "adhoc",
+            "module": module,
+            "args": args,
+            "inventory": list(inventory_files),
+            "limit": limit,
+        }
+        return AnsibleRun(self, cmd, request, capture, echo_failures)
+
+    def run_lines(self, run):
+        """
+        Yields the lines of output of an AnsibleRun, and sets its
+        returncode once it is done
+        """
+        with self._lock:
+            self.runs_started += 1
+
+        worker = self._checkout_worker()
+        if worker is None:
+            with self._lock:
+                self.processes_started += 1
+            process = subprocess.Popen(
+                self.controller + run.cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                env=self.env,
+            )
+            for line in process.stdout:
+                yield line.decode(errors="replace").rstrip()
+            run.returncode = process.wait()
+            return
+
+        try:
+            run.returncode = yield from worker.run(run.request)
+        finally:
+            self._checkin_worker(worker)
+
+    def is_apiserver_healthy(self, master_server):
+        """
+        Returns True if the API server on the given master is healthy. It is
+        asked directly rather than through ansible, but it is part of the
+        executor so that other backends can stand in for the servers.
+        """
+        return readiness.is_apiserver_healthy(
+            readiness.apiserver_healthz_url(master_server)
+        )
+
+    def check_hosts(self, hosts, timeout, concurrency):
+        """
+        Checks that ansible can reach the given hosts over ssh, and returns
+        a dictionary of the hosts that failed to the reason why
+        """
+        # Connections that are already open are used, but none are opened,
+        # since the checks would have to wait for them to close
+        ssh_options = ()
+        if self.ssh_control_dir is not None:
+            ssh_options = ssh_mux.ssh_options(self.ssh_control_dir, None, master="no")
+        return health.check_hosts(
+            hosts, timeout=timeout, concurrency=concurrency, ssh_options=ssh_options
+        )
+
+    def keep_warm(self, hosts, timeout, concurrency):
+        """
+        Opens, or keeps open, a shared ssh connection to every given host,
+        and returns a dictionary of the hosts that could not be reached to
+        the reason why
+        """
+        if self.ssh_control_dir is None:
+            return {}
+        return ssh_mux.keep_warm(
+            hosts, self.ssh_control_dir, self.ssh_persist, timeout, concurrency
+        )
+
+    def get_warm_hosts(self, hosts):
+        """
+        Returns the given hosts that have a shared ssh connection open
+        """
+        if self.ssh_control_dir is None:
+            return []
+        return ssh_mux.get_warm_hosts(hosts, self.ssh_control_dir)
+
+    def _checkout_worker(self):
+        """
+        Returns an idle worker, starting a new one if there is none, or
+        None if commands have to run as their own processes
+        """
+        with self._lock:
+            if self.backend != WORKER_BACKEND:
+                return None
+            if self._idle_workers:
+                return self._idle_workers.pop()
+
+        worker = _Worker(self.env, self.controller)
+        with self._lock:
+            self.processes_started += 1
+        if worker.start():
+            return worker
+
+        with self._lock:
+            if self.backend == WORKER_BACKEND:
+                self.backend = SUBPROCESS_BACKEND
+                click.echo(
+                    "Could not start an ansible worker, running ansible "
+                    "commands as separate processes instead",
+                    err=True,
+                )
+                for line in worker.log_tail:
+                    click.echo("  {}".format(line), err=True)
+        return None
+
+    def _checkin_worker(self, worker):
+        with self._lock:
+            if worker.is_alive():
+                self._idle_workers.append(worker)
+
+    def close(self):
+        """
+        Stops all idle workers
+        """
+        with self._lock:
+            workers, self._idle_workers = self._idle_workers, []
+        for worker in workers:
+            worker.stop()
+
+
+class _Worker:
+    """
+    A running ansible_worker process, started through the controller
+    command if there is one
+    """
+
+    def __init__(self, env, controller=()):
+        self.env = env
+        self.controller = list(controller)
+        self.process = None
+        self.log_tail = collections.deque(maxlen=20)
+
+    def start(self):
+        """
+        Starts the process, and returns whether it is ready for requests
+        """
+        self.process = subprocess.Popen(
+            self.controller + [sys.executable, "-u", WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=self.env,
+        )
+
+        for line in self.process.stdout:
+            line = line.decode(errors="replace").rstrip()
+            event = _parse_event(line)
+            if event is not None and event.get("event") == "worker_ready":
+                return True
+            if line:
+                self.log_tail.append(line)
+
+        self.process.wait()
+        return False
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def run(self, request):
+        """
+        Sends a request, and yields the lines of output it produces.
+        Returns the return code of the request.
+        """
+        finished = False
+        try:
+            self.process.stdin.write((json.dumps(request) + "\n").encode())
+            self.process.stdin.flush()
+
+            for line in self.process.stdout:
+                line = line.decode(errors="replace").rstrip()
+                event = _parse_event(line)
+                if event is not None and event.get("event") == "worker_exit":
+                    finished = True
+                    return event["returncode"]
+                yield line
+
+            return self.process.wait()
+        finally:
+            # A worker that stopped in the middle of a request, or that is
+            # abandoned by the caller, cannot be given another one.
+            if not finished and self.is_alive():
+                self.process.kill()
+                self.process.wait()
+
+    def stop(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class AnsibleRun:
+    """
+    A single ansible or ansible-playbook command, started by an
+    AnsibleExecutor. Iterating over it runs the command and yields every
+    event printed by the json_lines callback.
+    Once it is done, the attributes below describe the outcome:
+
+    returncode   - exit code of the ansible process
+    host_status  - "ok", "failed" or "unreachable" for every host that
+                   reported a result. A host is only "ok" if none of its
+                   tasks failed.
+    failures     - the runner events of every failed or unreachable task
+    task_timings - (task, host, seconds) for every task result
+    stats        - the per host summary printed at the end of a playbook
+    log_tail     - the last lines that were not json, such as errors
+                   printed by ansible itself
+
+    The results of the tasks named in capture are kept, and can be looked
+    up with results_for().
+    """
+
+    def __init__(self, executor, cmd, request, capture=(), echo_failures=True):
+        self.executor = executor
+        self.cmd = cmd
+        self.request = request
+        self.capture = set(capture)
+        self.echo_failures = echo_failures
+
+        self.returncode = None
+        self.host_status = {}
+        self.failures = []
+        self.task_timings = []
+        self.stats = None
+        self.span = None
+        self.log_tail = collections.deque(maxlen=20)
+        self._captured = collections.defaultdict(dict)
+
+    def __iter__(self):
+        if self.request["kind"] == "playbook":
+            span_name = "ansible-playbook {}".format(
+                os.path.basename(self.request["playbook"])
+            )
+        else:
+            span_name = "ansible {}".format(self.request["module"])
+        self.span = tracing.start_span(span_name, kind="ansible")
+
+        for line in self.executor.run_lines(self):
+            event = _parse_event(line)
+            if event is None:
+                if line:
+                    self.log_tail.append(line)
+                continue
+
+            self._record(event)
+            yield event
+
+        if self.returncode != 0 and not self.host_status and self.echo_failures:
+            click.echo(
+                "{} exited with code {}:".format(self.cmd[0], self.returncode),
+                err=True,
+            )
+            for line in self.log_tail:
+                click.echo("  {}".format(line), err=True)
+
+        self.span.attributes["returncode"] = self.returncode
+        self.span.finish()
+
+    def run(self):
+        """
+        Runs the command to completion, and returns this run
+        """
+        for _ in self:
+            pass
+        return self
+
+    def _record(self, event):
+        if event.get("event") == "stats":
+            self.stats = event["hosts"]
+            return
+
+        if event.get("event") != "runner":
+            return
+
+        host = event["host"]
+        status = event["status"]
+
+        if event.get("duration") is not None:
+            self.task_timings.append((event["task"], host, event["duration"]))
+            tracing.record_span(
+                event["task"],
+                event["time"] - event["duration"],
+                event["time"],
+                parent=self.span,
+                host=host,
+                status=status,
+            )
+
+        if event["task"] in self.capture:
+            self._captured[event["task"]][host] = event["result"]
+
+        if status in ("failed", "unreachable"):
+            self.host_status[host] = status
+            self.failures.append(event)
+            if self.echo_failures:
+                click.echo(
+                    "{} {} at '{}': {}".format(
+                        host, status, event["task"], _failure_message(event)
+                    ),
+                    err=True,
+                )
+        elif host not in self.host_status:
+            self.host_status[host] = "ok"
+
+    @property
+    def ok_hosts(self):
+        return [host for host, status in self.host_status.items() if status == "ok"]
+
+    @property
+    def failed_hosts(self):
+        return [host for host, status in self.host_status.items() if status != "ok"]
+
+    def results_for(self, task):
+        """
+        Returns a dictionary of host to result of a captured task
+        """
+        return dict(self._captured.get(task, {}))
+
+
+def _common_args(inventory_files, limit):
+    args = []
+    for inventory_file in inventory_files:
+        args += ["-i", inventory_file]
+    if limit is not None:
+        args += ["--limit", ",".join(limit)]
+    return args
+
+
+def _parse_event(line):
+    if not line.startswith("{"):
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def _failure_message(event):
+    result = event["result"]
+    message = result.get("msg") or result.get("stderr") or "no details"
+    return message.strip().splitlines()[-1] if message.strip() else message
+
+
+def parse_join_command(stdout):
+    """
+    Takes the output of `kubeadm token create --print-join-command`, and
+    returns the credentials workers need to join the cluster, as a
+    dictionary with the master endpoint, token and CA cert hash.
+    Returns None if the output does not contain a join command.
+    """
+    for line in stdout.splitlines():
+        words = line.split()
+        if words[:2] != ["kubeadm", "join"] or len(words) < 3:
+            continue
+
+        join_credentials = {"endpoint": words[2]}
+        for flag, key in (
+            ("--token", "token"),
+            ("--discovery-token-ca-cert-hash", "ca_cert_hash"),
+        ):
+            if flag in words and words.index(flag) + 1 < len(words):
+                join_credentials[key] = words[words.index(flag) + 1]
+
+        if "token" in join_credentials and "ca_cert_hash" in join_credentials:
+            return join_credentials
+
+    return None
+
+
+def json_lines_env(callback_plugins_dir):
+    """
+    Returns the environment for ansible to print its output with the
+    json_lines callback plugin
+    """
+    env = dict(os.environ)
+    env.update(
+        {
+            "ANSIBLE_CALLBACK_PLUGINS": callback_plugins_dir,
+            "ANSIBLE_STDOUT_CALLBACK": "json_lines",
+            "ANSIBLE_LOAD_CALLBACK_PLUGINS": "1",
+        }
+    )
+    return env
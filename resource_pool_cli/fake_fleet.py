@@ -0,0 +1,414 @@
+#!/usr/bin/python3
+
+"""
+A fake fleet of servers, that stands in for ansible and the servers it
+runs against, so that the cli can be run and measured without any real
+servers. It is selected with RP_ANSIBLE_BACKEND=fake.
+
+Every server has specs derived from its name, so they are the same every
+time it is probed. Playbooks are read to find their tasks, and every task
+succeeds on every host after RP_FAKE_LATENCY seconds, processed in batches
+of FORKS hosts, like ansible does. Hosts are unreachable for a run with a
+probability of RP_FAKE_FAILURE_RATE, and so are their health checks, and
+hosts marked down with mark_down() are unreachable until they are marked
+up again. With RP_FAKE_HANDSHAKE set, every run also takes that many
+seconds per batch of hosts it has no ssh connection open to, and leaves
+one open for as long as ssh would. The tasks named in RP_FAKE_FAILED_TASKS,
+separated by commas, fail on every host, which stops the rest of the
+playbook on them, like a failed task does in ansible. With
+RP_FAKE_FAILED_TASK_RUNS set, they only fail in that many of their first
+runs.
+
+The tasks that change the state of a cluster, like kubeadm init, join,
+drain and reset, are tracked in a json state file, so that the nodes of a
+cluster can be listed across cli invocations. Like the real one, kubeadm
+init fails on a server that was initialized and not reset since.
+"""
+
+import collections
+import hashlib
+import json
+import math
+import os
+import random
+import shutil
+import threading
+import time
+
+import yaml
+
+import executor
+import ssh_mux
+
+LATENCY = float(os.environ.get("RP_FAKE_LATENCY", 0))
+HANDSHAKE = float(os.environ.get("RP_FAKE_HANDSHAKE", 0))
+FAILURE_RATE = float(os.environ.get("RP_FAKE_FAILURE_RATE", 0))
+SEED = os.environ.get("RP_FAKE_SEED")
+FAILED_TASKS = set(filter(None, os.environ.get("RP_FAKE_FAILED_TASKS", "").split(",")))
+FAILED_TASK_RUNS = int(os.environ.get("RP_FAKE_FAILED_TASK_RUNS", 0))
+
+# Ansible's default number of hosts it works on at once
+FORKS = 5
+
+# The tasks that change the state of the clusters
+STATE_TASKS = {"kubeadm init", "kubeadm join", "drain nodes", "kubeadm reset"}
+
+
+class _TaskFailed(Exception):
+    pass
+
+
+def get_fake_server_specs(server):
+    """
+    Returns the capacity probe results of a fake server
+    """
+    digest = int(hashlib.md5(server.encode()).hexdigest(), 16)
+    sockets = (1, 2)[digest % 2]
+    cores_per_socket = (4, 8, 12, 16)[digest // 2 % 4]
+    mem_gb = (16, 32, 64, 128, 256)[digest // 8 % 5]
+    return {
+        "sockets": sockets,
+        "cores_per_socket": cores_per_socket,
+        "vcpus": sockets * cores_per_socket * 2,
+        "mem_kb": mem_gb * 1024 * 1024,
+    }
+
+
+def get_fake_server_names(count):
+    return [
+        "10.{}.{}.{}".format(index // 62500, index // 250 % 250, index % 250 + 1)
+        for index in range(count)
+    ]
+
+
+def write_ansible_dir(ansible_dir, source_ansible_dir, host_count):
+    """
+    Sets up an ANSIBLE_DIR for a fake fleet of host_count servers, with the
+    playbooks, pool template and callback plugins of source_ansible_dir
+    """
+    for name in ("playbooks", "pool_template", "callback_plugins"):
+        shutil.copytree(
+            os.path.join(source_ansible_dir, name),
+            os.path.join(ansible_dir, name),
+            ignore=shutil.ignore_patterns("__pycache__"),
+        )
+
+    fleet_dir = os.path.join(ansible_dir, "pools", "fleet")
+    os.makedirs(fleet_dir)
+    hosts_yaml = {
+        "all": {"hosts": {server: None for server in get_fake_server_names(host_count)}}
+    }
+    with open(os.path.join(fleet_dir, "hosts.yml"), "w") as f:
+        yaml.dump(hosts_yaml, f)
+
+
+def mark_down(state_file, servers, down=True):
+    """
+    Marks servers of a fake fleet as down, so that they stop answering, or
+    as up again
+    """
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        state = {"clusters": {}}
+
+    down_servers = set(state.get("down", []))
+    if down:
+        down_servers.update(servers)
+    else:
+        down_servers.difference_update(servers)
+    state["down"] = sorted(down_servers)
+
+    with open("{}.tmp".format(state_file), "w") as f:
+        json.dump(state, f)
+    os.replace("{}.tmp".format(state_file), state_file)
+
+
+_state_locks = {}
+_state_locks_lock = threading.Lock()
+
+
+def _get_state_lock(state_file):
+    # The executors of every site share the state file of the fleet
+    with _state_locks_lock:
+        return _state_locks.setdefault(state_file, threading.Lock())
+
+
+def _node_name(server):
+    return "ip-{}".format(server.replace(".", "-"))
+
+
+def _read_hosts(inventory_files, limit):
+    hosts = []
+    for inventory_file in inventory_files:
+        try:
+            with open(inventory_file) as stream:
+                hosts_yaml = yaml.safe_load(stream) or {}
+        except IOError:
+            continue
+        for host in (hosts_yaml.get("all") or {}).get("hosts") or {}:
+            if host not in hosts:
+                hosts.append(host)
+
+    if limit is not None:
+        limit = set(limit)
+        hosts = [host for host in hosts if host in limit]
+    return hosts
+
+
+def _read_tasks(playbook_file):
+    with open(playbook_file) as stream:
+        plays = yaml.safe_load(stream) or []
+
+    tasks = []
+    for play in plays:
+        for task in play.get("tasks") or []:
+            name = task.get("name") or next(iter(task))
+            tasks.append((name, task))
+    return tasks
+
+
+class FakeFleetExecutor(executor.AnsibleExecutor):
+    def __init__(self, callback_plugins_dir, state_file, ssh_persist="60"):
+        super().__init__(callback_plugins_dir, backend="fake", ssh_persist=ssh_persist)
+        self.state_file = state_file
+        self._state_lock = _get_state_lock(state_file)
+        self._random = random.Random(SEED)
+        self._failed_task_runs = collections.Counter()
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {"clusters": {}}
+
+    def _save_state(self, state):
+        with open("{}.tmp".format(self.state_file), "w") as f:
+            json.dump(state, f)
+        os.replace("{}.tmp".format(self.state_file), self.state_file)
+
+    def is_apiserver_healthy(self, master_server):
+        with self._state_lock:
+            return master_server in self._load_state()["clusters"]
+
+    def check_hosts(self, hosts, timeout, concurrency):
+        with self._state_lock:
+            down = set(self._load_state().get("down", []))
+            return {
+                host: "port 22 timed out"
+                for host in hosts
+                if host in down or self._random.random() < FAILURE_RATE
+            }
+
+    def keep_warm(self, hosts, timeout, concurrency):
+        failed = self.check_hosts(hosts, timeout, concurrency)
+        with self._state_lock:
+            state = self._load_state()
+            self._mark_warm(state, [host for host in hosts if host not in failed])
+            self._save_state(state)
+        return failed
+
+    def get_warm_hosts(self, hosts):
+        with self._state_lock:
+            warm = self._load_state().get("warm", {})
+        now = time.time()
+        return [host for host in hosts if warm.get(host, 0) > now]
+
+    def _mark_warm(self, state, hosts):
+        expires_at = time.time() + ssh_mux.parse_time(self.ssh_persist)
+        warm = state.setdefault("warm", {})
+        for host in hosts:
+            warm[host] = expires_at
+
+    def run_lines(self, run):
+        with self._lock:
+            self.runs_started += 1
+
+        request = run.request
+        hosts = _read_hosts(request["inventory"], request.get("limit"))
+
+        if request["kind"] == "playbook":
+            if not os.path.exists(request["playbook"]):
+                yield "ERROR! the playbook: {} could not be found".format(
+                    request["playbook"]
+                )
+                run.returncode = 1
+                return
+            tasks = _read_tasks(request["playbook"])
+        else:
+            tasks = [
+                (
+                    request["module"],
+                    {request["module"]: request["args"], "_adhoc": True},
+                )
+            ]
+
+        with self._state_lock:
+            unreachable = {
+                host for host in hosts if self._random.random() < FAILURE_RATE
+            }
+            unreachable.update(self._load_state().get("down", []))
+
+        # Connecting to the hosts that have no connection open yet
+        if HANDSHAKE:
+            warm = set(self.get_warm_hosts(hosts))
+            cold = [host for host in hosts if host not in warm | unreachable]
+            time.sleep(HANDSHAKE * math.ceil(len(cold) / float(FORKS)))
+            with self._state_lock:
+                state = self._load_state()
+                self._mark_warm(state, cold)
+                self._save_state(state)
+        stats = {
+            host: {"ok": 0, "failures": 0, "unreachable": 0, "changed": 0, "skipped": 0}
+            for host in hosts
+        }
+
+        for task_name, task in tasks:
+            active = [
+                host
+                for host in hosts
+                if not stats[host]["unreachable"] and not stats[host]["failures"]
+            ]
+            if not active:
+                break
+
+            yield json.dumps(
+                {"event": "task_start", "task": task_name, "time": time.time()}
+            )
+            time.sleep(LATENCY * math.ceil(len(active) / float(FORKS)))
+
+            with self._state_lock:
+                state = self._load_state()
+                fails = self._task_fails(task_name)
+                results = {}
+                for host in active:
+                    if host in unreachable:
+                        continue
+                    try:
+                        if fails:
+                            raise _TaskFailed("{} failed".format(task_name))
+                        results[host] = "ok", self._run_task(
+                            state["clusters"], task_name, task, host, request
+                        )
+                    except _TaskFailed as exc:
+                        results[host] = "failed", {"msg": str(exc), "rc": 1}
+                if task_name in STATE_TASKS:
+                    self._save_state(state)
+
+            for host in active:
+                if host in unreachable:
+                    status = "unreachable"
+                    result = {"msg": "Failed to connect to the host via ssh"}
+                    stats[host]["unreachable"] += 1
+                else:
+                    status, result = results[host]
+                    stats[host]["ok" if status == "ok" else "failures"] += 1
+
+                yield json.dumps(
+                    {
+                        "event": "runner",
+                        "status": status,
+                        "host": host,
+                        "task": task_name,
+                        "duration": LATENCY,
+                        "result": result,
+                        "time": time.time(),
+                    }
+                )
+
+        if request["kind"] == "playbook":
+            yield json.dumps({"event": "stats", "hosts": stats, "time": time.time()})
+
+        if unreachable.intersection(hosts):
+            run.returncode = 4
+        elif any(stats[host]["failures"] for host in hosts):
+            run.returncode = 2
+        else:
+            run.returncode = 0
+
+    def _task_fails(self, task_name):
+        """
+        Returns whether a run of the given task fails, counting the run
+        """
+        if task_name not in FAILED_TASKS:
+            return False
+        self._failed_task_runs[task_name] += 1
+        return (
+            not FAILED_TASK_RUNS
+            or self._failed_task_runs[task_name] <= FAILED_TASK_RUNS
+        )
+
+    def _run_task(self, clusters, task_name, task, host, request):
+        """
+        Applies what a task would do on a host to the clusters, and returns
+        its result
+        """
+        result = {"changed": True, "stdout": ""}
+
+        if "_adhoc" in task:
+            args = task[task_name]
+            if "/proc/cpuinfo" in args:
+                result["stdout"] = json.dumps(get_fake_server_specs(host))
+            elif "kubectl get nodes" in args:
+                result["stdout"] = self._get_nodes_json(clusters.get(host))
+        elif task_name == "kubeadm init":
+            if host in clusters:
+                raise _TaskFailed(
+                    "[ERROR Port-6443]: Port 6443 is in use, "
+                    "[ERROR FileAvailable--etc-kubernetes-manifests-kube-apiserver.yaml]"
+                )
+            clusters[host] = [host]
+        elif task_name == "join token creation":
+            result["stdout"] = (
+                "kubeadm join {}:6443 --token abcdef.0123456789abcdef "
+                "--discovery-token-ca-cert-hash sha256:{}".format(
+                    host, hashlib.sha256(host.encode()).hexdigest()
+                )
+            )
+        elif task_name == "kubeadm join":
+            master = task["shell"].split()[2].split(":")[0]
+            if host not in clusters.setdefault(master, [master]):
+                clusters[master].append(host)
+        elif task_name == "drain nodes":
+            result["stdout_lines"] = self._drain(
+                clusters.get(host, []), request["extra_vars"]["nodes"]
+            )
+        elif task_name == "kubeadm reset":
+            clusters.pop(host, None)
+            for nodes in clusters.values():
+                if host in nodes:
+                    nodes.remove(host)
+
+        if "stdout_lines" not in result:
+            result["stdout_lines"] = result["stdout"].splitlines()
+        return result
+
+    def _drain(self, cluster_nodes, nodes):
+        lines = []
+        for node_name in nodes.split(","):
+            server = next(
+                (node for node in cluster_nodes if _node_name(node) == node_name), None
+            )
+            if server is None or self._random.random() < FAILURE_RATE:
+                lines.append("FAILED {}".format(node_name))
+            else:
+                cluster_nodes.remove(server)
+                lines.append("DRAINED {}".format(node_name))
+        return lines
+
+    def _get_nodes_json(self, cluster_nodes):
+        if cluster_nodes is None:
+            return ""
+        return json.dumps(
+            {
+                "items": [
+                    {
+                        "metadata": {"name": _node_name(node)},
+                        "status": {"conditions": [{"type": "Ready", "status": "True"}]},
+                    }
+                    for node in cluster_nodes
+                ]
+            }
+        )
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+"""
+Health checks that run right before placement, so that servers which would
+fail halfway through provisioning are never picked. Every server is checked
+for an ssh banner on its ssh port, and then for a working login with the
+keys ansible uses.
+
+The checks run on an asyncio event loop, so thousands of servers are
+checked at once, each one bounded by a timeout, and the whole check takes
+about as long as the slowest server. The ssh logins run on a pool of
+threads rather than as asyncio subprocesses, which need a child watcher
+attached to the loop, and can only have one outside of the main thread
+from Python 3.8 on.
+"""
+
+import asyncio
+import concurrent.futures
+import subprocess
+
+SSH_PORT = 22
+
+# Never prompt for anything, and do not fail on servers that were never
+# connected to before, like ansible is set up to do
+SSH_CMD = [
+    "ssh",
+    "-o",
+    "BatchMode=yes",
+    "-o",
+    "StrictHostKeyChecking=no",
+    "-o",
+    "UserKnownHostsFile=/dev/null",
+    "-o",
+    "LogLevel=ERROR",
+]
+
+
+async def _check_port(host, port, timeout):
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port), timeout
+    )
+    try:
+        banner = await asyncio.wait_for(reader.readline(), timeout)
+    finally:
+        writer.close()
+
+    if not banner.startswith(b"SSH-"):
+        return "port {} did not answer with an ssh banner".format(port)
+    return None
+
+
+def run_ssh(cmd, timeout, read_errors=True):
+    """
+    Runs an ssh command, and returns the reason it failed, or None if it
+    did not. With read_errors, the reason is the last line ssh printed;
+    without, ssh may leave a master connection running in the background,
+    which must not hold on to any pipe of this process.
+    """
+    try:
+        process = subprocess.run(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE if read_errors else subprocess.DEVNULL,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return "ssh timed out"
+    except OSError as exc:
+        return "ssh could not be run: {}".format(exc.strerror or exc)
+
+    if process.returncode != 0:
+        lines = (process.stderr or b"").decode(errors="replace").strip().splitlines()
+        return (
+            lines[-1] if lines else "ssh exited with code {}".format(process.returncode)
+        )
+    return None
+
+
+def _check_auth(host, timeout, ssh_options):
+    cmd = SSH_CMD + list(ssh_options)
+    cmd += ["-o", "ConnectTimeout={}".format(int(max(timeout, 1))), host, "true"]
+    return run_ssh(cmd, timeout)
+
+
+async def _check_host(host, semaphore, threads, port, timeout, check_auth, ssh_options):
+    async with semaphore:
+        try:
+            reason = await _check_port(host, port, timeout)
+        except asyncio.TimeoutError:
+            return host, "port {} timed out".format(port)
+        except OSError as exc:
+            return host, "port {}: {}".format(port, exc.strerror or exc)
+        except Exception as exc:
+            return host, "port {} could not be checked: {}".format(port, exc)
+
+        if reason is None and check_auth:
+            try:
+                reason = await asyncio.get_event_loop().run_in_executor(
+                    threads, _check_auth, host, timeout, ssh_options
+                )
+            except Exception as exc:
+                reason = "ssh login could not be checked: {}".format(exc)
+        return host, reason
+
+
+async def _check_hosts(
+    hosts, threads, port, timeout, concurrency, check_auth, ssh_options
+):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *[
+            _check_host(
+                host, semaphore, threads, port, timeout, check_auth, ssh_options
+            )
+            for host in hosts
+        ]
+    )
+
+
+def check_hosts(
+    hosts,
+    port=SSH_PORT,
+    timeout=5.0,
+    concurrency=200,
+    check_auth=True,
+    ssh_options=(),
+):
+    """
+    Checks the given hosts all at once, up to concurrency at a time, and
+    returns a dictionary of the hosts that failed to the reason why.
+    ssh_options are added to the ssh command of the login check.
+    """
+    if not hosts:
+        return {}
+
+    # A loop of its own, since this can be called from any thread
+    loop = asyncio.new_event_loop()
+    threads = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        results = loop.run_until_complete(
+            _check_hosts(
+                hosts, threads, port, timeout, concurrency, check_auth, ssh_options
+            )
+        )
+    finally:
+        loop.close()
+        threads.shutdown()
+
+    return {host: reason for host, reason in results if reason is not None}
@@ -0,0 +1,672 @@
+#!/usr/bin/python3
+
+"""
+SQLite backed inventory of which servers belong to which pool, along with
+their cached capacity probe results.
+
+This is the source of truth for pool membership. The ansible hosts yaml
+files are only generated from it when a playbook or ansible command needs
+them, and every move of servers between pools is a single transaction.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import yaml
+
+FLEET = "fleet"
+
+# Roles match the names of the ansible inventory files of a pool
+FLEET_ROLE = "hosts"
+MASTERS_ROLE = "masters"
+WORKERS_ROLE = "workers"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pools (
+    name TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL DEFAULT 0,
+    rendered_generation INTEGER NOT NULL DEFAULT -1
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    pool TEXT NOT NULL REFERENCES pools(name),
+    role TEXT NOT NULL,
+    listed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS hosts_by_pool ON hosts (pool, role);
+CREATE TABLE IF NOT EXISTS specs (
+    host TEXT PRIMARY KEY,
+    probe TEXT NOT NULL,
+    gathered_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS prewarmed (
+    host TEXT PRIMARY KEY,
+    k8s_version TEXT NOT NULL,
+    prewarmed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS desired_capacity (
+    pool TEXT PRIMARY KEY REFERENCES pools(name),
+    cores INTEGER,
+    mem INTEGER,
+    drift_since REAL
+);
+CREATE TABLE IF NOT EXISTS pool_sites (
+    pool TEXT PRIMARY KEY REFERENCES pools(name),
+    site TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS host_checks (
+    host TEXT PRIMARY KEY,
+    failures INTEGER NOT NULL DEFAULT 0,
+    checked_at REAL NOT NULL,
+    reason TEXT
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    host TEXT PRIMARY KEY,
+    pool TEXT NOT NULL,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reservations_by_token ON reservations (token);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# SQLite limits the number of parameters in a single statement
+MAX_PARAMS = 500
+
+
+def _chunks(items, size=MAX_PARAMS):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class InventoryError(Exception):
+    pass
+
+
+class InventoryStore:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self):
+        """
+        The connection of the calling thread. Phases run on threads of their
+        own, and sqlite connections cannot be shared between threads.
+        """
+        if not hasattr(self._local, "connection"):
+            # Transactions are managed explicitly with transaction()
+            self._local.connection = sqlite3.connect(
+                self.db_file, timeout=30, isolation_level=None
+            )
+        return self._local.connection
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the enclosed statements as one transaction, which either
+        fully commits or is fully rolled back.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, db, key, value):
+        db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def _bump_generation(self, db, rp_names):
+        db.executemany(
+            "UPDATE pools SET generation = generation + 1 WHERE name = ?",
+            [(rp_name,) for rp_name in rp_names],
+        )
+
+    def is_empty(self):
+        return self.get_meta("imported") is None
+
+    # Pools
+
+    def pool_exists(self, rp_name):
+        row = self.connection.execute(
+            "SELECT 1 FROM pools WHERE name = ?", (rp_name,)
+        ).fetchone()
+        return row is not None
+
+    def get_pool_names(self):
+        """
+        Returns all pool names, with the fleet first
+        """
+        rows = self.connection.execute(
+            "SELECT name FROM pools ORDER BY name != ?, name", (FLEET,)
+        )
+        return [row[0] for row in rows]
+
+    def create_pool(
+        self,
+        rp_name,
+        masters_list,
+        workers_list,
+        cores=None,
+        mem=None,
+        token=None,
+        site=None,
+    ):
+        """
+        Creates a pool, and moves its masters and workers out of the fleet.
+        The requested cores and memory are kept as the desired capacity of
+        the pool, and the site it is constrained to, if any, is kept too.
+        """
+        with self.transaction() as db:
+            db.execute("INSERT INTO pools (name) VALUES (?)", (rp_name,))
+            self._move(db, masters_list, FLEET, rp_name, MASTERS_ROLE, token)
+            self._move(db, workers_list, FLEET, rp_name, WORKERS_ROLE, token)
+            db.execute(
+                "INSERT INTO desired_capacity (pool, cores, mem) VALUES (?, ?, ?)",
+                (rp_name, cores, mem),
+            )
+            if site is not None:
+                db.execute(
+                    "INSERT INTO pool_sites (pool, site) VALUES (?, ?)",
+                    (rp_name, site),
+                )
+
+    def delete_pool(self, rp_name):
+        """
+        Moves every server of a pool back into the fleet and removes the
+        pool, returning the servers that were moved
+        """
+        return self.delete_pools([rp_name])[rp_name]
+
+    def delete_pools(self, rp_names):
+        """
+        Moves every server of the given pools back into the fleet and
+        removes the pools, as a single transaction. Returns a dictionary of
+        pool to the servers that were moved.
+        """
+        moved = {}
+        with self.transaction() as db:
+            for rp_name in rp_names:
+                servers = [
+                    row[0]
+                    for row in db.execute(
+                        "SELECT host FROM hosts WHERE pool = ?", (rp_name,)
+                    )
+                ]
+                self._move(db, servers, rp_name, FLEET, FLEET_ROLE)
+                db.execute("DELETE FROM desired_capacity WHERE pool = ?", (rp_name,))
+                db.execute("DELETE FROM pool_sites WHERE pool = ?", (rp_name,))
+                db.execute("DELETE FROM pools WHERE name = ?", (rp_name,))
+                moved[rp_name] = servers
+        return moved
+
+    def get_pool_sites(self):
+        """
+        Returns a dictionary of pool name to the site it is constrained to,
+        for every pool that is
+        """
+        return dict(self.connection.execute("SELECT pool, site FROM pool_sites"))
+
+    # Desired capacity
+
+    def get_desired_capacities(self):
+        """
+        Returns a dictionary of pool name to its desired capacity, for every
+        pool that has one. The capacity is a dictionary with the desired
+        cores and memory, either of which is None if it was never requested,
+        and when the pool was first seen below it, or None if it is not.
+        """
+        rows = self.connection.execute(
+            "SELECT pool, cores, mem, drift_since FROM desired_capacity ORDER BY pool"
+        )
+        return {
+            rp_name: {"cores": cores, "mem": mem, "drift_since": drift_since}
+            for rp_name, cores, mem, drift_since in rows
+        }
+
+    def set_desired_capacity(self, rp_name, cores=None, mem=None):
+        """
+        Sets the desired cores and memory of a pool. A resource given as
+        None keeps its current desired amount.
+        """
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT cores, mem FROM desired_capacity WHERE pool = ?", (rp_name,)
+            ).fetchone()
+            if row is not None:
+                cores = cores if cores is not None else row[0]
+                mem = mem if mem is not None else row[1]
+            db.execute(
+                "INSERT OR REPLACE INTO desired_capacity (pool, cores, mem) VALUES (?, ?, ?)",
+                (rp_name, cores, mem),
+            )
+
+    def set_drift_since(self, rp_name, drift_since):
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE desired_capacity SET drift_since = ? WHERE pool = ?",
+                (drift_since, rp_name),
+            )
+
+    # Servers
+
+    def get_servers(self, rp_name, role=None):
+        if role is None:
+            rows = self.connection.execute(
+                "SELECT host FROM hosts WHERE pool = ? ORDER BY host", (rp_name,)
+            )
+        else:
+            rows = self.connection.execute(
+                "SELECT host FROM hosts WHERE pool = ? AND role = ? ORDER BY host",
+                (rp_name, role),
+            )
+        return [row[0] for row in rows]
+
+    def get_server_pools(self, servers):
+        """
+        Returns a dictionary of server to the pool it is in, for the given
+        servers that are in the inventory
+        """
+        server_pools = {}
+        for chunk in _chunks(servers):
+            rows = self.connection.execute(
+                "SELECT host, pool FROM hosts WHERE host IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                chunk,
+            )
+            server_pools.update(rows)
+        return server_pools
+
+    def transfer_servers(
+        self, servers_list, from_rp_name, to_rp_name, to_role, token=None
+    ):
+        with self.transaction() as db:
+            self._move(db, servers_list, from_rp_name, to_rp_name, to_role, token)
+
+    def _move(self, db, servers_list, from_rp_name, to_rp_name, to_role, token=None):
+        """
+        Moves servers between pools. Servers that another operation reserved
+        cannot be moved, and the reservations of the moved servers are done
+        with, since the servers are where they were reserved for.
+        """
+        reserved = self._get_reserved(db, servers_list, token)
+        if reserved:
+            raise InventoryError(
+                "These servers are reserved by another operation: {}".format(
+                    ", ".join(sorted(reserved))
+                )
+            )
+
+        for chunk in _chunks(servers_list):
+            moved = db.execute(
+                "UPDATE hosts SET pool = ?, role = ? WHERE pool = ? AND host IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                [to_rp_name, to_role, from_rp_name] + chunk,
+            ).rowcount
+            if moved != len(chunk):
+                raise InventoryError(
+                    "Not all of the given servers are in the {} pool".format(
+                        from_rp_name
+                    )
+                )
+
+            # A server changing pools is a good moment to re-check its
+            # hardware, so the next get_specs() call probes it again.
+            db.execute(
+                "DELETE FROM specs WHERE host IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                chunk,
+            )
+            db.execute(
+                "DELETE FROM reservations WHERE host IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                chunk,
+            )
+
+        self._bump_generation(db, [from_rp_name, to_rp_name])
+
+    # Reservations
+
+    def _get_reserved(self, db, servers, token=None):
+        """
+        Returns the given servers that are reserved, other than by token
+        """
+        reserved = set()
+        now = time.time()
+        for chunk in _chunks(servers):
+            rows = db.execute(
+                "SELECT host FROM reservations WHERE expires_at > ? AND token != ? AND host IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                [now, token or ""] + chunk,
+            )
+            reserved.update(row[0] for row in rows)
+        return reserved
+
+    def get_reserved(self, servers, token=None):
+        return self._get_reserved(self.connection, servers, token)
+
+    def reserve(self, servers, rp_name, token, ttl):
+        """
+        Reserves servers for a pool for ttl seconds, or until they are
+        moved. Raises InventoryError if another operation reserved any of
+        them first.
+        """
+        with self.transaction() as db:
+            reserved = self._get_reserved(db, servers, token)
+            if reserved:
+                raise InventoryError(
+                    "These servers are reserved by another operation: {}".format(
+                        ", ".join(sorted(reserved))
+                    )
+                )
+
+            expires_at = time.time() + ttl
+            db.executemany(
+                "INSERT OR REPLACE INTO reservations (host, pool, token, expires_at) VALUES (?, ?, ?, ?)",
+                [(server, rp_name, token, expires_at) for server in servers],
+            )
+
+    def release_reservations(self, token):
+        """
+        Drops the reservations held by token, along with every reservation
+        that expired
+        """
+        with self.transaction() as db:
+            db.execute(
+                "DELETE FROM reservations WHERE token = ? OR expires_at <= ?",
+                (token, time.time()),
+            )
+
+    # Cached specs
+
+    def get_cached_probes(self, servers, max_age):
+        """
+        Returns the cached probe results of the given servers that were
+        gathered less than max_age seconds ago, or at any time if max_age
+        is None
+        """
+        oldest = time.time() - max_age if max_age is not None else 0
+        probes = {}
+        for chunk in _chunks(servers):
+            rows = self.connection.execute(
+                "SELECT host, probe FROM specs WHERE gathered_at >= ? AND host IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                [oldest] + chunk,
+            )
+            for server, probe in rows:
+                probes[server] = json.loads(probe)
+        return probes
+
+    def get_host_checks(self, servers):
+        """
+        Returns a dictionary of server to the outcome of its latest
+        reachability check, for the given servers that were ever checked.
+        failures is how many checks in a row the server has failed.
+        """
+        checks = {}
+        for chunk in _chunks(servers):
+            rows = self.connection.execute(
+                "SELECT host, failures, checked_at, reason FROM host_checks WHERE host IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                chunk,
+            )
+            for server, failures, checked_at, reason in rows:
+                checks[server] = {
+                    "failures": failures,
+                    "checked_at": checked_at,
+                    "reason": reason,
+                }
+        return checks
+
+    def record_checks(self, reachable, unreachable):
+        """
+        Records the outcome of checking servers. reachable is the servers
+        that answered, and unreachable is a dictionary of the servers that
+        did not to the reason why.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO host_checks (host, failures, checked_at) VALUES (?, 0, ?)",
+                [(server, now) for server in reachable],
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO host_checks (host, failures, checked_at) VALUES (?, 0, ?)",
+                [(server, now) for server in unreachable],
+            )
+            db.executemany(
+                "UPDATE host_checks SET failures = failures + 1, checked_at = ?, reason = ? WHERE host = ?",
+                [(now, reason, server) for server, reason in unreachable.items()],
+            )
+
+    def get_failing_hosts(self):
+        """
+        Returns the outcome of the latest check of every server whose
+        latest check failed, like get_host_checks() does
+        """
+        rows = self.connection.execute(
+            "SELECT host, failures, checked_at, reason FROM host_checks WHERE failures > 0 ORDER BY host"
+        )
+        return {
+            server: {"failures": failures, "checked_at": checked_at, "reason": reason}
+            for server, failures, checked_at, reason in rows
+        }
+
+    def clear_checks(self, servers):
+        """
+        Forgets the checks of the given servers, so that they are checked
+        again before they are next used
+        """
+        with self.transaction() as db:
+            db.executemany(
+                "DELETE FROM host_checks WHERE host = ?",
+                [(server,) for server in servers],
+            )
+
+    def save_probes(self, probes):
+        now = time.time()
+        with self.transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO specs (host, probe, gathered_at) VALUES (?, ?, ?)",
+                [(server, json.dumps(probe), now) for server, probe in probes.items()],
+            )
+
+    # Prewarmed servers
+
+    def get_prewarmed(self, servers, k8s_version):
+        """
+        Returns the given servers that already have the given version of
+        kubernetes installed
+        """
+        prewarmed = []
+        for chunk in _chunks(servers):
+            rows = self.connection.execute(
+                "SELECT host FROM prewarmed WHERE k8s_version = ? AND host IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                [k8s_version] + chunk,
+            )
+            prewarmed += [row[0] for row in rows]
+        return prewarmed
+
+    def mark_prewarmed(self, servers, k8s_version):
+        now = time.time()
+        with self.transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO prewarmed (host, k8s_version, prewarmed_at) VALUES (?, ?, ?)",
+                [(server, k8s_version, now) for server in servers],
+            )
+
+    # Ansible inventory files
+
+    def render_inventory(self, rp_name, pool_dir):
+        """
+        Writes the ansible hosts yaml files of a pool, but only if the pool
+        changed since they were last written
+        """
+        row = self.connection.execute(
+            "SELECT generation, rendered_generation FROM pools WHERE name = ?",
+            (rp_name,),
+        ).fetchone()
+        if row is None:
+            raise InventoryError("There is no resource pool named {}".format(rp_name))
+
+        generation, rendered_generation = row
+        if generation == rendered_generation and os.path.isdir(pool_dir):
+            return
+
+        roles = [FLEET_ROLE] if rp_name == FLEET else [MASTERS_ROLE, WORKERS_ROLE]
+        for role in roles:
+            yaml_file = "{}/{}.yml".format(pool_dir, role)
+            servers = self.get_servers(rp_name, role)
+            hosts_yaml = {"all": {"hosts": {server: None for server in servers}}}
+
+            with open("{}.tmp".format(yaml_file), "w") as f:
+                yaml.dump(hosts_yaml, f)
+            os.replace("{}.tmp".format(yaml_file), yaml_file)
+
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE pools SET rendered_generation = ? WHERE name = ?",
+                (generation, rp_name),
+            )
+            if rp_name == FLEET:
+                db.execute("UPDATE hosts SET listed = (pool = ?)", (FLEET,))
+                self._set_meta(
+                    db,
+                    "fleet_file_mtime",
+                    str(os.stat("{}/{}.yml".format(pool_dir, FLEET_ROLE)).st_mtime),
+                )
+
+    def sync_fleet_file(self, fleet_yaml_file):
+        """
+        Servers are added to (or removed from) the fleet by editing its hosts
+        yaml file by hand. When that file was changed since it was last
+        rendered, new servers in it join the fleet, and fleet servers that
+        were listed in it but have since been deleted leave the inventory.
+        Servers that are in other pools are never touched.
+        """
+        try:
+            mtime = str(os.stat(fleet_yaml_file).st_mtime)
+        except FileNotFoundError:
+            return
+
+        if mtime == self.get_meta("fleet_file_mtime"):
+            return
+
+        file_servers = set(_read_hosts_yaml_file(fleet_yaml_file))
+
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO pools (name) VALUES (?)", (FLEET,))
+
+            known_servers = set(self.get_server_pools(file_servers))
+            db.executemany(
+                "INSERT INTO hosts (host, pool, role, listed) VALUES (?, ?, ?, 1)",
+                [
+                    (server, FLEET, FLEET_ROLE)
+                    for server in sorted(file_servers - known_servers)
+                ],
+            )
+
+            listed_servers = [
+                row[0]
+                for row in db.execute(
+                    "SELECT host FROM hosts WHERE pool = ? AND listed = 1", (FLEET,)
+                )
+            ]
+            db.executemany(
+                "DELETE FROM hosts WHERE host = ?",
+                [(server,) for server in listed_servers if server not in file_servers],
+            )
+
+            self._bump_generation(db, [FLEET])
+            self._set_meta(db, "fleet_file_mtime", mtime)
+
+    def import_yaml_inventory(self, pools_dir):
+        """
+        One time import of an inventory that was kept in hosts yaml files,
+        before this database existed
+        """
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO pools (name) VALUES (?)", (FLEET,))
+            for rp_name in sorted(os.listdir(pools_dir)):
+                pool_dir = "{}/{}".format(pools_dir, rp_name)
+                if rp_name.startswith(".") or not os.path.isdir(pool_dir):
+                    continue
+
+                db.execute("INSERT OR IGNORE INTO pools (name) VALUES (?)", (rp_name,))
+                roles = (
+                    [FLEET_ROLE] if rp_name == FLEET else [MASTERS_ROLE, WORKERS_ROLE]
+                )
+                for role in roles:
+                    yaml_file = "{}/{}.yml".format(pool_dir, role)
+                    db.executemany(
+                        "INSERT OR REPLACE INTO hosts (host, pool, role, listed) VALUES (?, ?, ?, ?)",
+                        [
+                            (server, rp_name, role, int(rp_name == FLEET))
+                            for server in _read_hosts_yaml_file(yaml_file)
+                        ],
+                    )
+
+            if os.path.exists("{}/{}/{}.yml".format(pools_dir, FLEET, FLEET_ROLE)):
+                self._set_meta(
+                    db,
+                    "fleet_file_mtime",
+                    str(
+                        os.stat(
+                            "{}/{}/{}.yml".format(pools_dir, FLEET, FLEET_ROLE)
+                        ).st_mtime
+                    ),
+                )
+            self._set_meta(db, "imported", str(time.time()))
+
+
+def read_hosts_yaml_files(yaml_files):
+    """
+    Returns the servers listed in the given ansible hosts yaml files, in the
+    order they are listed
+    """
+    servers = {}
+    for yaml_file in yaml_files:
+        servers.update(dict.fromkeys(_read_hosts_yaml_file(yaml_file)))
+    return list(servers)
+
+
+def _read_hosts_yaml_file(yaml_file):
+    """
+    Returns the servers listed in an ansible hosts yaml file
+    """
+    try:
+        with open(yaml_file, "r") as stream:
+            hosts_yaml = yaml.safe_load(stream) or {}
+    except FileNotFoundError:
+        return []
+
+    return list((hosts_yaml.get("all") or {}).get("hosts") or {})
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+"""
+The phase journal of an operation on a pool, such as create or resize.
+
+It is kept as json in the pool directory, and records what the operation
+was asked to do, every phase it finished along with what the phase
+returned, such as the join credentials of the master, and the status of
+every host it worked on. It is written as soon as anything changes, so
+that an operation that failed partway through can be resumed from where
+it stopped, without repeating the phases and hosts that were done.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class Journal:
+    def __init__(self, journal_file, state):
+        self.journal_file = journal_file
+        self.state = state
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, journal_file, rp_name, operation, args):
+        """
+        Starts the journal of a new operation on a pool, replacing the
+        journal of the previous one
+        """
+        journal = cls(
+            journal_file,
+            {
+                "pool": rp_name,
+                "operation": operation,
+                "args": args,
+                "started": time.time(),
+                "finished": None,
+                "phases": {},
+                "hosts": {},
+            },
+        )
+        journal._save()
+        return journal
+
+    @classmethod
+    def load(cls, journal_file):
+        """
+        Returns the journal in the given file, or None if there is none
+        """
+        try:
+            with open(journal_file) as f:
+                return cls(journal_file, json.load(f))
+        except (IOError, ValueError):
+            return None
+
+    @property
+    def rp_name(self):
+        return self.state["pool"]
+
+    @property
+    def operation(self):
+        return self.state["operation"]
+
+    @property
+    def args(self):
+        return self.state["args"]
+
+    @property
+    def is_finished(self):
+        return self.state["finished"] is not None
+
+    def is_done(self, phase_name):
+        with self._lock:
+            return phase_name in self.state["phases"]
+
+    def get_result(self, phase_name):
+        with self._lock:
+            return self.state["phases"][phase_name]["result"]
+
+    def mark_done(self, phase_name, result=None):
+        """
+        Records that a phase finished, along with what it returned.
+        Results that cannot be kept as json, such as ansible runs, are not
+        needed by later phases, and are dropped.
+        """
+        try:
+            json.dumps(result)
+        except (TypeError, ValueError):
+            result = None
+
+        with self._lock:
+            self.state["phases"][phase_name] = {
+                "finished": time.time(),
+                "result": result,
+            }
+            self._save()
+
+    def get_host_status(self, server):
+        with self._lock:
+            return self.state["hosts"].get(server)
+
+    def set_host_status(self, statuses):
+        """
+        Records the status of hosts, given as a dictionary of server to
+        status
+        """
+        with self._lock:
+            self.state["hosts"].update(statuses)
+            self._save()
+
+    def finish(self):
+        with self._lock:
+            self.state["finished"] = time.time()
+            self._save()
+
+    def _save(self):
+        with open("{}.tmp".format(self.journal_file), "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace("{}.tmp".format(self.journal_file), self.journal_file)
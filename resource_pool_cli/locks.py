@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+"""
+Locks that let operations on different pools run at the same time, across
+every cli process and container sharing the pools directory.
+
+Each pool has its own lock, held for the whole of an operation that changes
+the pool, so that two operations never change the same pool at once, while
+operations on other pools go ahead. The fleet lock is only held for the
+short critical section in which an operation places its request on the
+fleet and reserves the servers it picked. The reservations are kept in the
+inventory until the servers are transferred, so no other operation can
+pick them in the meantime, and no playbook ever runs under the fleet lock.
+
+The locks are flock()s on files in the lock directory, so they are released
+by the kernel if the process holding them dies.
+"""
+
+import contextlib
+import fcntl
+import os
+import time
+
+FLEET_LOCK = ".fleet"
+
+
+class LockBusy(Exception):
+    """
+    Raised when a pool is locked by another operation. The message is meant
+    to be shown to the user as it is.
+    """
+
+
+class LockManager:
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def _lock_file(self, name):
+        return "{}/{}.lock".format(self.lock_dir, name)
+
+    @contextlib.contextmanager
+    def pool_lock(self, rp_name, operation, timeout=0):
+        """
+        Holds the lock of a pool while the enclosed block runs. If another
+        operation holds it for longer than timeout seconds, LockBusy is
+        raised, naming that operation.
+        """
+        lock_file = self._lock_file(rp_name)
+        fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise LockBusy(
+                            "The {} pool is busy with another operation: {}".format(
+                                rp_name, _read_holder(fd)
+                            )
+                        )
+                    time.sleep(0.5)
+
+            # Kept in the lock file, so that a waiting operation can say
+            # what it is waiting for
+            os.ftruncate(fd, 0)
+            os.pwrite(
+                fd,
+                "{} (pid {}, since {})".format(
+                    operation, os.getpid(), time.strftime("%Y-%m-%d %H:%M:%S")
+                ).encode(),
+                0,
+            )
+            yield
+        finally:
+            os.close(fd)
+
+    @contextlib.contextmanager
+    def fleet_lock(self):
+        """
+        Holds the fleet lock while the enclosed block runs, waiting for it
+        if needed. It is only ever held for placement and reservations, so
+        the wait is short.
+        """
+        fd = os.open(self._lock_file(FLEET_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def _read_holder(fd):
+    holder = os.pread(fd, 1024, 0).decode(errors="replace").strip()
+    return holder or "unknown"
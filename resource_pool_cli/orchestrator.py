@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+"""
+A small dependency graph executor for the phases of an operation, such as
+installing kubernetes or joining workers. Every phase starts as soon as all
+of the phases it depends on are done, so phases that do not depend on each
+other run in parallel.
+
+Given a journal, every phase that finishes is recorded in it, and phases
+that the journal already has as done are skipped, with the result they
+returned back then, so that an operation can be resumed.
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import tracing
+
+
+class PhaseFailed(Exception):
+    def __init__(self, phase_name, error):
+        super().__init__("Phase {} failed: {}".format(phase_name, error))
+        self.phase_name = phase_name
+        self.error = error
+
+
+class PhaseGraph:
+    def __init__(self, max_workers=4, journal=None):
+        self.max_workers = max_workers
+        self.journal = journal
+        self.phases = {}
+        self.results = {}
+        self.timings = {}
+        self.skipped = []
+        self._lock = threading.Lock()
+
+    def add(self, name, func, depends_on=()):
+        """
+        Adds a phase. func is called with no arguments, and whatever it
+        returns is stored in self.results under the phase name, so that
+        later phases can use it.
+        """
+        for dependency in depends_on:
+            if dependency not in self.phases:
+                raise ValueError(
+                    "Phase {} depends on unknown phase {}".format(name, dependency)
+                )
+        self.phases[name] = (func, tuple(depends_on))
+
+    def _run_phase(self, name, parent_span):
+        if self.journal is not None and self.journal.is_done(name):
+            result = self.journal.get_result(name)
+            with self._lock:
+                self.skipped.append(name)
+            self.results[name] = result
+            return result
+
+        func = self.phases[name][0]
+        start = time.monotonic()
+        try:
+            with tracing.span(name, parent=parent_span, kind="phase"):
+                result = func()
+        finally:
+            with self._lock:
+                self.timings[name] = (start, time.monotonic())
+        self.results[name] = result
+
+        if self.journal is not None:
+            self.journal.mark_done(name, result)
+        return result
+
+    def run(self):
+        """
+        Runs every phase, respecting dependencies. If a phase fails, no new
+        phases are started, the ones already running are waited for, and
+        PhaseFailed is raised.
+        """
+        done = set()
+        running = {}
+        failure = None
+
+        # Phases run on other threads, so they are attached to the span
+        # that is current here
+        parent_span = tracing.current_span()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                if failure is None:
+                    for name, (_, depends_on) in self.phases.items():
+                        if name in done or name in running.values():
+                            continue
+                        if all(dependency in done for dependency in depends_on):
+                            running[
+                                executor.submit(self._run_phase, name, parent_span)
+                            ] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        if failure is None:
+                            failure = PhaseFailed(name, error)
+                    else:
+                        done.add(name)
+
+        if failure is not None:
+            raise failure
+
+    def critical_path(self):
+        """
+        Returns the chain of phases that determined the total run time.
+        It is found by starting at the phase that finished last, and then
+        repeatedly stepping to the dependency that finished last, since that
+        is the one the phase had to wait for.
+        """
+        if not self.timings:
+            return []
+
+        name = max(self.timings, key=lambda phase: self.timings[phase][1])
+        path = [name]
+
+        while True:
+            depends_on = [
+                dependency
+                for dependency in self.phases[name][1]
+                if dependency in self.timings
+            ]
+            if not depends_on:
+                break
+            name = max(depends_on, key=lambda phase: self.timings[phase][1])
+            path.append(name)
+
+        return list(reversed(path))
+
+    def report(self):
+        """
+        Returns a list of (phase name, start offset, duration, is critical)
+        tuples in the order the phases started, with times in seconds
+        """
+        if not self.timings:
+            return []
+
+        first_start = min(start for start, _ in self.timings.values())
+        critical_path = set(self.critical_path())
+
+        return [
+            (name, start - first_start, end - start, name in critical_path)
+            for name, (start, end) in sorted(
+                self.timings.items(), key=lambda item: item[1][0]
+            )
+        ]
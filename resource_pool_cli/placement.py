@@ -0,0 +1,358 @@
+#!/usr/bin/python3
+
+"""
+Placement engine used by create and resize to decide which servers make up
+a pool. Given the specs of candidate servers, it picks a set of servers
+whose total cores and memory meet the request, with as little overshoot
+as possible.
+
+Servers with identical specs are interchangeable, so the search works on
+groups of servers rather than individual servers. This keeps it fast on
+large fleets, where there are usually only a handful of distinct hardware
+configurations. A greedy pass first builds a set that meets the request,
+then a local search adds, removes and swaps servers until it cannot
+improve the result any further, or until the time budget runs out.
+
+When many requests are placed on the same servers, as when planning, the
+servers can be grouped once with group_servers(), and every request
+placed on the groups with select_from_groups().
+"""
+
+import time
+
+import tracing
+
+# Missing resources are weighted far above overshoot, so that the search
+# always prefers a set that meets the request.
+DEFICIT_WEIGHT = 1000000.0
+
+# Moving a server in or out of a pool is only used to break ties, so that
+# an existing pool is not reshuffled for no gain in fit.
+MOVE_WEIGHT = 0.000001
+
+# Preferred servers, such as ones that already have kubernetes installed,
+# are favoured over others when the fit is about the same. Every other new
+# server costs as much as overshooting the request by this fraction.
+COLD_WEIGHT = 0.001
+
+DEFAULT_TIME_BUDGET = 0.5
+
+
+@tracing.traced("placement")
+def select_servers(
+    candidates,
+    cores=None,
+    memory=None,
+    current=(),
+    preferred=(),
+    min_servers=0,
+    time_budget=DEFAULT_TIME_BUDGET,
+):
+    """
+    Picks servers out of candidates, a get_specs() style dictionary, so that
+    their total cores and memory are at least the requested amounts.
+    A request of None for cores or memory means that resource is not
+    constrained.
+
+    current is the servers that are already in the pool. They are all
+    candidates as well, and the engine prefers keeping them over pulling in
+    new ones, so a pool that needs to grow one resource and shrink the
+    other gets servers swapped rather than rebuilt.
+
+    preferred is servers that should be picked over others with similar
+    specs, such as servers that were prewarmed.
+
+    Returns a dictionary with the selected servers, along with their total
+    cores and memory, or None if the request cannot be met.
+    """
+    return select_from_groups(
+        group_servers(candidates, current, preferred),
+        cores,
+        memory,
+        min_servers,
+        time_budget,
+    )
+
+
+def group_servers(candidates, current=(), preferred=()):
+    """
+    Groups the servers of candidates, a get_specs() style dictionary, into
+    the groups of interchangeable servers the search works on. Returns a
+    dictionary of (cores, mem, is_current, is_preferred) to the sorted list
+    of servers with that key.
+    """
+    current = set(current)
+    preferred = set(preferred)
+
+    groups = {}
+    for server in sorted(candidates):
+        server_specs = candidates[server]
+        key = (
+            server_specs["cores"],
+            server_specs["mem"],
+            server in current,
+            server in preferred,
+        )
+        groups.setdefault(key, []).append(server)
+    return groups
+
+
+def select_from_groups(
+    groups, cores=None, memory=None, min_servers=0, time_budget=DEFAULT_TIME_BUDGET
+):
+    """
+    Same as select_servers(), on servers that were already grouped with
+    group_servers(). It is not traced, since planning calls it far too
+    often for every call to be a span.
+    """
+    search = _Search(groups, cores, memory, min_servers)
+    if not search.is_feasible_at_all():
+        return None
+
+    deadline = time.monotonic() + time_budget
+    search.fill()
+    search.improve(deadline)
+
+    if not search.is_satisfied():
+        return None
+
+    servers = search.selected_servers()
+    return {
+        "servers": servers,
+        "cores": search.total_cores,
+        "mem": search.total_mem,
+        "added": [server for server in servers if server not in search.current],
+        "removed": sorted(search.current.difference(servers)),
+    }
+
+
+def _move_cost(key, delta):
+    """
+    Returns the cost of selecting delta more servers of the group with the
+    given key. Removing a current server or adding a new one is a move, and
+    adding a new server that is not preferred costs a bit more.
+    """
+    _, _, is_current, is_preferred = key
+    if is_current:
+        return -delta * MOVE_WEIGHT
+    if is_preferred:
+        return delta * MOVE_WEIGHT
+    return delta * (MOVE_WEIGHT + COLD_WEIGHT)
+
+
+class _Search:
+    """
+    Holds the state of one placement search. Servers are grouped by
+    (cores, mem, is_current, is_preferred), and the state is how many
+    servers of each group are selected.
+    """
+
+    def __init__(self, groups, cores, memory, min_servers):
+        self.cores = cores
+        self.memory = memory
+        self.min_servers = min_servers
+
+        # Every resource is normalized by its request, so that overshooting
+        # 8 cores and overshooting 8 GB are not treated as the same thing.
+        self.core_weight = 1.0 / max(cores, 1) if cores is not None else 0.0
+        self.mem_weight = 1.0 / max(memory, 1) if memory is not None else 0.0
+
+        self.groups = sorted(groups.items(), reverse=True)
+        self.current = {
+            server
+            for (_, _, is_current, _), servers in self.groups
+            if is_current
+            for server in servers
+        }
+        self.counts = [0] * len(self.groups)
+        self.total_cores = 0
+        self.total_mem = 0
+        self.total_servers = 0
+        self.move_cost = 0.0
+
+        # The pool starts out as it is today, and the search works from there
+        for index, ((_, _, is_current, _), servers) in enumerate(self.groups):
+            if is_current:
+                self._apply(index, len(servers))
+
+    def is_feasible_at_all(self):
+        all_cores = sum(key[0] * len(servers) for key, servers in self.groups)
+        all_mem = sum(key[1] * len(servers) for key, servers in self.groups)
+        all_servers = sum(len(servers) for _, servers in self.groups)
+
+        return (
+            (self.cores is None or all_cores >= self.cores)
+            and (self.memory is None or all_mem >= self.memory)
+            and all_servers >= self.min_servers
+        )
+
+    def is_satisfied(self):
+        return self._deficit(self.total_cores, self.total_mem, self.total_servers) == 0
+
+    def selected_servers(self):
+        servers = []
+        for index, (_, group_servers) in enumerate(self.groups):
+            servers += group_servers[: self.counts[index]]
+        return servers
+
+    def _deficit(self, total_cores, total_mem, total_servers):
+        deficit = 0.0
+        if self.cores is not None and total_cores < self.cores:
+            deficit += (self.cores - total_cores) * self.core_weight
+        if self.memory is not None and total_mem < self.memory:
+            deficit += (self.memory - total_mem) * self.mem_weight
+        if total_servers < self.min_servers:
+            deficit += self.min_servers - total_servers
+        return deficit
+
+    def _overshoot(self, total_cores, total_mem):
+        overshoot = 0.0
+        if self.cores is not None and total_cores > self.cores:
+            overshoot += (total_cores - self.cores) * self.core_weight
+        if self.memory is not None and total_mem > self.memory:
+            overshoot += (total_mem - self.memory) * self.mem_weight
+        return overshoot
+
+    def _cost(self, total_cores, total_mem, total_servers, move_cost):
+        return (
+            DEFICIT_WEIGHT * self._deficit(total_cores, total_mem, total_servers)
+            + self._overshoot(total_cores, total_mem)
+            + move_cost
+        )
+
+    def cost(self):
+        return self._cost(
+            self.total_cores, self.total_mem, self.total_servers, self.move_cost
+        )
+
+    def _cost_after(self, changes):
+        """
+        Returns the cost of the state after applying changes, a list of
+        (group index, count delta) tuples, without applying them
+        """
+        total_cores = self.total_cores
+        total_mem = self.total_mem
+        total_servers = self.total_servers
+        move_cost = self.move_cost
+
+        for index, delta in changes:
+            key, _ = self.groups[index]
+            total_cores += key[0] * delta
+            total_mem += key[1] * delta
+            total_servers += delta
+            move_cost += _move_cost(key, delta)
+
+        return self._cost(total_cores, total_mem, total_servers, move_cost)
+
+    def _apply(self, index, delta):
+        key, _ = self.groups[index]
+        self.counts[index] += delta
+        self.total_cores += key[0] * delta
+        self.total_mem += key[1] * delta
+        self.total_servers += delta
+        self.move_cost += _move_cost(key, delta)
+
+    def _room(self, index):
+        return len(self.groups[index][1]) - self.counts[index]
+
+    def _bulk_size(self, index, adding):
+        """
+        When far away from the request, a whole batch of identical servers
+        can be added or removed at once. This returns how many servers of the
+        group can be moved without crossing the request in any resource.
+        """
+        (group_cores, group_mem, _, _), _ = self.groups[index]
+        limits = []
+
+        if adding:
+            available = self._room(index)
+            if self.cores is not None and group_cores and self.total_cores < self.cores:
+                limits.append((self.cores - self.total_cores) // group_cores)
+            if self.memory is not None and group_mem and self.total_mem < self.memory:
+                limits.append((self.memory - self.total_mem) // group_mem)
+        else:
+            available = self.counts[index]
+            if self.cores is not None and group_cores:
+                limits.append((self.total_cores - self.cores) // group_cores)
+            if self.memory is not None and group_mem:
+                limits.append((self.total_mem - self.memory) // group_mem)
+            limits.append(self.total_servers - self.min_servers)
+
+        if not limits:
+            return 1
+
+        return int(max(1, min(available, min(limits))))
+
+    def fill(self):
+        """
+        Greedily adds the group that closes the most of the remaining gap,
+        in batches, until the request is met
+        """
+        while not self.is_satisfied():
+            best_index = None
+            best_cost = self.cost()
+
+            for index in range(len(self.groups)):
+                if self._room(index) == 0:
+                    continue
+                cost = self._cost_after([(index, 1)])
+                if cost < best_cost:
+                    best_index = index
+                    best_cost = cost
+
+            if best_index is None:
+                return
+
+            self._apply(best_index, self._bulk_size(best_index, True))
+
+    def improve(self, deadline):
+        """
+        Local search over single adds, removes and swaps between groups.
+        The best improving move is applied until there are none left, or
+        the deadline passes.
+        """
+        while time.monotonic() < deadline:
+            current_cost = self.cost()
+            best_changes = None
+            best_cost = current_cost
+
+            selected = [index for index, count in enumerate(self.counts) if count]
+            unselected = [
+                index for index in range(len(self.groups)) if self._room(index)
+            ]
+
+            for index in selected:
+                cost = self._cost_after([(index, -1)])
+                if cost < best_cost:
+                    best_changes = [(index, -1)]
+                    best_cost = cost
+
+            for index in unselected:
+                cost = self._cost_after([(index, 1)])
+                if cost < best_cost:
+                    best_changes = [(index, 1)]
+                    best_cost = cost
+
+            for out_index in selected:
+                if time.monotonic() >= deadline:
+                    break
+                for in_index in unselected:
+                    if in_index == out_index:
+                        continue
+                    cost = self._cost_after([(out_index, -1), (in_index, 1)])
+                    if cost < best_cost:
+                        best_changes = [(out_index, -1), (in_index, 1)]
+                        best_cost = cost
+
+            if best_changes is None:
+                return
+
+            if len(best_changes) == 1:
+                index, delta = best_changes[0]
+                size = self._bulk_size(index, delta > 0)
+                # Only take the whole batch if it is still an improvement
+                if size > 1 and self._cost_after([(index, delta * size)]) < best_cost:
+                    best_changes = [(index, delta * size)]
+
+            for index, delta in best_changes:
+                self._apply(index, delta)
@@ -0,0 +1,330 @@
+#!/usr/bin/python3
+
+"""
+What-if planning of pool requests against the capacity the fleet has now,
+without changing anything. A request is a pool name with the cores and
+memory it should have. A pool that does not exist yet is planned like
+create would, with a master and the workers placement picks, and a pool
+that exists is planned like resize would.
+
+Requests are planned on specs that were already gathered, so planning does
+not connect to any server, and the fleet is grouped for the placement
+engine once, for every request, so thousands of requests are planned per
+second. A new pool can be constrained to a site, and an existing pool that
+is constrained to one only grows within it.
+
+Every request is planned on its own, against the fleet as it is, unless
+the plan is cumulative, in which case every request takes its servers out
+of the fleet, and gives back the ones it removes, as if the requests were
+run one after another.
+"""
+
+import bisect
+import heapq
+
+import placement
+
+
+def get_resize_type(pool_cores, pool_mem, cores, memory):
+    """
+    Returns how a pool with the given cores and memory has to change to
+    meet the requested ones: increase, decrease, or rebalance when one of
+    them grows while the other shrinks. A request of None or 0 for cores or
+    memory leaves it as it is. Returns None if nothing has to change.
+    """
+    resize_types = set()
+    if cores and cores != pool_cores:
+        resize_types.add("increase" if cores > pool_cores else "decrease")
+    if memory and memory != pool_mem:
+        resize_types.add("increase" if memory > pool_mem else "decrease")
+
+    if not resize_types:
+        return None
+    if len(resize_types) > 1:
+        return "rebalance"
+    return resize_types.pop()
+
+
+def get_totals(specs, servers=None):
+    """
+    Returns the total cores and memory of the given servers, or of every
+    server of specs, a get_specs() style dictionary
+    """
+    if servers is None:
+        servers = specs
+    cores = sum(specs[server]["cores"] for server in servers)
+    mem = sum(specs[server]["mem"] for server in servers)
+    return round(cores, 2), round(mem, 2)
+
+
+class Planner:
+    """
+    Plans requests on a snapshot of the fleet and the pools. fleet_specs
+    holds the fleet servers that can be picked, in the order create goes
+    through them, pool_specs every existing pool to the specs of its
+    workers, and preferred the fleet servers placement favours, such as
+    the prewarmed ones. server_sites holds the site of every server, and
+    pool_sites the site of every pool that is constrained to one.
+    """
+
+    def __init__(
+        self,
+        fleet_specs,
+        pool_specs,
+        preferred=(),
+        cumulative=False,
+        time_budget=placement.DEFAULT_TIME_BUDGET,
+        server_sites=None,
+        pool_sites=None,
+    ):
+        self.fleet_specs = dict(fleet_specs)
+        self.pool_specs = {
+            rp_name: dict(specs) for rp_name, specs in pool_specs.items()
+        }
+        self.preferred = set(preferred)
+        self.cumulative = cumulative
+        self.time_budget = time_budget
+        self.server_sites = server_sites or {}
+        self.pool_sites = dict(pool_sites or {})
+
+        self.fleet_cores, self.fleet_mem = get_totals(self.fleet_specs)
+        self.fleet_groups = placement.group_servers(
+            self.fleet_specs, preferred=self.preferred
+        )
+        self._pool_groups = {}
+        self._site_groups = {}
+
+        # Create picks the first server with the most cores as the master,
+        # which is kept at the top of a heap, since the fleet changes
+        # between requests of a cumulative plan
+        self._positions = {server: index for index, server in enumerate(fleet_specs)}
+        self._masters = [
+            (-self.fleet_specs[server]["cores"], index, server)
+            for server, index in self._positions.items()
+        ]
+        heapq.heapify(self._masters)
+
+    def plan(self, rp_name, cores, memory, site=None):
+        """
+        Plans a single request, on the servers of site if it is given.
+        Returns a dictionary with the pool, its site, the operation it
+        takes, the master picked for a new pool, the servers to add and to
+        remove, the final cores and memory of the pool, and the cores and
+        memory left in the fleet afterwards. When the request cannot be
+        met, error holds the reason why, and nothing changes.
+        """
+        pool_site = self.pool_sites.get(rp_name)
+        if rp_name in self.pool_specs and site not in (None, pool_site):
+            plan = _new_plan(rp_name, "resize", pool_site)
+            plan["error"] = "The pool is not constrained to the {} site.".format(site)
+        elif rp_name in self.pool_specs:
+            plan = self._plan_resize(rp_name, cores, memory)
+        else:
+            plan = self._plan_create(rp_name, cores, memory, site)
+
+        if plan["error"] is not None:
+            plan.update(fleet_cores=self.fleet_cores, fleet_mem=self.fleet_mem)
+            return plan
+
+        taken = plan["add"] + ([plan["master"]] if plan["master"] else [])
+        taken_cores, taken_mem = get_totals(self.fleet_specs, taken)
+        removed_cores, removed_mem = get_totals(
+            self.pool_specs.get(rp_name, {}), plan["remove"]
+        )
+        plan["fleet_cores"] = round(self.fleet_cores - taken_cores + removed_cores, 2)
+        plan["fleet_mem"] = round(self.fleet_mem - taken_mem + removed_mem, 2)
+
+        if self.cumulative:
+            self._apply(plan)
+        return plan
+
+    def _plan_create(self, rp_name, cores, memory, site):
+        plan = _new_plan(rp_name, "create", site)
+        if not cores or not memory:
+            plan["error"] = "You must specify cores and memory"
+            return plan
+
+        master = self._get_master(site)
+        placement_result = None
+        if master is not None:
+            groups = dict(self._get_fleet_groups(site))
+            key = self._get_fleet_key(master)
+            groups[key] = [server for server in groups[key] if server != master]
+            placement_result = placement.select_from_groups(
+                groups, cores, memory, min_servers=1, time_budget=self.time_budget
+            )
+
+        if placement_result is None:
+            plan["error"] = (
+                "There are not enough resources available to create a new "
+                "resource pool."
+            )
+            return plan
+
+        plan.update(
+            master=master,
+            add=placement_result["servers"],
+            cores=placement_result["cores"],
+            mem=placement_result["mem"],
+        )
+        return plan
+
+    def _plan_resize(self, rp_name, cores, memory):
+        pool_specs = self.pool_specs[rp_name]
+        pool_cores, pool_mem = get_totals(pool_specs)
+        resize_type = get_resize_type(pool_cores, pool_mem, cores, memory)
+
+        site = self.pool_sites.get(rp_name)
+        plan = _new_plan(rp_name, resize_type or "resize", site)
+        if resize_type is None:
+            plan["error"] = "The request equals the current state of the pool."
+            return plan
+
+        if resize_type == "increase":
+            # Only the missing resources need to be found in the fleet
+            placement_result = placement.select_from_groups(
+                self._get_fleet_groups(site),
+                cores - pool_cores if cores and cores > pool_cores else None,
+                memory - pool_mem if memory and memory > pool_mem else None,
+                time_budget=self.time_budget,
+            )
+        elif resize_type == "decrease":
+            placement_result = placement.select_from_groups(
+                self._get_pool_groups(rp_name),
+                cores,
+                memory,
+                time_budget=self.time_budget,
+            )
+        else:
+            groups = dict(self._get_fleet_groups(site))
+            groups.update(self._get_pool_groups(rp_name))
+            placement_result = placement.select_from_groups(
+                groups, cores, memory, time_budget=self.time_budget
+            )
+
+        if placement_result is None:
+            plan["error"] = "The requested resources are not available."
+            return plan
+
+        if resize_type == "increase":
+            plan.update(
+                add=placement_result["servers"],
+                cores=round(pool_cores + placement_result["cores"], 2),
+                mem=round(pool_mem + placement_result["mem"], 2),
+            )
+        else:
+            plan.update(
+                add=placement_result["added"],
+                remove=placement_result["removed"],
+                cores=placement_result["cores"],
+                mem=placement_result["mem"],
+            )
+
+        if not plan["add"] and not plan["remove"]:
+            plan["error"] = (
+                "The pool cannot be resized any closer to the request without "
+                "going below it."
+            )
+        return plan
+
+    def _get_master(self, site=None):
+        while self._masters and self._masters[0][2] not in self.fleet_specs:
+            heapq.heappop(self._masters)
+        if site is None:
+            return self._masters[0][2] if self._masters else None
+
+        # The heap holds the whole fleet, so a site is looked for in order
+        for _, _, server in sorted(self._masters):
+            if server in self.fleet_specs and self._get_site(server) == site:
+                return server
+        return None
+
+    def _get_site(self, server):
+        return self.server_sites.get(server)
+
+    def _get_fleet_groups(self, site):
+        if site is None:
+            return self.fleet_groups
+        if site not in self._site_groups:
+            self._site_groups[site] = placement.group_servers(
+                {
+                    server: server_specs
+                    for server, server_specs in self.fleet_specs.items()
+                    if self._get_site(server) == site
+                },
+                preferred=self.preferred,
+            )
+        return self._site_groups[site]
+
+    def _get_fleet_key(self, server):
+        server_specs = self.fleet_specs[server]
+        return (
+            server_specs["cores"],
+            server_specs["mem"],
+            False,
+            server in self.preferred,
+        )
+
+    def _get_pool_groups(self, rp_name):
+        # Every server of the pool is current, so whether it is preferred
+        # does not matter to placement
+        if rp_name not in self._pool_groups:
+            pool_specs = self.pool_specs[rp_name]
+            self._pool_groups[rp_name] = placement.group_servers(
+                pool_specs, current=pool_specs
+            )
+        return self._pool_groups[rp_name]
+
+    def _apply(self, plan):
+        """
+        Changes the snapshot like running the plan would
+        """
+        rp_name = plan["pool"]
+        pool_specs = self.pool_specs.setdefault(rp_name, {})
+        if plan["site"] is not None:
+            self.pool_sites[rp_name] = plan["site"]
+        self._pool_groups.pop(rp_name, None)
+        self._site_groups.clear()
+
+        taken = {}
+        for server in plan["add"] + ([plan["master"]] if plan["master"] else []):
+            taken.setdefault(self._get_fleet_key(server), set()).add(server)
+            server_specs = self.fleet_specs.pop(server)
+            if server != plan["master"]:
+                pool_specs[server] = server_specs
+
+        for key, servers in taken.items():
+            remaining = [
+                server for server in self.fleet_groups[key] if server not in servers
+            ]
+            if remaining:
+                self.fleet_groups[key] = remaining
+            else:
+                del self.fleet_groups[key]
+
+        for server in plan["remove"]:
+            self.fleet_specs[server] = pool_specs.pop(server)
+            key = self._get_fleet_key(server)
+            bisect.insort(self.fleet_groups.setdefault(key, []), server)
+
+            # Servers given back to the fleet go after the ones already in
+            # it, when create goes through the fleet for a master
+            position = self._positions.setdefault(server, len(self._positions))
+            heapq.heappush(self._masters, (-key[0], position, server))
+
+        self.fleet_cores = plan["fleet_cores"]
+        self.fleet_mem = plan["fleet_mem"]
+
+
+def _new_plan(rp_name, operation, site=None):
+    return {
+        "pool": rp_name,
+        "site": site,
+        "operation": operation,
+        "master": None,
+        "add": [],
+        "remove": [],
+        "cores": None,
+        "mem": None,
+        "error": None,
+    }
@@ -5,17 +5,151 @@ import random
 import string
 import sys
 import os
-import subprocess
 import json
 from prettytable import PrettyTable
-import yaml
 import shutil
-
-ANSIBLE_DIR = "/etc/ansible"
+import time
+import resource
+import fnmatch
+from contextlib import ExitStack, contextmanager
+
+import capacity
+import executor
+import fake_fleet
+import inventory
+import journal
+import locks
+import orchestrator
+import placement
+import planner
+import readiness
+import sites
+import tracing
+
+ANSIBLE_DIR = os.environ.get("RP_ANSIBLE_DIR", "/etc/ansible")
 PLAYBOOK_DIR = "{}/playbooks".format(ANSIBLE_DIR)
 TEMPLATE_DIR = "{}/pool_template".format(ANSIBLE_DIR)
 POOLS_DIR = "{}/pools".format(ANSIBLE_DIR)
 FLEET_HOSTS_YAML_FILE = "{}/pools/fleet/hosts.yml".format(ANSIBLE_DIR)
+INVENTORY_DB_FILE = "{}/.inventory.db".format(POOLS_DIR)
+
+# Hardware specs rarely change, so gathered facts are cached per host for this
+# many seconds. The --refresh flag on the cli bypasses the cache entirely.
+FACTS_CACHE_TTL = int(os.environ.get("RP_FACTS_CACHE_TTL", 3600))
+
+# Nodes are drained in parallel when shrinking a pool, up to this many at
+# once. A node that cannot be drained within the timeout, for example
+# because of a PodDisruptionBudget, is left in its pool.
+DRAIN_CONCURRENCY = int(os.environ.get("RP_DRAIN_CONCURRENCY", 5))
+DRAIN_TIMEOUT = os.environ.get("RP_DRAIN_TIMEOUT", "300s")
+
+# The kubernetes packages version installed by install_k8s.yml. Servers that
+# were prewarmed with this version skip the install step entirely.
+K8S_VERSION = os.environ.get("RP_K8S_VERSION", "1.14.3-00")
+
+# How long create waits for the master and the workers to become ready
+# before giving up. The cluster is polled, so it moves on as soon as it is.
+READY_TIMEOUT = int(os.environ.get("RP_READY_TIMEOUT", 300))
+
+# Ansible is told to print one json object per result, using the json_lines
+# callback plugin in here, so that its output can be parsed line by line as
+# it arrives.
+CALLBACK_PLUGINS_DIR = "{}/callback_plugins".format(ANSIBLE_DIR)
+
+# Every command records a trace of where its time went. The trace is kept as
+# json in TRACE_DIR, and its durations are written for the Prometheus node
+# exporter textfile collector in METRICS_TEXTFILE_DIR.
+TRACE_DIR = os.environ.get("RP_TRACE_DIR", "{}/.traces".format(POOLS_DIR))
+TRACES_KEPT = int(os.environ.get("RP_TRACES_KEPT", 100))
+METRICS_TEXTFILE_DIR = os.environ.get(
+    "RP_METRICS_TEXTFILE_DIR", "{}/.metrics".format(POOLS_DIR)
+)
+
+# The resource pool service listens on this unix socket, on the volume that
+# is shared by every container of the cli, so that the commands can reach it.
+SERVICE_SOCKET = os.environ.get(
+    "RP_SERVICE_SOCKET", "{}/.service.sock".format(POOLS_DIR)
+)
+
+# Operations on different pools run at the same time, but an operation
+# waits up to POOL_LOCK_TIMEOUT seconds for another one on the same pool to
+# finish before giving up. Servers picked from the fleet are reserved for up
+# to RESERVATION_TTL seconds, which covers waiting for the user to confirm.
+LOCK_DIR = "{}/.locks".format(POOLS_DIR)
+POOL_LOCK_TIMEOUT = int(os.environ.get("RP_POOL_LOCK_TIMEOUT", 0))
+RESERVATION_TTL = int(os.environ.get("RP_RESERVATION_TTL", 900))
+
+# The reconciler checks up to RECONCILE_CHECK_BUDGET workers of the pools
+# every RECONCILE_INTERVAL seconds, and replaces a worker once it failed
+# RECONCILE_FAILURES checks in a row. What it does is logged to EVENTS_FILE.
+RECONCILE_INTERVAL = int(os.environ.get("RP_RECONCILE_INTERVAL", 30))
+RECONCILE_CHECK_BUDGET = int(os.environ.get("RP_RECONCILE_CHECK_BUDGET", 50))
+RECONCILE_FAILURES = int(os.environ.get("RP_RECONCILE_FAILURES", 3))
+EVENTS_FILE = os.environ.get("RP_EVENTS_FILE", "{}/.events.log".format(POOLS_DIR))
+
+# Fleet servers are health checked right before placement, all at once, up
+# to HEALTH_CONCURRENCY at a time and each within HEALTH_TIMEOUT seconds.
+# Servers that passed a check in the last HEALTH_CHECK_TTL seconds are not
+# checked again. A server that fails is quarantined, and left out of
+# placement for QUARANTINE_BACKOFF seconds, doubled for every failure in a
+# row up to QUARANTINE_MAX_BACKOFF, before it is checked again.
+HEALTH_TIMEOUT = float(os.environ.get("RP_HEALTH_TIMEOUT", 5))
+HEALTH_CONCURRENCY = int(os.environ.get("RP_HEALTH_CONCURRENCY", 200))
+HEALTH_CHECK_TTL = int(os.environ.get("RP_HEALTH_CHECK_TTL", 60))
+QUARANTINE_BACKOFF = int(os.environ.get("RP_QUARANTINE_BACKOFF", 60))
+QUARANTINE_MAX_BACKOFF = int(os.environ.get("RP_QUARANTINE_MAX_BACKOFF", 3600))
+
+# Workers join their master JOIN_BATCH_SIZE at a time. The ones that fail
+# are retried up to JOIN_RETRIES times, after JOIN_RETRY_DELAY seconds that
+# double with every retry.
+JOIN_BATCH_SIZE = int(os.environ.get("RP_JOIN_BATCH_SIZE", 20))
+JOIN_RETRIES = int(os.environ.get("RP_JOIN_RETRIES", 3))
+JOIN_RETRY_DELAY = int(os.environ.get("RP_JOIN_RETRY_DELAY", 5))
+
+# How the cores and memory of a server are counted, by pool totals and by
+# placement. CPU_ACCOUNTING is "physical" to count every core of every
+# socket, "vcpus" to count hyperthreads as well, or "socket" to count the
+# cores of a single socket. Unless CAPACITY_ACCOUNTING is "capacity", what
+# kubelet and the system reserve on every server, given like the kubelet
+# flags of the same names with cpu in cores and memory in GB, such as
+# "cpu=0.5,memory=1", is not counted.
+CPU_ACCOUNTING = os.environ.get("RP_CPU_ACCOUNTING", capacity.PHYSICAL)
+CAPACITY_ACCOUNTING = os.environ.get("RP_CAPACITY_ACCOUNTING", "allocatable")
+KUBE_RESERVED = os.environ.get("RP_KUBE_RESERVED", "")
+SYSTEM_RESERVED = os.environ.get("RP_SYSTEM_RESERVED", "")
+EVICTION_HARD = os.environ.get("RP_EVICTION_HARD", "")
+
+# Ssh connections are shared through control sockets in SSH_CONTROL_DIR, on
+# the volume that is shared by every container of the cli, and kept open for
+# SSH_PERSIST after they were last used, in the time format of ssh_config,
+# so that every command reuses the connections of the ones before it. With
+# SSH_KEEP_WARM set, the service keeps a connection open to every server.
+SSH_CONTROL_DIR = os.environ.get("RP_SSH_CONTROL_DIR", "{}/.ssh".format(POOLS_DIR))
+SSH_PERSIST = os.environ.get("RP_SSH_PERSIST", "30m")
+SSH_KEEP_WARM = os.environ.get("RP_SSH_KEEP_WARM", "0") == "1"
+
+# The fleet can be split into sites, each with its own servers and its own
+# ansible controller, as described in the sites module. Without this file,
+# every server is in a single site run by the local controller.
+SITES_FILE = os.environ.get("RP_SITES_FILE", "{}/sites.yml".format(ANSIBLE_DIR))
+
+# Ansible commands are sent to long lived worker processes that keep ansible
+# loaded between steps. Setting this to "subprocess" runs every command as
+# its own ansible or ansible-playbook process instead, and setting it to
+# "fake" runs the cli against a fake fleet, without any servers.
+ANSIBLE_BACKEND = os.environ.get("RP_ANSIBLE_BACKEND", executor.WORKER_BACKEND)
+
+# The only facts we need are cpu and memory counts, so instead of gathering the
+# full fact set, this reads them straight out of /proc with the raw module.
+# It prints a single line of json, which does not require python on the server.
+CAPACITY_PROBE_CMD = (
+    "s=$(grep '^physical id' /proc/cpuinfo | sort -u | wc -l); "
+    "c=$(grep -m1 '^cpu cores' /proc/cpuinfo | cut -d: -f2); "
+    "v=$(grep -c '^processor' /proc/cpuinfo); "
+    "m=$(awk '/^MemTotal/ {print $2}' /proc/meminfo); "
+    'printf \'{"sockets": %d, "cores_per_socket": %d, "vcpus": %d, '
+    '"mem_kb": %d}\\n\' ${s:-0} ${c:-0} ${v:-0} ${m:-0}'
+)
 
 
 def randomString(stringLength=10):
@@ -26,99 +160,840 @@ def randomString(stringLength=10):
     return "".join(random.choice(letters) for i in range(stringLength))
 
 
-def verify_rp_name(rp_name):
+_inventory_store = None
+
+
+def get_inventory():
+    """
+    Returns the inventory store, opening it on first use. The first time
+    the store is created, pools that were kept in hosts yaml files are
+    imported into it. Servers added to the fleet's hosts.yml by hand are
+    picked up every time it is opened.
+    """
+    global _inventory_store
+
+    if _inventory_store is None:
+        _inventory_store = inventory.InventoryStore(INVENTORY_DB_FILE)
+        if _inventory_store.is_empty():
+            _inventory_store.import_yaml_inventory(POOLS_DIR)
+        _inventory_store.sync_fleet_file(FLEET_HOSTS_YAML_FILE)
+
+    return _inventory_store
+
+
+_lock_manager = None
+
+
+def get_locks():
+    global _lock_manager
+
+    if _lock_manager is None:
+        _lock_manager = locks.LockManager(LOCK_DIR)
+
+    return _lock_manager
+
+
+@contextmanager
+def pool_lock(rp_name, operation):
+    """
+    Holds the lock of a pool for an operation, or exits if another
+    operation is holding it
+    """
+    try:
+        with get_locks().pool_lock(rp_name, operation, POOL_LOCK_TIMEOUT):
+            yield
+    except locks.LockBusy as exc:
+        click.echo(exc)
+        sys.exit(1)
+
+
+@contextmanager
+def pool_locks(rp_names, operation):
+    """
+    Holds the locks of the given pools for an operation. Yields the pools
+    that were locked, and a dictionary of the ones that were skipped,
+    because another operation is holding them, to the reason why.
+    """
+    busy = {}
+    with ExitStack() as stack:
+        locked = []
+        for rp_name in rp_names:
+            try:
+                stack.enter_context(
+                    get_locks().pool_lock(rp_name, operation, POOL_LOCK_TIMEOUT)
+                )
+                locked.append(rp_name)
+            except locks.LockBusy as exc:
+                busy[rp_name] = str(exc)
+        yield locked, busy
+
+
+# Servers are reserved under the token of the operation that picked them.
+# Jobs of the service take over the token of the plan they were given.
+_reservation_token = randomString(16)
+_has_reserved = False
+
+
+def set_reservation_token(token):
+    global _reservation_token
+
+    _reservation_token = token
+
+
+def get_available_specs(specs):
+    """
+    Returns the given fleet specs without the servers that left the fleet
+    or were reserved by another operation since they were gathered. This
+    is meant to be called under the fleet lock, right before placement.
+    """
+    server_pools = get_inventory().get_server_pools(specs)
+    reserved = get_inventory().get_reserved(specs, _reservation_token)
+    return {
+        server: server_specs
+        for server, server_specs in specs.items()
+        if server_pools.get(server) == "fleet" and server not in reserved
+    }
+
+
+def pick_fleet_servers(rp_name, cores, memory):
+    """
+    Picks healthy fleet servers of a pool's site that make up the given
+    cores and memory, with the placement engine, and reserves them for the
+    pool. Returns the placement result, or None if the fleet cannot make
+    them up.
+    """
+    fleet_specs = get_site_specs(get_specs("fleet"), get_pool_site(rp_name))
+    fleet_specs = get_healthy_specs(fleet_specs)
+    with get_locks().fleet_lock():
+        fleet_specs = get_available_specs(fleet_specs)
+        placement_result = placement.select_servers(
+            fleet_specs,
+            cores or None,
+            memory or None,
+            preferred=get_prewarmed(fleet_specs),
+        )
+        if placement_result is not None:
+            reserve_servers(rp_name, placement_result["servers"])
+    return placement_result
+
+
+def reserve_servers(rp_name, server_list, token=None):
+    """
+    Reserves fleet servers for a pool, until they are transferred into it.
+    Returns the token they were reserved under.
+    """
+    global _has_reserved
+
+    token = token or _reservation_token
+    get_inventory().reserve(server_list, rp_name, token, RESERVATION_TTL)
+    if token == _reservation_token:
+        _has_reserved = True
+    return token
+
+
+def release_reservations(token=None):
+    """
+    Releases the servers reserved under token, or under the token of this
+    process if it is not given
+    """
+    if token is None and not _has_reserved:
+        return
+    get_inventory().release_reservations(token or _reservation_token)
+
+
+def get_quarantined_until(check):
+    """
+    Takes the latest check of a server, from the inventory, and returns
+    the time its quarantine ends, or None if its latest check passed
+    """
+    if not check["failures"]:
+        return None
+    backoff = min(
+        QUARANTINE_BACKOFF * 2 ** (check["failures"] - 1), QUARANTINE_MAX_BACKOFF
+    )
+    return check["checked_at"] + backoff
+
+
+@tracing.traced("health check")
+def get_healthy_specs(specs):
+    """
+    Returns the given fleet specs without the servers that are quarantined,
+    or that fail the health check they are given now. It is meant to be
+    called right before placement, so that servers that would fail halfway
+    through provisioning are never picked.
+    """
+    inventory_store = get_inventory()
+    checks = inventory_store.get_host_checks(specs)
+    now = time.time()
+
+    quarantined = []
+    to_check = []
+    for server in specs:
+        check = checks.get(server)
+        if check is None:
+            to_check.append(server)
+            continue
+
+        quarantined_until = get_quarantined_until(check)
+        if quarantined_until is not None and quarantined_until > now:
+            quarantined.append(server)
+        elif quarantined_until is not None:
+            # Its quarantine is over, so it gets another chance
+            to_check.append(server)
+        elif check["checked_at"] < now - HEALTH_CHECK_TTL:
+            to_check.append(server)
+
+    failed = get_executor().check_hosts(to_check, HEALTH_TIMEOUT, HEALTH_CONCURRENCY)
+    inventory_store.record_checks(
+        [server for server in to_check if server not in failed], failed
+    )
+
+    for server, reason in sorted(failed.items()):
+        click.echo("{} failed its health check: {}".format(server, reason), err=True)
+    if quarantined:
+        click.echo(
+            "Leaving out {} quarantined servers, see the quarantine command".format(
+                len(quarantined)
+            ),
+            err=True,
+        )
+
+    return {
+        server: server_specs
+        for server, server_specs in specs.items()
+        if server not in failed and server not in quarantined
+    }
+
+
+@tracing.traced("keep connections warm")
+def keep_warm_connections():
+    """
+    Opens, or keeps open, a shared ssh connection to every server of every
+    pool, so that the next commands do not have to connect to them. Returns
+    a dictionary of the servers that could not be reached to the reason why.
+    """
+    servers = [
+        server
+        for rp_name in get_pool_names()
+        for server in get_inventory().get_servers(rp_name)
+    ]
+    return get_executor().keep_warm(servers, HEALTH_TIMEOUT, HEALTH_CONCURRENCY)
+
+
+def get_pool_names():
     """
-    This function verifies that a resource pool directory,
-    and thus rp_name, exists
+    Returns the names of all pools, including the fleet.
     """
-    is_rp_name_valid = False
+    return get_inventory().get_pool_names()
 
-    for file in os.listdir(POOLS_DIR):
-        if file == rp_name:
-            is_rp_name_valid = True
 
-    if not is_rp_name_valid:
+def match_pool_names(patterns):
+    """
+    Returns the names of the pools matching the given names or glob
+    patterns, in the order they were given. The fleet never matches.
+    Exits if a name or pattern matches no pool.
+    """
+    pool_names = [name for name in get_pool_names() if name != "fleet"]
+
+    matched = []
+    for pattern in patterns:
+        names = fnmatch.filter(pool_names, pattern)
+        if not names:
+            click.echo("There is no resource pool named {}.".format(pattern))
+            sys.exit(1)
+        matched += [name for name in names if name not in matched]
+    return matched
+
+
+def verify_rp_name(rp_name):
+    """
+    This function verifies that a resource pool, and thus rp_name, exists
+    """
+    if not get_inventory().pool_exists(rp_name):
         click.echo("There is no resource pool named {}.".format(rp_name))
-        sys.exit()
+        sys.exit(1)
+
+
+def get_servers(rp_name, role):
+    """
+    Returns a list of all servers with the given role in a pool.
+    The fleet's servers have the "hosts" role, while the servers
+    of other pools are either "masters" or "workers".
+    """
+    return get_inventory().get_servers(rp_name, role)
+
+
+def get_inventory_file(rp_name, role):
+    """
+    Returns the ansible hosts yaml file of the given role in a pool.
+    These files are only generated from the inventory store here, right
+    before ansible needs them, and only when the pool has changed.
+    """
+    pool_dir = "{}/{}".format(POOLS_DIR, rp_name)
+    get_inventory().render_inventory(rp_name, pool_dir)
+    return "{}/{}.yml".format(pool_dir, role)
 
 
 def init_pool_dir(rp_name):
     """
-    This function initializes a new pool directory, with basic 
+    This function initializes a new pool directory, with basic
     template files in place
     """
     shutil.copytree(TEMPLATE_DIR, "{}/{}".format(POOLS_DIR, rp_name))
 
 
-def init_pool(rp_name, masters_list, workers_list):
+def init_pool(rp_name, masters_list, workers_list, cores=None, memory=None, site=None):
     """
-    Initial transfer of servers into a new pool
+    Initial transfer of servers into a new pool, which records the
+    requested cores and memory as the capacity the pool is kept at, and the
+    site it is constrained to
     """
-    masters_yaml_file = "{}/{}/masters.yml".format(POOLS_DIR, rp_name)
-    transfer_servers(masters_list, FLEET_HOSTS_YAML_FILE, masters_yaml_file)
+    click.echo("Moving servers from fleet to {}...".format(rp_name))
+    get_inventory().create_pool(
+        rp_name, masters_list, workers_list, cores, memory, _reservation_token, site
+    )
+
+
+def get_journal_file(rp_name):
+    return "{}/{}/journal.json".format(POOLS_DIR, rp_name)
+
+
+def start_journal(rp_name, operation, args):
+    """
+    Starts the phase journal of an operation on a pool
+    """
+    return journal.Journal.start(get_journal_file(rp_name), rp_name, operation, args)
+
+
+def load_journal(rp_name):
+    """
+    Returns the phase journal of the last operation on a pool, or None
+    """
+    return journal.Journal.load(get_journal_file(rp_name))
+
+
+def set_desired_capacity(rp_name, cores=None, memory=None):
+    """
+    Records the cores and memory a pool was resized to. A resource that
+    was not given is recorded as the amount the pool has now, since the
+    resize may have moved it too, such as the memory of the servers a
+    cores only shrink removed, and the reconciler would undo the resize
+    to get back to its previous desired amount.
+    """
+    if cores is None or memory is None:
+        pool_cores, pool_mem = get_total_cores_mem(rp_name)
+        cores = cores if cores is not None else pool_cores
+        memory = memory if memory is not None else pool_mem
+    get_inventory().set_desired_capacity(rp_name, cores, memory)
+
+
+def get_missing_capacity(rp_name):
+    """
+    Returns the cores and memory the workers of a pool are short of its
+    desired capacity, counting the workers that can be reached
+    """
+    desired = get_inventory().get_desired_capacities().get(rp_name, {})
+    workers = get_servers(rp_name, "workers")
+    specs = {
+        server: server_specs
+        for server, server_specs in get_specs(rp_name).items()
+        if server in workers
+    }
+    cores, mem = get_total_cores_mem(rp_name, specs=specs)
+    return (
+        max((desired.get("cores") or 0) - cores, 0),
+        max((desired.get("mem") or 0) - mem, 0),
+    )
+
 
-    workers_yaml_file = "{}/{}/workers.yml".format(POOLS_DIR, rp_name)
-    transfer_servers(workers_list, FLEET_HOSTS_YAML_FILE, workers_yaml_file)
+def remove_pools(rp_names):
+    """
+    Returns every server of the given pools to the fleet, and removes the
+    pools from the inventory, in a single update. Returns a dictionary of
+    pool to the servers that were moved.
+    """
+    click.echo("Moving servers from {} to fleet...".format(", ".join(rp_names)))
+    return get_inventory().delete_pools(rp_names)
 
 
-def run_playbook(playbook_name, hosts_yaml_file):
+def reset_pools(rp_names, check=True):
     """
-    Wrapper function for running playbooks
+    Resets kubeadm on the masters and workers of all the given pools, with
+    a single playbook run, and returns the finished executor.AnsibleRun.
+    check is passed on to check_playbook_run().
     """
-    playbook_cmd = "ansible-playbook {}/{}.yml -i {}".format(
-        PLAYBOOK_DIR, playbook_name, hosts_yaml_file
+    inventory_files = [
+        get_inventory_file(rp_name, role)
+        for rp_name in rp_names
+        for role in ("masters", "workers")
+    ]
+    reset_run = (
+        get_executor()
+        .playbook("{}/reset.yml".format(PLAYBOOK_DIR), inventory_files)
+        .run()
     )
+    return check_playbook_run(reset_run, check)
+
+
+_ansible_executor = None
+
+
+def get_executor():
+    """
+    Returns the executor that runs every ansible command, creating it on
+    first use, so that its workers are shared by all steps of an operation.
+    When the fleet is split into sites, it is a coordinator that runs every
+    command on the executors of the sites it reaches.
+    """
+    global _ansible_executor
+
+    if _ansible_executor is None and get_sites():
+        site_executors = {sites.DEFAULT_SITE: new_executor()}
+        for site in get_sites():
+            site_executors[site.name] = new_executor(site)
+        _ansible_executor = sites.SiteCoordinator(site_executors, get_sites())
+    elif _ansible_executor is None:
+        _ansible_executor = new_executor()
+
+    return _ansible_executor
+
 
-    process = subprocess.Popen(
-        playbook_cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+def close_executor():
+    """
+    Stops the workers of the executor, if one was created
+    """
+    global _ansible_executor
+
+    if _ansible_executor is not None:
+        _ansible_executor.close()
+        _ansible_executor = None
+
+
+def new_executor(site=None):
+    """
+    Returns a new executor on ANSIBLE_BACKEND, run by the controller of the
+    given site, or by the local controller if there is none
+    """
+    if ANSIBLE_BACKEND == "fake":
+        return fake_fleet.FakeFleetExecutor(
+            CALLBACK_PLUGINS_DIR,
+            "{}/.fake_fleet.json".format(ANSIBLE_DIR),
+            SSH_PERSIST,
+        )
+
+    return executor.AnsibleExecutor(
+        CALLBACK_PLUGINS_DIR,
+        ANSIBLE_BACKEND,
+        SSH_CONTROL_DIR,
+        SSH_PERSIST,
+        site.controller if site is not None else (),
+        site.forks if site is not None else None,
     )
-    playbook_cmd_output = str(process.communicate()[0])
 
-    return playbook_cmd_output
+
+_sites = None
 
 
-def transfer_servers(servers_list, from_yaml_file, to_yaml_file):
+def get_sites():
     """
-    Moves given list of servers from one yaml file to the other
+    Returns the sites the fleet is split into, other than the default site
     """
-    from_rp_name = from_yaml_file.split("/")[-2]
-    to_rp_name = to_yaml_file.split("/")[-2]
+    global _sites
 
-    click.echo("Removing servers from {}...".format(from_rp_name))
-    with open(from_yaml_file, "r") as stream:
+    if _sites is None:
         try:
-            from_yaml = yaml.safe_load(stream)
-            for server in servers_list:
-                del from_yaml["all"]["hosts"][server]
-            updated_from_yaml = from_yaml
-        except yaml.YAMLError as exc:
+            _sites = sites.load_sites(SITES_FILE)
+        except sites.SitesError as exc:
             click.echo(exc)
+            sys.exit(1)
 
-    with open(from_yaml_file, "w") as f:
-        yaml.dump(updated_from_yaml, f)
+    return _sites
 
-    click.echo("Adding servers to {}...".format(to_rp_name))
-    with open(to_yaml_file, "r") as stream:
-        try:
-            to_yaml = yaml.safe_load(stream)
-            temp_servers_dict = {}
 
-            current_servers = to_yaml["all"]["hosts"]
-            if current_servers:
-                for server in current_servers:
-                    temp_servers_dict[server] = None
+def get_site_names():
+    return [sites.DEFAULT_SITE] + [site.name for site in get_sites()]
 
-            for server in servers_list:
-                temp_servers_dict[server] = None
 
-            to_yaml["all"]["hosts"] = temp_servers_dict
-            updated_to_yaml = to_yaml
+def verify_site_name(site):
+    if site is not None and site not in get_site_names():
+        click.echo(
+            "There is no site named {}, the sites are: {}".format(
+                site, ", ".join(get_site_names())
+            )
+        )
+        sys.exit(1)
 
-        except yaml.YAMLError as exc:
-            click.echo(exc)
 
-    with open(to_yaml_file, "w") as f:
-        yaml.dump(updated_to_yaml, f)
+def get_pool_site(rp_name):
+    """
+    Returns the site a pool is constrained to, or None if its servers can
+    come from any site
+    """
+    return get_inventory().get_pool_sites().get(rp_name)
+
+
+def get_site_specs(specs, site):
+    """
+    Returns the given specs without the servers that are not in site, or
+    all of them if site is None
+    """
+    if site is None:
+        return specs
+    return {
+        server: server_specs
+        for server, server_specs in specs.items()
+        if sites.get_site(server, get_sites()) == site
+    }
+
+
+class PlaybookFailed(Exception):
+    """
+    Raised when a playbook failed. failed_hosts is the hosts it failed on or
+    could not reach, and is empty if it failed before any host ran it.
+    """
+
+    def __init__(self, playbook_file, failed_hosts, returncode):
+        if failed_hosts:
+            message = "{} failed on {}".format(
+                os.path.basename(playbook_file), ", ".join(failed_hosts)
+            )
+        else:
+            message = "{} exited with code {}".format(
+                os.path.basename(playbook_file), returncode
+            )
+        super().__init__(message)
+        self.failed_hosts = failed_hosts
+        self.returncode = returncode
+
+
+def check_playbook_run(playbook_run, check=True):
+    """
+    Raises PlaybookFailed if a finished playbook run failed on any host or
+    exited with an error. Without check, it is only raised if the playbook
+    failed before any host ran it, and the caller handles the hosts that
+    failed. Returns the run.
+    """
+    if not check and playbook_run.host_status:
+        return playbook_run
+    if playbook_run.failed_hosts or playbook_run.returncode != 0:
+        raise PlaybookFailed(
+            playbook_run.request["playbook"],
+            playbook_run.failed_hosts,
+            playbook_run.returncode,
+        )
+    return playbook_run
+
+
+def run_playbook_file(
+    playbook_file,
+    hosts_yaml_file,
+    limit=None,
+    extra_vars=None,
+    capture=(),
+    check=True,
+):
+    """
+    Runs a playbook to completion, optionally limited to some of the hosts
+    and with extra variables, and returns the finished executor.AnsibleRun.
+    With check, PlaybookFailed is raised if it failed on any host, see
+    check_playbook_run().
+    """
+    playbook_run = (
+        get_executor()
+        .playbook(playbook_file, [hosts_yaml_file], limit, extra_vars, capture)
+        .run()
+    )
+    return check_playbook_run(playbook_run, check)
+
+
+def run_playbook(
+    playbook_name,
+    hosts_yaml_file,
+    limit=None,
+    extra_vars=None,
+    capture=(),
+    check=True,
+):
+    """
+    Wrapper function for running the playbooks in PLAYBOOK_DIR
+    """
+    return run_playbook_file(
+        "{}/{}.yml".format(PLAYBOOK_DIR, playbook_name),
+        hosts_yaml_file,
+        limit,
+        extra_vars,
+        capture,
+        check,
+    )
+
+
+def get_prewarmed(server_list):
+    """
+    Returns the given servers that already have K8S_VERSION installed
+    """
+    return get_inventory().get_prewarmed(server_list, K8S_VERSION)
+
+
+@tracing.traced("install kubernetes")
+def install_k8s(rp_name, role, server_list):
+    """
+    Installs kubernetes on the given servers of a pool, skipping the servers
+    that were prewarmed. Servers that finish the install are recorded as
+    prewarmed, since kubeadm reset does not remove the packages when they
+    later go back to the fleet.
+    Returns the servers that have kubernetes installed afterwards.
+    """
+    prewarmed = get_prewarmed(server_list)
+    cold_servers = [server for server in server_list if server not in prewarmed]
+
+    if prewarmed:
+        click.echo(
+            "Skipping kubernetes install on {} prewarmed servers".format(len(prewarmed))
+        )
+    if not cold_servers:
+        return prewarmed
+
+    install_run = run_playbook(
+        "install_k8s",
+        get_inventory_file(rp_name, role),
+        limit=cold_servers,
+        extra_vars={"k8s_version": K8S_VERSION},
+        check=False,
+    )
+
+    # A server has finished the install if none of its tasks failed
+    ok_hosts = set(install_run.ok_hosts)
+    installed = [server for server in cold_servers if server in ok_hosts]
+
+    get_inventory().mark_prewarmed(installed, K8S_VERSION)
+
+    return prewarmed + installed
+
+
+def start_trace(command):
+    tracing.start_trace(command, argv=sys.argv[1:])
+
+
+def finish_trace(profile=False):
+    """
+    Finishes the trace of the command, saves it as json, and writes its
+    metrics. With profile set, the trace is also printed as a tree.
+    """
+    root = tracing.finish_trace()
+    if root is None:
+        return
+
+    # Kept with the trace, so that the benchmarks can compare them
+    root.attributes["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if _ansible_executor is not None:
+        root.attributes["ansible_runs"] = _ansible_executor.runs_started
+        root.attributes["processes_started"] = _ansible_executor.processes_started
+
+    if profile:
+        click.echo(tracing.summary_table(root), err=True)
+
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        trace_file = "{}/{}-{}-{}.json".format(
+            TRACE_DIR,
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(root.start)),
+            root.name,
+            os.getpid(),
+        )
+        tracing.write_json(root, trace_file)
+
+        # Only the latest traces are kept
+        trace_files = sorted(
+            name for name in os.listdir(TRACE_DIR) if name.endswith(".json")
+        )
+        for name in trace_files[:-TRACES_KEPT]:
+            os.remove("{}/{}".format(TRACE_DIR, name))
+
+        os.makedirs(METRICS_TEXTFILE_DIR, exist_ok=True)
+        tracing.write_prometheus(
+            root, "{}/resource_pool_cli_{}.prom".format(METRICS_TEXTFILE_DIR, root.name)
+        )
+    except OSError as exc:
+        # Failing to save the trace should never fail the command itself
+        click.echo("Could not save the trace: {}".format(exc), err=True)
+
+
+def run_phases(phases):
+    """
+    Runs a PhaseGraph, and then prints how long each phase took, marking
+    the phases on the critical path. If a phase fails, the report is still
+    printed before exiting. The journal of the PhaseGraph, if it has one,
+    is marked as finished once every phase is done.
+    """
+    try:
+        phases.run()
+    except orchestrator.PhaseFailed as exc:
+        click.echo(exc)
+        print_phase_report(phases)
+        if phases.journal is not None:
+            click.echo(
+                "Continue from where it stopped with: resume {}".format(
+                    phases.journal.rp_name
+                )
+            )
+        sys.exit(1)
+
+    print_phase_report(phases)
+    if phases.journal is not None:
+        phases.journal.finish()
+
+
+def print_phase_report(phases):
+    """
+    Prints the start time and duration of every phase of a PhaseGraph,
+    and which phases were skipped
+    """
+    output_table = PrettyTable(["Phase", "Start (s)", "Duration (s)", "Critical"])
+    for name, start, duration, is_critical in phases.report():
+        output_table.add_row(
+            [name, round(start, 1), round(duration, 1), "*" if is_critical else ""]
+        )
+    click.echo(output_table)
+
+    if phases.skipped:
+        click.echo(
+            "Skipped, since they were done before: {}".format(", ".join(phases.skipped))
+        )
+
+
+def setup_master(rp_name, master_server):
+    """
+    Initializes the master server with kubeadm, and saves its unique token
+    and hash into the pool's join playbook, because workers will need these
+    to join this cluster. Returns the join credentials. A master that was
+    partly set up before is reset first, so that a create whose init master
+    phase failed can be resumed.
+    """
+    masters_file = get_inventory_file(rp_name, "masters")
+    setup_run = run_playbook(
+        "setup_master", masters_file, capture=["join token creation"]
+    )
+
+    join_credentials = None
+    for result in setup_run.results_for("join token creation").values():
+        join_credentials = executor.parse_join_command(result.get("stdout", ""))
+
+    if join_credentials is None:
+        raise RuntimeError(
+            "Could not get the join command from master {}".format(master_server)
+        )
+
+    # Dynamically creating unique join playbook for this pool, using the token/hash
+    # that we got from the master. It is written from the template every time,
+    # so that a resumed setup replaces the credentials of the previous one.
+    with open("{}/join.yml".format(TEMPLATE_DIR)) as f:
+        join_playbook = f.read()
+    join_playbook = join_playbook.replace("MASTERIP", master_server).replace(
+        "CREDS",
+        "--token {} --discovery-token-ca-cert-hash {}".format(
+            join_credentials["token"], join_credentials["ca_cert_hash"]
+        ),
+    )
+    with open("{}/{}/join.yml".format(POOLS_DIR, rp_name), "w") as f:
+        f.write(join_playbook)
+
+    return join_credentials
+
+
+@tracing.traced("join workers")
+def join_workers(rp_name, server_list, journal=None):
+    """
+    Joins the given workers of a pool to its master, JOIN_BATCH_SIZE at a
+    time, so the API server of the master is never sent more joins at once
+    than it can take. Workers that fail to join are retried on their own,
+    after a delay that doubles with every round, up to JOIN_RETRIES times.
+    Workers that still fail are reset, moved back to the fleet, and have
+    the failure recorded, which quarantines them.
+    With a journal, the status of every worker is recorded in it, and the
+    workers it has as joined or returned to the fleet are skipped.
+    Returns the list of servers that joined.
+    """
+    workers_file = get_inventory_file(rp_name, "workers")
+
+    # The reason the run_playbook function isn't just called here is
+    # because this is the unique join playbook specific to this pool.
+    join_file = "{}/{}/join.yml".format(POOLS_DIR, rp_name)
+
+    status = {server: "not joined" for server in server_list}
+    if journal is not None:
+        for server in server_list:
+            status[server] = journal.get_host_status(server) or status[server]
+    server_list = [
+        server for server in server_list if status[server] != "returned to fleet"
+    ]
+    attempts = {server: 0 for server in server_list}
+    to_join = [server for server in server_list if status[server] != "joined"]
+
+    for retry in range(JOIN_RETRIES + 1):
+        if retry:
+            delay = JOIN_RETRY_DELAY * 2 ** (retry - 1)
+            click.echo(
+                "Retrying to join {} workers in {} seconds...".format(
+                    len(to_join), delay
+                )
+            )
+            time.sleep(delay)
+
+        for start in range(0, len(to_join), JOIN_BATCH_SIZE):
+            batch = to_join[start : start + JOIN_BATCH_SIZE]
+            join_run = run_playbook_file(
+                join_file, workers_file, limit=batch, check=False
+            )
+
+            ok_hosts = set(join_run.ok_hosts)
+            for server in batch:
+                attempts[server] += 1
+                if server in ok_hosts:
+                    status[server] = "joined"
+                else:
+                    status[server] = join_run.host_status.get(server, "not joined")
+            if journal is not None:
+                journal.set_host_status({server: status[server] for server in batch})
+
+        to_join = [server for server in to_join if status[server] != "joined"]
+        if not to_join:
+            break
+
+    joined = [server for server in server_list if status[server] == "joined"]
+    tracing.current_span().attributes.update(
+        {"joined": len(joined), "failed": len(to_join)}
+    )
+
+    if to_join:
+        output_table = PrettyTable(["Server", "Attempts", "Status"])
+        for server in to_join:
+            output_table.add_row([server, attempts[server], status[server]])
+        click.echo("These workers could not join the pool:")
+        click.echo(output_table)
+
+        run_playbook("reset", workers_file, limit=to_join, check=False)
+        transfer_servers(to_join, rp_name, "fleet")
+        get_inventory().record_checks(
+            [], {server: "kubeadm join {}".format(status[server]) for server in to_join}
+        )
+        if journal is not None:
+            journal.set_host_status({server: "returned to fleet" for server in to_join})
+
+    return joined
+
+
+@tracing.traced("transfer servers")
+def transfer_servers(servers_list, from_rp_name, to_rp_name):
+    """
+    Moves given list of servers from one pool to the other, as a single
+    transaction. Servers moved into a pool become workers.
+    """
+    to_role = inventory.FLEET_ROLE if to_rp_name == "fleet" else "workers"
+
+    click.echo("Moving servers from {} to {}...".format(from_rp_name, to_rp_name))
+    get_inventory().transfer_servers(
+        servers_list, from_rp_name, to_rp_name, to_role, _reservation_token
+    )
 
 
 def has_user_confirmed(warning):
@@ -142,88 +1017,238 @@ def has_user_confirmed(warning):
         return False
 
 
-def get_all_servers_in_yaml_file(yaml_file):
+def get_pool_servers_role(rp_name):
     """
-    Returns a list of all servers in a given hosts yaml file
+    Returns the role of the servers that make up the capacity of a pool.
+    For regular pools, this is only the workers, since the master does not
+    run any workloads.
     """
-    all_servers_in_yaml_file = []
+    if rp_name == "fleet":
+        return inventory.FLEET_ROLE
+
+    return "workers"
+
 
-    with open(yaml_file, "r") as stream:
+def parse_capacity_probe(stdout):
+    """
+    Returns the probe dictionary printed by CAPACITY_PROBE_CMD, or None if
+    it cannot be found in the given output.
+    """
+    for line in reversed(stdout.splitlines()):
+        line = line.strip()
+        if line.startswith("{"):
+            try:
+                return json.loads(line)
+            except ValueError:
+                return None
+
+    return None
+
+
+_capacity_policy = None
+
+
+def get_capacity_policy():
+    """
+    Returns the policy that decides how the capacity of servers is counted
+    """
+    global _capacity_policy
+
+    if _capacity_policy is None:
         try:
-            servers_yaml = yaml.safe_load(stream)
-            servers_list = servers_yaml["all"]["hosts"]
-            for server in servers_list:
-                all_servers_in_yaml_file.append(server)
-        except FileNotFoundError as fnfe:
-            click.echo("{} does not exist".format(yaml_file))
-            sys.exit()
-        except yaml.YAMLError as exc:
+            _capacity_policy = capacity.CapacityPolicy(
+                CPU_ACCOUNTING,
+                CAPACITY_ACCOUNTING != "capacity",
+                KUBE_RESERVED,
+                SYSTEM_RESERVED,
+                EVICTION_HARD,
+            )
+        except capacity.CapacityError as exc:
             click.echo(exc)
+            sys.exit(1)
 
-    return all_servers_in_yaml_file
+    return _capacity_policy
 
 
-def get_specs(rp_name):
+def get_server_specs(probe):
     """
-    Returns a dictionary with all servers, along with their specs.
-    The keys to the dictonary are the server names/ips.
-    The values are dictionaries containing the cpu and mem totals. 
+    Turns the results of a capacity probe into the specs used everywhere
+    else, a dictionary with the server's cores and GB of memory, as counted
+    by the capacity policy, along with its hardware
     """
-    rp_dir = "{}/{}".format(POOLS_DIR, rp_name)
-    server_file_name = "workers.yml"
+    return get_capacity_policy().get_specs(probe)
 
-    if rp_name == "fleet":
-        server_file_name = "hosts.yml"
 
-    ansible_facts_cmd = "ansible all -i {}/{} -m gather_facts --tree {}".format(
-        rp_dir, server_file_name, rp_dir
-    )
-    process = subprocess.Popen(
-        ansible_facts_cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+def iter_capacity_probes(inventory_files, servers):
+    """
+    Runs the capacity probe against the given servers, and yields a
+    (server, probe, reason) tuple for every server as soon as its result
+    comes in. probe is None for the servers that did not answer, and
+    reason says why.
+    """
+    warm_servers = get_executor().get_warm_hosts(servers)
+    probe_run = get_executor().adhoc(
+        inventory_files, "raw", CAPACITY_PROBE_CMD, limit=servers, echo_failures=False
     )
-    ansible_facts_cmd_out = process.communicate()[0]
 
-    specs = {}
+    answered = set()
 
-    # The ansible_facts_cmd saves facts as json inside of files named after the server.
-    # This is why we are looping through the directory, and reading file contents as json.
-    for file in os.listdir(rp_dir):
-        if file.endswith(".yml"):
+    # Unreachable servers are reported by the caller
+    for event in probe_run:
+        if event.get("event") != "runner":
             continue
 
-        with open("{}/{}".format(rp_dir, file), "r") as myfile:
-            data = myfile.read()
-        facts = json.loads(data)
+        server = event["host"]
+        result = event["result"]
+        probe = None
+
+        if event["status"] == "ok":
+            probe = parse_capacity_probe(result.get("stdout", ""))
 
-        # Whether or not a server can be reached, the fact file is generated.
-        # Here, we remove facts from servers that cannot be reachced,
-        # in order to avoid inaccurate spec counts.
-        if "msg" in facts:
-            if facts["msg"].startswith("SSH Error"):
-                os.remove("{}/{}".format(rp_dir, file))
-                continue
+        answered.add(server)
+        if probe is not None:
+            yield server, probe, None
+        elif event["status"] == "unreachable":
+            yield server, None, result.get("msg", "unreachable")
+        else:
+            yield server, None, result.get("msg") or "capacity probe failed"
 
-        this_server_core_count = facts["ansible_facts"]["ansible_processor_cores"]
-        this_server_mem_amount = facts["ansible_facts"]["ansible_memtotal_mb"] / 1024.0
-        specs[file] = {
-            "cores": this_server_core_count,
-            "mem": round(this_server_mem_amount),
-        }
-        os.remove("{}/{}".format(rp_dir, file))
+    # Kept with the trace, since the probe is much faster on servers that
+    # already had a connection open
+    probe_run.span.attributes["warm_connections"] = len(warm_servers)
+
+    # Ansible does not report anything for servers that it never got to,
+    # such as when the run itself fails.
+    for server in servers:
+        if server not in answered:
+            yield server, None, "no result from ansible"
+
+
+def probe_capacity(inventory_files, servers):
+    """
+    Runs the capacity probe against the given servers, and returns 2
+    dictionaries, both keyed by server. The first holds the probe results
+    of the servers that answered. The second holds the reason why each of
+    the other servers did not.
+    """
+    probes = {}
+    unreachable = {}
+    for server, probe, reason in iter_capacity_probes(inventory_files, servers):
+        if probe is not None:
+            probes[server] = probe
+        else:
+            unreachable[server] = reason
 
-    return specs
+    return probes, unreachable
+
+
+def get_specs(rp_name, refresh=False):
+    """
+    Returns a dictionary with all servers, along with their specs.
+    The keys to the dictonary are the server names/ips.
+    The values are dictionaries containing the cpu and mem totals. 
+    """
+    return get_specs_for_pools([rp_name], refresh)[rp_name]
+
+
+@tracing.traced("gather specs")
+def get_specs_for_pools(rp_names, refresh=False, max_age=FACTS_CACHE_TTL):
+    """
+    Returns a dictionary keyed by pool name, where each value is the
+    get_specs() dictionary of that pool.
+    """
+    return {
+        rp_name: specs
+        for rp_name, specs, _ in iter_pool_specs(rp_names, refresh, max_age)
+    }
 
 
-def get_total_cores_mem(rp_name):
+def iter_pool_specs(rp_names, refresh=False, max_age=FACTS_CACHE_TTL):
+    """
+    Yields a (pool name, specs, unreachable) tuple for every given pool, as
+    soon as the specs of all of its servers are known. specs is a get_specs()
+    dictionary, and unreachable is a dictionary of the servers that could
+    not be reached to the reason why. Pools are yielded in the order they
+    complete, and the ones that are fully cached come first.
+
+    Specs are served from the facts cache when possible. Facts are only
+    gathered for servers that are missing from the cache or are older than
+    max_age seconds, or for every server when refresh is set. A max_age of
+    None never expires them. All of these servers, across
+    every given pool, are gathered in a single ansible run, so that the
+    wall time is bound by the slowest host instead of the sum of all pools.
+    """
+    all_specs = {}
+    all_unreachable = {}
+    pending = {}
+    stale_servers = {}
+    stale_pools = []
+
+    for rp_name in rp_names:
+        role = get_pool_servers_role(rp_name)
+        servers = get_servers(rp_name, role)
+        cached_probes = {}
+        if not refresh:
+            cached_probes = get_inventory().get_cached_probes(servers, max_age)
+
+        all_specs[rp_name] = {}
+        all_unreachable[rp_name] = {}
+        pending[rp_name] = set()
+        for server in servers:
+            if server in cached_probes:
+                all_specs[rp_name][server] = get_server_specs(cached_probes[server])
+            else:
+                stale_servers[server] = rp_name
+                pending[rp_name].add(server)
+
+        if pending[rp_name]:
+            stale_pools.append((rp_name, role))
+        else:
+            yield rp_name, all_specs[rp_name], all_unreachable[rp_name]
+
+    if not stale_servers:
+        return
+
+    inventory_files = [
+        get_inventory_file(rp_name, role) for rp_name, role in stale_pools
+    ]
+
+    probes = {}
+    unreachable = {}
+    for server, probe, reason in iter_capacity_probes(inventory_files, stale_servers):
+        rp_name = stale_servers[server]
+        if probe is not None:
+            probes[server] = probe
+            all_specs[rp_name][server] = get_server_specs(probe)
+        else:
+            # Servers that cannot be reached are left out of the specs, in
+            # order to avoid inaccurate spec counts, but the user should
+            # know about them.
+            unreachable[server] = reason
+            all_unreachable[rp_name][server] = reason
+            click.echo("Could not reach {}: {}".format(server, reason), err=True)
+
+        pending[rp_name].discard(server)
+        if not pending[rp_name]:
+            yield rp_name, all_specs[rp_name], all_unreachable[rp_name]
+
+    get_inventory().save_probes(probes)
+    get_inventory().record_checks(probes, unreachable)
+
+
+def get_total_cores_mem(rp_name, refresh=False, specs=None):
     """
     While get_specs() returns detailed pool specs, it is also common that
-    we want to know the total amount of cores and memory in a pool.
+    we want to know the total amount of cores and memory in a pool, as
+    counted by the capacity policy.
     This function returns those 2 totals in a list.
+    Already gathered specs can be passed in to avoid gathering them again.
     """
     pool_core_count = 0
     pool_mem_amount = 0
 
-    specs = get_specs(rp_name)
+    if specs is None:
+        specs = get_specs(rp_name, refresh)
 
     for server in specs:
         this_server_core_count = specs[server]["cores"]
@@ -231,82 +1256,404 @@ def get_total_cores_mem(rp_name):
         pool_core_count += this_server_core_count
         pool_mem_amount += this_server_mem_amount
 
-    return [pool_core_count, round(pool_mem_amount, 2)]
+    return [round(pool_core_count, 2), round(pool_mem_amount, 2)]
 
 
-def get_pool_info_table(rp_name):
+def get_hardware_totals(specs):
     """
-    This returns a nicely formatted representation of a pool.
+    Returns the total sockets, physical cores, vCPUs and GB of memory of
+    the given servers, whatever the capacity policy counts
     """
-    total_cores_mem = get_total_cores_mem(rp_name)
-    pool_core_count = total_cores_mem[0]
-    pool_mem_amount = total_cores_mem[1]
+    totals = {"sockets": 0, "physical_cores": 0, "vcpus": 0, "total_mem": 0}
+    for server_specs in specs.values():
+        for key in totals:
+            totals[key] += server_specs[key]
+    return totals
+
+
+def get_pool_info(rp_name, refresh=False, specs=None, unreachable=None):
+    """
+    Returns a dictionary describing a pool: its name, master, total and
+    desired cores and memory, its hardware totals, and a list of its servers with their specs
+    and whether they could be reached
+    """
+    if specs is None:
+        specs = get_specs(rp_name, refresh)
+    total_cores_mem = get_total_cores_mem(rp_name, specs=specs)
 
     if rp_name == "fleet":
         master_server = "N/A"
     else:
-        master_server = get_all_servers_in_yaml_file(
-            "{}/{}/masters.yml".format(POOLS_DIR, rp_name)
-        )[0]
-
-    output_table = PrettyTable(["Pool Name", rp_name])
-    output_table.add_row(["Cluster Master", master_server])
-    output_table.add_row(["CPU Cores", pool_core_count])
-    output_table.add_row(["GB of RAM", pool_mem_amount])
+        master_server = get_servers(rp_name, "masters")[0]
+
+    desired = get_inventory().get_desired_capacities().get(rp_name, {})
+
+    return {
+        "name": rp_name,
+        "site": get_pool_site(rp_name),
+        "master": master_server,
+        "cores": total_cores_mem[0],
+        "mem": total_cores_mem[1],
+        "desired_cores": desired.get("cores"),
+        "desired_mem": desired.get("mem"),
+        "hardware": get_hardware_totals(specs),
+        "hosts": get_hosts_info(specs, unreachable or {}),
+    }
+
+
+def get_hosts_info(specs, unreachable):
+    """
+    Returns a list with the specs and reachability of every server, for the
+    servers in specs and the ones that could not be reached
+    """
+    hosts = []
+    for server in sorted(set(specs) | set(unreachable)):
+        host_info = {"host": server, "reachable": server in specs}
+        if server in specs:
+            host_info.update(specs[server])
+        else:
+            host_info["reason"] = unreachable[server]
+        hosts.append(host_info)
+    return hosts
+
+
+def format_pool_info_table(pool_info):
+    """
+    Returns a nicely formatted representation of a get_pool_info() dictionary
+    """
+    output_table = PrettyTable(["Pool Name", pool_info["name"]])
+    if pool_info.get("site") is not None:
+        output_table.add_row(["Site", pool_info["site"]])
+    output_table.add_row(["Cluster Master", pool_info["master"]])
+    output_table.add_row(["CPU Cores", pool_info["cores"]])
+    output_table.add_row(["GB of RAM", pool_info["mem"]])
+    if "hardware" in pool_info:
+        output_table.add_row(
+            [
+                "Hardware",
+                "{sockets} sockets, {physical_cores} cores, {vcpus} vCPUs, "
+                "{total_mem} GB".format(**pool_info["hardware"]),
+            ]
+        )
+    if pool_info.get("desired_cores") is not None:
+        output_table.add_row(["Desired CPU Cores", pool_info["desired_cores"]])
+    if pool_info.get("desired_mem") is not None:
+        output_table.add_row(["Desired GB of RAM", pool_info["desired_mem"]])
     return output_table
 
 
+def iter_pool_infos(rp_names, refresh=False):
+    """
+    Yields the get_pool_info() dictionary of every given pool, as soon as
+    the specs of all of its servers are known
+    """
+    for rp_name, specs, unreachable in iter_pool_specs(rp_names, refresh):
+        yield get_pool_info(rp_name, specs=specs, unreachable=unreachable)
+
+
+def get_pool_info_table(rp_name, refresh=False, specs=None):
+    """
+    This returns a nicely formatted representation of a pool.
+    """
+    return format_pool_info_table(get_pool_info(rp_name, refresh, specs))
+
+
+class PlanError(Exception):
+    """
+    Raised when a change to a pool cannot be planned. The message is meant
+    to be shown to the user as it is.
+    """
+
+
+def plan_resize(rp_name, cores, memory, refresh=False, token=None):
+    """
+    Works out how a pool has to change to meet the requested cores and
+    memory, using the placement engine. Returns a dictionary with the type
+    of resize, the servers to add and to remove, the final cores and memory
+    of the pool, and the token the servers to add are reserved under. They
+    are reserved under the token of this process, unless one is given.
+    Raises PlanError if the request is invalid or the resources are not
+    available.
+    """
+    pool_specs = get_specs(rp_name, refresh)
+    pool_core_count, pool_mem_amount = get_total_cores_mem(rp_name, specs=pool_specs)
+
+    # Check whether the user is trying to increase or decrease the cpu/mem.
+    # If they are trying to increase one and decrease the other, the pool
+    # has to be rebalanced by swapping some of its servers with the fleet.
+    resize_type = planner.get_resize_type(
+        pool_core_count, pool_mem_amount, cores, memory
+    )
+    if resize_type is None:
+        raise PlanError(
+            "Your request is invalid. You specified resize parameters that equal the current state of the pool."
+        )
+
+    # A pool that is constrained to a site only grows within it
+    fleet_specs = {}
+    if resize_type != "decrease":
+        site = get_pool_site(rp_name)
+        fleet_specs = get_healthy_specs(
+            get_site_specs(get_specs("fleet", refresh), site)
+        )
+
+    # Placing the request on the fleet and reserving the servers it picked
+    # is one short critical section, so two operations never pick the same
+    # servers. The specs are gathered before it, since that can take long.
+    with get_locks().fleet_lock():
+        fleet_specs = get_available_specs(fleet_specs)
+        plan = planner.Planner(
+            fleet_specs, {rp_name: pool_specs}, get_prewarmed(fleet_specs)
+        ).plan(rp_name, cores, memory)
+
+        if plan["error"] is not None:
+            raise PlanError(
+                "{}\nAvailable cores: {}\nAvailable memory: {} GB".format(
+                    plan["error"], plan["fleet_cores"], plan["fleet_mem"]
+                )
+            )
+
+        servers_to_add = plan["add"]
+        servers_to_remove = plan["remove"]
+        final_core_count = plan["cores"]
+        final_mem_amount = plan["mem"]
+
+        reservation = None
+        if servers_to_add:
+            reservation = reserve_servers(rp_name, servers_to_add, token)
+
+    return {
+        "resize_type": resize_type,
+        "add": servers_to_add,
+        "remove": servers_to_remove,
+        "cores": final_core_count,
+        "mem": final_mem_amount,
+        "reservation": reservation,
+    }
+
+
+def verify_plan(rp_name, servers_to_add, servers_to_remove):
+    """
+    Raises PlanError if a resize plan of a pool went stale since it was
+    made, because the servers it adds left the fleet, or the servers it
+    removes left the pool. It is meant to be called under the pool lock,
+    right before the plan is run.
+    """
+    server_pools = get_inventory().get_server_pools(
+        list(servers_to_add) + list(servers_to_remove)
+    )
+    stale = [server for server in servers_to_add if server_pools.get(server) != "fleet"]
+    stale += [
+        server for server in servers_to_remove if server_pools.get(server) != rp_name
+    ]
+    if stale:
+        raise PlanError(
+            "The {} pool changed since the resize was planned, plan it again: "
+            "{} moved".format(rp_name, ", ".join(sorted(stale)))
+        )
+
+
+@tracing.traced("plan snapshot")
+def get_planner(rp_names, refresh=False, cumulative=False):
+    """
+    Returns a planner.Planner for requests on the given pools, on a snapshot
+    of the fleet and of the pools that exist among them. Cached specs are
+    used however old they are, so only servers that were never probed are
+    connected to, unless refresh is set. Fleet servers that are quarantined
+    or reserved are left out, like they are when pools are created or
+    resized, but no health check is run.
+    """
+    rp_names = [rp_name for rp_name in rp_names if rp_name in get_pool_names()]
+    all_specs = get_specs_for_pools(["fleet"] + rp_names, refresh, max_age=None)
+    fleet_specs = get_available_specs(all_specs.pop("fleet"))
+
+    checks = get_inventory().get_host_checks(fleet_specs)
+    now = time.time()
+    for server, check in checks.items():
+        quarantined_until = get_quarantined_until(check)
+        if quarantined_until is not None and quarantined_until > now:
+            del fleet_specs[server]
+
+    server_sites = {
+        server: sites.get_site(server, get_sites())
+        for specs in [fleet_specs] + list(all_specs.values())
+        for server in specs
+    }
+    return planner.Planner(
+        fleet_specs,
+        all_specs,
+        get_prewarmed(fleet_specs),
+        cumulative,
+        server_sites=server_sites,
+        pool_sites=get_inventory().get_pool_sites(),
+    )
+
+
+@tracing.traced("add workers to pool")
 def add_workers_to_pool(rp_name, server_list):
     """
     1) Adds new servers to an existing pool. 
     2) Makes sure kubernetes is installed on each new server.
     3) Joins them to the master as worker nodes
+    Returns the list of servers that joined.
     """
-    pool_yaml_file = "{}/{}/workers.yml".format(POOLS_DIR, rp_name)
-    transfer_servers(server_list, FLEET_HOSTS_YAML_FILE, pool_yaml_file)
+    transfer_servers(server_list, "fleet", rp_name)
 
-    run_playbook("install_k8s", pool_yaml_file)
+    install_k8s(rp_name, "workers", server_list)
+    return join_workers(rp_name, server_list)
 
-    # The reason the run_playbook function isn't just called here is
-    # because this is a unique join playbook specific to this pool.
-    join_file = "{}/{}/join.yml".format(POOLS_DIR, rp_name)
-    cmd = "ansible-playbook {} -i {}".format(join_file, pool_yaml_file)
 
-    process = subprocess.Popen(
-        cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+def get_node_name(server):
+    """
+    Returns the kubernetes node name that a server registers with
+    """
+    return "ip-{}".format(server.replace(".", "-"))
+
+
+@tracing.traced("evict workers")
+def evict_workers(rp_name, server_list):
+    """
+    Moves workers that can no longer be reached out of a pool and back into
+    the fleet. They cannot be drained or reset, so their nodes are only
+    deleted from the cluster, and their failed checks keep them quarantined
+    in the fleet for as long as they stay down.
+    """
+    node_names = [get_node_name(server) for server in server_list]
+    get_executor().adhoc(
+        [get_inventory_file(rp_name, "masters")],
+        "shell",
+        "KUBECONFIG=/etc/kubernetes/admin.conf kubectl delete node --wait=false {}".format(
+            " ".join(node_names)
+        ),
+    ).run()
+
+    transfer_servers(server_list, rp_name, "fleet")
+
+
+def get_node_readiness(rp_name):
+    """
+    Asks the master of a pool for the state of its nodes, and returns a
+    dictionary of node name to whether the node is Ready
+    """
+    # This is polled while the cluster comes up, so failures are expected
+    nodes_run = get_executor().adhoc(
+        [get_inventory_file(rp_name, "masters")],
+        "shell",
+        "KUBECONFIG=/etc/kubernetes/admin.conf kubectl get nodes -o json",
+        echo_failures=False,
     )
-    join_output = str(process.communicate()[0])
 
+    node_readiness = {}
+    for event in nodes_run:
+        if event.get("event") == "runner" and event["status"] == "ok":
+            node_readiness = readiness.parse_node_readiness(
+                event["result"].get("stdout", "")
+            )
+    return node_readiness
 
-def return_workers_to_fleet(rp_name, server_list):
+
+def wait_for_master(rp_name):
     """
-    1) Drains nodes and deletes them from the k8s cluster (done from master).
-    2) Resets kubeadm state on the nodes (done from nodes themselves).
-    3) Moves servers back into the fleet.
+    Waits until the API server on the master of a pool is healthy.
+    Returns the number of seconds spent waiting.
+    """
+    master_server = get_servers(rp_name, "masters")[0]
+    return readiness.wait_for(
+        lambda: get_executor().is_apiserver_healthy(master_server), READY_TIMEOUT
+    )
+
 
-    run_playbook() is not used in this block of code because these playbook
-    commands utilize extra arguments such as --extra-vars and --limit, which
-    are needed here, but not widely used in the rest of the code. 
+def wait_for_nodes(rp_name, server_list):
     """
-    master_yaml_file = "{}/{}/masters.yml".format(POOLS_DIR, rp_name)
-    workers_yaml_file = "{}/{}/workers.yml".format(POOLS_DIR, rp_name)
+    Waits until the nodes of the given servers are Ready.
+    Returns the number of seconds spent waiting.
+    """
+    node_names = [get_node_name(server) for server in server_list]
 
-    for server in server_list:
-        node_name = "ip-{}".format(server.replace(".", "-"))
-        cmd = "ansible-playbook {}/drain.yml -i {} --extra-vars node={}".format(
-            PLAYBOOK_DIR, master_yaml_file, node_name
-        )
-        process = subprocess.Popen(
-            cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        drain_output = str(process.communicate()[0])
+    def are_nodes_ready():
+        node_readiness = get_node_readiness(rp_name)
+        return all(node_readiness.get(node_name) for node_name in node_names)
 
-        cmd = "ansible-playbook {}/reset.yml -i {} --limit {}".format(
-            PLAYBOOK_DIR, workers_yaml_file, server
-        )
-        process = subprocess.Popen(
-            cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    # Every check is an ansible run against the master, so start slower
+    # than for the API server.
+    return readiness.wait_for(
+        are_nodes_ready, READY_TIMEOUT, initial_delay=2.0, max_delay=15.0
+    )
+
+
+@tracing.traced("return workers to fleet")
+def return_workers_to_fleet(rp_name, server_list, concurrency=DRAIN_CONCURRENCY):
+    """
+    1) Drains nodes and deletes them from the k8s cluster (done from master).
+       All nodes are drained by a single playbook run, up to `concurrency`
+       at a time. kubectl drain evicts pods, so PodDisruptionBudgets are
+       respected, and a node that cannot be drained within DRAIN_TIMEOUT
+       is reported as failed instead of blocking the rest.
+    2) Resets kubeadm state on the drained nodes (done from nodes themselves),
+       with a single playbook run limited to those nodes.
+    3) Moves only the servers that were drained and reset back into the fleet.
+
+    Returns the list of servers that were moved back into the fleet. Raises
+    RuntimeError after moving them if any server was left in the pool.
+    """
+    master_yaml_file = get_inventory_file(rp_name, "masters")
+    workers_yaml_file = get_inventory_file(rp_name, "workers")
+
+    servers_by_node = {get_node_name(server): server for server in server_list}
+    status = {server: "drain failed" for server in server_list}
+
+    click.echo("Draining {} nodes...".format(len(server_list)))
+    drain_run = run_playbook(
+        "drain",
+        master_yaml_file,
+        extra_vars={
+            "nodes": ",".join(servers_by_node),
+            "drain_concurrency": concurrency,
+            "drain_timeout": DRAIN_TIMEOUT,
+        },
+        capture=["drain nodes"],
+    )
+
+    # The drain playbook prints one "DRAINED <node>" or "FAILED <node>"
+    # line per node.
+    for result in drain_run.results_for("drain nodes").values():
+        for line in result.get("stdout_lines", []):
+            words = line.split()
+            if len(words) == 2 and words[0] == "DRAINED":
+                server = servers_by_node.get(words[1])
+                # A drained node is only left to fail in the reset step
+                if server:
+                    status[server] = "reset failed"
+
+    drained_servers = [
+        server for server in server_list if status[server] == "reset failed"
+    ]
+
+    if drained_servers:
+        click.echo("Resetting {} nodes...".format(len(drained_servers)))
+        reset_run = run_playbook(
+            "reset", workers_yaml_file, limit=drained_servers, check=False
         )
-        reset_output = str(process.communicate()[0])
+        for server in reset_run.ok_hosts:
+            if server in status:
+                status[server] = "returned to fleet"
 
-    transfer_servers(server_list, workers_yaml_file, FLEET_HOSTS_YAML_FILE)
\ No newline at end of file
+    returned_servers = [
+        server for server in server_list if status[server] == "returned to fleet"
+    ]
+
+    output_table = PrettyTable(["Server", "Status"])
+    for server in server_list:
+        output_table.add_row([server, status[server]])
+    click.echo(output_table)
+
+    if returned_servers:
+        transfer_servers(returned_servers, rp_name, "fleet")
+
+    if len(returned_servers) < len(server_list):
+        raise RuntimeError(
+            "{} of {} workers could not be returned to the fleet".format(
+                len(server_list) - len(returned_servers), len(server_list)
+            )
+        )
+    return returned_servers
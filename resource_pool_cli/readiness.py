@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+"""
+Readiness checks for new clusters. Rather than sleeping for a fixed amount
+of time and hoping that the control plane or the workers are up, these
+poll for the actual state with exponential backoff, so the next step can
+start as soon as the cluster is ready.
+"""
+
+import json
+import ssl
+import time
+import urllib.error
+import urllib.request
+
+APISERVER_PORT = 6443
+
+
+class ReadinessTimeout(Exception):
+    pass
+
+
+def wait_for(check, timeout, initial_delay=1.0, max_delay=10.0):
+    """
+    Calls check() until it returns True, doubling the delay between calls
+    up to max_delay. Returns the number of seconds spent waiting, or raises
+    ReadinessTimeout if check() is still not True after timeout seconds.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    delay = initial_delay
+
+    while True:
+        if check():
+            return time.monotonic() - start
+
+        now = time.monotonic()
+        if now >= deadline:
+            raise ReadinessTimeout(
+                "Still not ready after {:.0f} seconds".format(now - start)
+            )
+
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, max_delay)
+
+
+def apiserver_healthz_url(master_server):
+    return "https://{}:{}/healthz".format(master_server, APISERVER_PORT)
+
+
+def is_apiserver_healthy(url, request_timeout=2):
+    """
+    Returns True if the given healthz endpoint answers "ok"
+    """
+    # kubeadm generates a self signed certificate for the API server, and
+    # the healthz endpoint does not need any credentials.
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    try:
+        with urllib.request.urlopen(
+            url, timeout=request_timeout, context=context
+        ) as response:
+            return response.status == 200 and response.read().strip() == b"ok"
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def parse_node_readiness(kubectl_nodes_json):
+    """
+    Takes the output of `kubectl get nodes -o json`, and returns a
+    dictionary of node name to whether the node is Ready
+    """
+    try:
+        nodes = json.loads(kubectl_nodes_json)["items"]
+    except (ValueError, KeyError, TypeError):
+        return {}
+
+    node_readiness = {}
+    for node in nodes:
+        conditions = node.get("status", {}).get("conditions", [])
+        node_readiness[node["metadata"]["name"]] = any(
+            condition["type"] == "Ready" and condition["status"] == "True"
+            for condition in conditions
+        )
+    return node_readiness
@@ -0,0 +1,354 @@
+#!/usr/bin/python3
+
+"""
+Auto healing for pools. Every pool keeps the cores and memory it was
+created or last resized to as its desired capacity, and the reconciler
+keeps it there. Workers that stop answering are moved out of the pool,
+and replacements are pulled in from the fleet through the same path that
+resize uses to grow a pool.
+
+Detection is incremental rather than a full get_specs() sweep. Each pass
+probes at most check_budget workers, starting with the ones whose capacity
+is unknown and then the ones checked longest ago, so the load on the
+servers stays bounded however large the pools grow. A worker is only
+considered down after failure_threshold failed checks in a row, so a
+single dropped ssh connection does not get a server replaced.
+
+Pools whose last create or resize failed partway are left alone, and
+reported, until that operation is resumed.
+
+Every step is written as a json line to the events file. Every pass also
+writes gauges for the Prometheus textfile collector, with how many workers
+it checked, how long a full round of checks takes at this budget, and how
+long it took from detecting a drift to having the replacements in place.
+"""
+
+import json
+import math
+import time
+
+import click
+
+import locks
+import placement
+import pool_helpers as rp
+import tracing
+
+
+class Reconciler:
+    def __init__(
+        self,
+        check_budget=rp.RECONCILE_CHECK_BUDGET,
+        failure_threshold=rp.RECONCILE_FAILURES,
+        interval=rp.RECONCILE_INTERVAL,
+        events_file=rp.EVENTS_FILE,
+        metrics_file=None,
+    ):
+        self.check_budget = check_budget
+        self.failure_threshold = failure_threshold
+        self.interval = interval
+        self.events_file = events_file
+        self.metrics_file = metrics_file
+
+        # Seconds from detecting a drift to healing it, by pool, for the
+        # pools healed since this reconciler started
+        self.heal_latency = {}
+
+    def emit(self, event, rp_name=None, **details):
+        """
+        Logs an event to the events file, and shows it
+        """
+        record = {"time": time.time(), "event": event, "pool": rp_name}
+        record.update(details)
+        with open(self.events_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+        click.echo(
+            "{} {}{}".format(
+                time.strftime("%Y-%m-%d %H:%M:%S"),
+                event,
+                "".join(
+                    " {}={}".format(key, value)
+                    for key, value in [("pool", rp_name)] + sorted(details.items())
+                    if value is not None
+                ),
+            )
+        )
+
+    def run(self):
+        """
+        Runs a pass every interval seconds, until interrupted
+        """
+        workers_count = sum(
+            len(rp.get_servers(rp_name, "workers"))
+            for rp_name in rp.get_inventory().get_desired_capacities()
+        )
+        click.echo(
+            "Checking up to {} of {} workers every {} seconds. A worker that goes "
+            "down is noticed within {} seconds.".format(
+                self.check_budget,
+                workers_count,
+                self.interval,
+                self.detection_bound(workers_count),
+            )
+        )
+
+        while True:
+            start = time.monotonic()
+            try:
+                self.run_once()
+            except (Exception, SystemExit) as exc:
+                # A failed pass must not stop the healing of the next ones
+                self.emit("pass_failed", error=str(exc))
+            time.sleep(max(self.interval - (time.monotonic() - start), 0))
+
+    def detection_bound(self, workers_count):
+        """
+        Returns the most seconds it can take to notice a worker is down,
+        which is how long it takes to check every worker failure_threshold
+        times at this budget
+        """
+        rounds = math.ceil(workers_count / float(max(self.check_budget, 1)))
+        return max(rounds, 1) * self.interval * self.failure_threshold
+
+    @tracing.traced("reconcile")
+    def run_once(self):
+        """
+        Checks the next batch of workers, and then heals every pool that is
+        below its desired capacity
+        """
+        start = time.monotonic()
+        desired = rp.get_inventory().get_desired_capacities()
+        pool_workers = {
+            rp_name: rp.get_servers(rp_name, "workers") for rp_name in desired
+        }
+
+        checked = self.check_workers(pool_workers)
+
+        missing = {}
+        for rp_name in sorted(desired):
+            # Pools that another operation is changing are left alone until
+            # the next pass
+            try:
+                with rp.get_locks().pool_lock(rp_name, "reconcile"):
+                    # A create or resize that failed partway has to be
+                    # resumed first, since a pool whose master never came
+                    # up cannot have workers joined to it
+                    journal = rp.load_journal(rp_name)
+                    if journal is not None and not journal.is_finished:
+                        self.emit(
+                            "pool_unfinished",
+                            rp_name,
+                            operation=journal.operation,
+                            resume="resume {}".format(rp_name),
+                        )
+                        continue
+                    missing[rp_name] = self.reconcile_pool(
+                        rp_name, desired[rp_name], pool_workers[rp_name]
+                    )
+            except locks.LockBusy as exc:
+                self.emit("pool_busy", rp_name, reason=str(exc))
+
+        # Servers reserved for a heal that did not get to transfer them
+        rp.release_reservations()
+
+        if self.metrics_file is not None:
+            workers_count = sum(len(servers) for servers in pool_workers.values())
+            self.write_metrics(
+                workers_count, checked, time.monotonic() - start, missing
+            )
+
+    def check_workers(self, pool_workers):
+        """
+        Probes up to check_budget workers, and records which of them
+        answered. Returns the number of workers probed.
+        """
+        inventory_store = rp.get_inventory()
+        server_pools = {
+            server: rp_name
+            for rp_name, servers in pool_workers.items()
+            for server in servers
+        }
+        if not server_pools:
+            return 0
+
+        probes = inventory_store.get_cached_probes(server_pools, None)
+        checks = inventory_store.get_host_checks(server_pools)
+
+        # Workers whose capacity is unknown go first, such as the ones that
+        # just joined, and then the ones that were checked longest ago.
+        to_check = sorted(
+            server_pools,
+            key=lambda server: (
+                server in probes,
+                checks.get(server, {}).get("checked_at", 0),
+            ),
+        )[: self.check_budget]
+
+        inventory_files = [
+            rp.get_inventory_file(rp_name, "workers")
+            for rp_name in sorted({server_pools[server] for server in to_check})
+        ]
+        probes, unreachable = rp.probe_capacity(inventory_files, to_check)
+
+        inventory_store.save_probes(probes)
+        inventory_store.record_checks(probes, unreachable)
+
+        checks = inventory_store.get_host_checks(unreachable)
+        for server, reason in sorted(unreachable.items()):
+            self.emit(
+                "worker_unreachable",
+                server_pools[server],
+                server=server,
+                failures=checks[server]["failures"],
+                reason=reason,
+            )
+
+        return len(to_check)
+
+    def reconcile_pool(self, rp_name, desired, servers):
+        """
+        Compares a pool's capacity to its desired capacity, and heals it if
+        it is below. Returns the missing cores and memory.
+        """
+        inventory_store = rp.get_inventory()
+        probes = inventory_store.get_cached_probes(servers, None)
+        checks = inventory_store.get_host_checks(servers)
+
+        down = [
+            server
+            for server in servers
+            if checks.get(server, {}).get("failures", 0) >= self.failure_threshold
+        ]
+        specs = {
+            server: rp.get_server_specs(probes[server])
+            for server in servers
+            if server in probes and server not in down
+        }
+        cores, mem = rp.get_total_cores_mem(rp_name, specs=specs)
+
+        missing_cores = max((desired["cores"] or 0) - cores, 0)
+        missing_mem = max((desired["mem"] or 0) - mem, 0)
+
+        if not down and not missing_cores and not missing_mem:
+            if desired["drift_since"] is not None:
+                inventory_store.set_drift_since(rp_name, None)
+            return 0, 0
+
+        # The capacity of workers that were never probed is not known yet,
+        # and they are first in line to be checked by the next pass
+        if any(server not in probes and server not in down for server in servers):
+            return missing_cores, missing_mem
+
+        drift_since = desired["drift_since"]
+        if drift_since is None:
+            drift_since = time.time()
+            inventory_store.set_drift_since(rp_name, drift_since)
+            self.emit(
+                "drift_detected",
+                rp_name,
+                cores=cores,
+                mem=mem,
+                desired_cores=desired["cores"],
+                desired_mem=desired["mem"],
+                down=down or None,
+            )
+
+        if down:
+            rp.evict_workers(rp_name, down)
+            self.emit("workers_evicted", rp_name, servers=down)
+
+        if missing_cores or missing_mem:
+            fleet_specs = rp.get_site_specs(
+                rp.get_specs("fleet"), rp.get_pool_site(rp_name)
+            )
+            fleet_specs = rp.get_healthy_specs(fleet_specs)
+            with rp.get_locks().fleet_lock():
+                fleet_specs = rp.get_available_specs(fleet_specs)
+                placement_result = placement.select_servers(
+                    fleet_specs,
+                    missing_cores or None,
+                    missing_mem or None,
+                    preferred=rp.get_prewarmed(fleet_specs),
+                )
+                if placement_result is not None:
+                    rp.reserve_servers(rp_name, placement_result["servers"])
+
+            if placement_result is None:
+                fleet_cores, fleet_mem = rp.get_total_cores_mem(
+                    "fleet", specs=fleet_specs
+                )
+                self.emit(
+                    "heal_blocked",
+                    rp_name,
+                    missing_cores=missing_cores,
+                    missing_mem=missing_mem,
+                    fleet_cores=fleet_cores,
+                    fleet_mem=fleet_mem,
+                )
+                return missing_cores, missing_mem
+
+            self.emit(
+                "replacement_started", rp_name, servers=placement_result["servers"]
+            )
+            joined = rp.add_workers_to_pool(rp_name, placement_result["servers"])
+
+            # The workers that could not join went back to the fleet, and the
+            # next pass finds replacements for them
+            failed = [
+                server for server in placement_result["servers"] if server not in joined
+            ]
+            if failed:
+                self.emit("replacement_failed", rp_name, servers=failed)
+                return missing_cores, missing_mem
+
+        latency = time.time() - drift_since
+        self.heal_latency[rp_name] = latency
+        inventory_store.set_drift_since(rp_name, None)
+        self.emit("healed", rp_name, latency="{:.1f}".format(latency))
+        return 0, 0
+
+    def write_metrics(self, workers_count, checked, duration, missing):
+        tracing.write_gauges(
+            self.metrics_file,
+            [
+                (
+                    "resource_pool_cli_reconciler_workers",
+                    "Workers of pools with a desired capacity.",
+                    [({}, workers_count)],
+                ),
+                (
+                    "resource_pool_cli_reconciler_workers_checked",
+                    "Workers probed in the last reconciler pass.",
+                    [({}, checked)],
+                ),
+                (
+                    "resource_pool_cli_reconciler_pass_duration_seconds",
+                    "Duration of the last reconciler pass.",
+                    [({}, duration)],
+                ),
+                (
+                    "resource_pool_cli_reconciler_detection_bound_seconds",
+                    "Most time it takes to notice a worker is down at the current budget.",
+                    [({}, self.detection_bound(workers_count))],
+                ),
+                (
+                    "resource_pool_cli_reconciler_missing_cores",
+                    "Cores a pool is below its desired capacity.",
+                    [({"pool": name}, cores) for name, (cores, _) in missing.items()],
+                ),
+                (
+                    "resource_pool_cli_reconciler_missing_mem_gb",
+                    "GB of memory a pool is below its desired capacity.",
+                    [({"pool": name}, mem) for name, (_, mem) in missing.items()],
+                ),
+                (
+                    "resource_pool_cli_reconciler_heal_latency_seconds",
+                    "Time from detecting a drift to healing it, for the last heal of a pool.",
+                    [
+                        ({"pool": name}, latency)
+                        for name, latency in sorted(self.heal_latency.items())
+                    ],
+                ),
+            ],
+        )
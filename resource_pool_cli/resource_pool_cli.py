@@ -1,344 +1,921 @@
 #!/usr/bin/python3
 
 import click
+import json
 import sys
 import os
 import subprocess
-import time
-import fileinput
 import shutil
+import time
+
+from prettytable import PrettyTable
 
 # Chose to import helper functions as rp to make it easier to understand
 # that these rp.* function are defined in another file.
 import pool_helpers as rp
+import placement
+import orchestrator
+import reconciler
+import service
+import tracing
 
 # Using the import * here to bring in the DIR varibales
 from pool_helpers import *
 
 
 @click.group(context_settings={"help_option_names": ["-h", "--help"]})
-def cli():
-    pass
+@click.option("--profile", is_flag=True, help="Print where the time went once done")
+@click.option(
+    "--local",
+    is_flag=True,
+    help="Run the command here, even if the resource pool service is running",
+)
+@click.pass_context
+def cli(ctx, profile, local):
+    # Every command is traced, and the trace is saved once it is done, even
+    # if the command exits early.
+    rp.start_trace(ctx.invoked_subcommand)
+    ctx.call_on_close(lambda: rp.finish_trace(profile))
+
+    # Servers this command reserved but never transferred, for example
+    # because it failed, are given back on the way out
+    ctx.call_on_close(rp.release_reservations)
+
+    # The ansible workers are stopped rather than left for the exit to kill
+    ctx.call_on_close(rp.close_executor)
+
+    # When the service is running, commands are sent to it instead
+    ctx.obj = {"client": None}
+    if not local and ctx.invoked_subcommand not in ("serve", "reconcile"):
+        ctx.obj["client"] = service.get_client(rp.SERVICE_SOCKET)
+
+
+def get_service_client():
+    return click.get_current_context().obj["client"]
+
+
+def run_job(client, argv, detach):
+    """
+    Starts a command as a job of the service, and prints its output as it
+    comes in, unless detach is set
+    """
+    job = client.start_job(argv)
+    if detach:
+        click.echo(
+            "Started job {}, follow it with: jobs {}".format(job["id"], job["id"])
+        )
+        return
+    follow_job(client, job["id"])
+
+
+def follow_job(client, job_id):
+    since = 0
+    while True:
+        job = client.get_job(job_id, since)
+        for line in job["output"]:
+            click.echo(line)
+        since = job["next"]
+
+        if job["status"] != "running":
+            if job["returncode"]:
+                sys.exit(job["returncode"])
+            return
+        time.sleep(0.5)
+
+
+@cli.command("serve", short_help="Run the resource pool service")
+@click.option(
+    "--refresh-interval",
+    type=int,
+    default=rp.FACTS_CACHE_TTL // 2,
+    help="Seconds between gathering the specs that expired",
+)
+def serve(refresh_interval):
+    # The service runs for too long to keep a trace of it. Its jobs are
+    # traced, since they run as commands of their own.
+    tracing.stop_trace()
+    service.serve(rp.SERVICE_SOCKET, refresh_interval)
+
+
+@cli.command("jobs", short_help="List or follow jobs of the service")
+@click.argument("job_id", required=False)
+def jobs(job_id):
+    client = get_service_client()
+    if client is None:
+        click.echo("The resource pool service is not running")
+        sys.exit(1)
+
+    if job_id:
+        follow_job(client, job_id)
+        return
+
+    output_table = PrettyTable(["Job", "Command", "Status", "Duration (s)"])
+    for job in client.get_jobs():
+        end = job["finished"] or time.time()
+        output_table.add_row(
+            [
+                job["id"],
+                " ".join(job["argv"]),
+                job["status"],
+                round(end - job["started"], 1),
+            ]
+        )
+    click.echo(output_table)
+
+
+OUTPUT_OPTION = click.option(
+    "--output",
+    "-o",
+    type=click.Choice(["table", "json", "ndjson"]),
+    default="table",
+    help="ndjson prints every pool as one line of json as soon as it is known",
+)
 
 
 @cli.command("list", short_help="List all pools")
-def list():
-    for file in os.listdir(POOLS_DIR):
-        click.echo(rp.get_pool_info_table(file))
+@click.option(
+    "--refresh", is_flag=True, help="Re-gather facts instead of using the cache"
+)
+@OUTPUT_OPTION
+def list(refresh, output):
+    show_pools(rp.get_pool_names(), refresh, output)
 
 
 @cli.command("show", short_help="Show pool info")
-@click.argument("rp_name")
-def show(rp_name):
-    rp.verify_rp_name(rp_name)
-    click.echo(rp.get_pool_info_table(rp_name))
+@click.argument("rp_names", nargs=-1, required=True)
+@click.option(
+    "--refresh", is_flag=True, help="Re-gather facts instead of using the cache"
+)
+@OUTPUT_OPTION
+def show(rp_names, refresh, output):
+    for rp_name in rp_names:
+        rp.verify_rp_name(rp_name)
+    show_pools(rp_names, refresh, output)
+
+
+def show_pools(rp_names, refresh, output):
+    # Specs for every pool are gathered in one pass, rather than one pool at
+    # a time, and every pool comes out of it as soon as its specs are known
+    client = get_service_client()
+    if client is not None:
+        pool_infos = client.iter_pools(rp_names, refresh)
+    else:
+        pool_infos = rp.iter_pool_infos(rp_names, refresh)
+
+    if output == "ndjson":
+        for pool_info in pool_infos:
+            click.echo(json.dumps(pool_info))
+        return
+
+    # The other outputs keep the pools in the order they were asked for
+    pool_infos = {pool_info["name"]: pool_info for pool_info in pool_infos}
+    pool_infos = [pool_infos[rp_name] for rp_name in rp_names]
+
+    if output == "json":
+        click.echo(json.dumps({"pools": pool_infos}, indent=2))
+        return
+
+    for pool_info in pool_infos:
+        click.echo(rp.format_pool_info_table(pool_info))
 
 
 @cli.command("create", short_help="Create new pool")
 @click.argument("rp_name")
 @click.option("--cores", "-c", type=int)
 @click.option("--memory", "-m", type=int)
-def create(rp_name, cores, memory):
+@click.option(
+    "--refresh", is_flag=True, help="Re-gather facts instead of using the cache"
+)
+@click.option(
+    "--site", "-s", help="Only use servers of this site, now and when resized"
+)
+@click.option(
+    "--detach", is_flag=True, help="Do not wait for the service to finish the job"
+)
+def create(rp_name, cores, memory, refresh, site, detach):
     if not cores or not memory:
         click.echo("You must specify cores and memory")
-        sys.exit()
+        sys.exit(1)
+    rp.verify_site_name(site)
 
-    click.echo("Analyzing hardware inventory...")
-    fleet_specs = rp.get_specs("fleet")
-
-    total_cores = 0
-    total_memory = 0
-    masters_list = []
-    workers_list = []
-
-    # Pick a server with a high core count to be the master
-    highest_core_count = 0
-    for server in fleet_specs:
-        this_server_cores = fleet_specs[server]["cores"]
-        if this_server_cores > highest_core_count:
-            highest_core_count = this_server_cores
-            masters_list.clear()
-            masters_list.append(server)
-
-    # Try to add other servers as workers, until request is met
-    for server in fleet_specs:
-        if server in masters_list:
-            continue
-        if total_cores < cores or total_memory < memory:
-            this_server_cores = fleet_specs[server]["cores"]
-            total_cores += this_server_cores
-            this_server_memory = fleet_specs[server]["mem"]
-            total_memory += this_server_memory
-            workers_list.append(server)
+    client = get_service_client()
+    if client is not None:
+        argv = ["create", rp_name, "--cores", cores, "--memory", memory]
+        if refresh:
+            argv.append("--refresh")
+        if site:
+            argv += ["--site", site]
+        run_job(client, argv, detach)
+        return
 
-    resources_fulfilled = True
+    with rp.pool_lock(rp_name, "create"):
+        create_pool(rp_name, cores, memory, refresh, site)
 
-    # Resource fulfilment is assumed, but now we have to verify before moving forward.
-    if total_cores < cores:
-        click.echo(
-            "There are not enough cores available to create a new resource pool."
-        )
-        click.echo("Total cores available: {}".format(total_cores))
-        resources_fulfilled = False
-    if total_memory < memory:
-        click.echo(
-            "There is not enough memory available to create a new resource pool."
+
+def create_pool(rp_name, cores, memory, refresh, site=None):
+    click.echo("Analyzing hardware inventory...")
+    fleet_specs = rp.get_site_specs(rp.get_specs("fleet", refresh), site)
+    fleet_specs = rp.get_healthy_specs(fleet_specs)
+
+    # The master and workers are picked and reserved under the fleet lock,
+    # so that other operations cannot pick the same servers
+    with rp.get_locks().fleet_lock():
+        fleet_specs = rp.get_available_specs(fleet_specs)
+        masters_list = []
+
+        # Pick a server with a high core count to be the master
+        highest_core_count = 0
+        for server in fleet_specs:
+            this_server_cores = fleet_specs[server]["cores"]
+            if this_server_cores > highest_core_count:
+                highest_core_count = this_server_cores
+                masters_list.clear()
+                masters_list.append(server)
+
+        # The rest of the fleet is handed to the placement engine, which picks
+        # the workers that meet the request with the least overshoot.
+        worker_candidates = {
+            server: fleet_specs[server]
+            for server in fleet_specs
+            if server not in masters_list
+        }
+        placement_result = placement.select_servers(
+            worker_candidates,
+            cores,
+            memory,
+            preferred=rp.get_prewarmed(worker_candidates),
+            min_servers=1,
         )
-        click.echo("Total memory available: {} GB".format(total_memory))
-        resources_fulfilled = False
 
-    if not resources_fulfilled:
-        sys.exit()
+        if placement_result is None:
+            total_cores_mem = rp.get_total_cores_mem("fleet", specs=worker_candidates)
+            click.echo(
+                "There are not enough resources available to create a new resource pool."
+            )
+            click.echo("Total cores available: {}".format(total_cores_mem[0]))
+            click.echo("Total memory available: {} GB".format(total_cores_mem[1]))
+            sys.exit(1)
+
+        workers_list = placement_result["servers"]
+        rp.reserve_servers(rp_name, masters_list + workers_list)
 
     click.echo("Creating RP with {} cores and {}GB of memory...".format(cores, memory))
 
     # Initialzing the new pool
     rp.init_pool_dir(rp_name)
-    rp.init_pool(rp_name, masters_list, workers_list)
-
-    masters_file = "{}/{}/masters.yml".format(POOLS_DIR, rp_name)
-    master_server = get_all_servers_in_yaml_file(masters_file)
-    master_server = master_server[0]
-
-    # Initialzing the master server, and saving it's unique token and hash
-    # because workers will need this to join this cluster
-    click.echo("Initializing master server...")
-    rp.run_playbook("install_k8s", masters_file)
-    kubeadm_init_output = rp.run_playbook("setup_master", masters_file)
-
-    token = kubeadm_init_output.split("--token")[1].split()[0]
-    cert_hash = kubeadm_init_output.split("--discovery-token-ca-cert-hash")[1].split()[
-        0
-    ]
-
-    # Dynamically creating unique join playbook for this pool, using the token/hash
-    # that we got from the master.
-    join_file = "{}/{}/join.yml".format(POOLS_DIR, rp_name)
-    with fileinput.FileInput(join_file, inplace=True) as file:
-        for line in file:
-            print(line.replace("MASTERIP", master_server), end="")
-
-    with fileinput.FileInput(join_file, inplace=True) as file:
-        for line in file:
-            print(
-                line.replace(
-                    "CREDS",
-                    "--token {} --discovery-token-ca-cert-hash {}".format(
-                        token, cert_hash
-                    ),
-                ),
-                end="",
-            )
+    rp.init_pool(rp_name, masters_list, workers_list, cores, memory, site)
 
-    # We sleep here, because the workers cannot try to join the master until
-    # it is ready, which takes about 30 seconds.
-    click.echo("waiting for master to be ready...")
-    time.sleep(35)
+    # From here on, every phase is journaled, so that a create that fails
+    # partway through can be resumed
+    journal = rp.start_journal(
+        rp_name, "create", {"masters": masters_list, "workers": workers_list}
+    )
+    provision_pool(rp_name, masters_list, workers_list, journal)
 
-    click.echo("Joining workers to the master...")
-    workers_file = "{}/{}/workers.yml".format(POOLS_DIR, rp_name)
-    rp.run_playbook("install_k8s", workers_file)
 
-    # The reason the run_playbook function isn't just called here is
-    # because this is the unique join playbook specific to this pool.
-    join_cmd = "ansible-playbook {} -i {}".format(join_file, workers_file)
-    process = subprocess.Popen(
-        join_cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+def provision_pool(rp_name, masters_list, workers_list, journal):
+    masters_file = rp.get_inventory_file(rp_name, "masters")
+    master_server = masters_list[0]
+
+    # Installing kubernetes on the workers does not depend on the master at
+    # all, so it runs alongside the master install and init. The workers
+    # only need to wait for the master before joining it.
+    phases = orchestrator.PhaseGraph(journal=journal)
+    phases.add("install master", lambda: install_master(rp_name, masters_list))
+    phases.add(
+        "install workers", lambda: rp.install_k8s(rp_name, "workers", workers_list)
+    )
+    phases.add(
+        "init master",
+        lambda: rp.setup_master(rp_name, master_server),
+        depends_on=["install master"],
+    )
+    phases.add(
+        "wait for master", lambda: wait_for_master(rp_name), depends_on=["init master"],
+    )
+    phases.add(
+        "join workers",
+        lambda: join_workers(rp_name, workers_list, journal),
+        depends_on=["install workers", "wait for master"],
+    )
+    phases.add(
+        "wait for workers",
+        lambda: wait_for_workers(rp_name, phases.results["join workers"]),
+        depends_on=["join workers"],
     )
-    join_cmd_output = str(process.communicate()[0])
+    phases.add(
+        "deploy dashboard",
+        lambda: rp.run_playbook("setup_k8s_dashboard", masters_file),
+        depends_on=["wait for workers"],
+    )
+
+    click.echo("Initializing master server and workers...")
+    rp.run_phases(phases)
+
+
+def install_master(rp_name, masters_list):
+    # Unlike a worker, the pool cannot go on without its master, and the
+    # install has to be done again when the create is resumed
+    installed = rp.install_k8s(rp_name, "masters", masters_list)
+    if len(installed) < len(masters_list):
+        raise RuntimeError(
+            "Could not install kubernetes on master {}".format(masters_list[0])
+        )
+    return installed
+
+
+def wait_for_master(rp_name):
+    # The workers cannot try to join the master until its API server is up
+    click.echo("waiting for master to be ready...")
+    waited = rp.wait_for_master(rp_name)
+    click.echo("Master was ready after {:.1f} seconds".format(waited))
+
+
+def join_workers(rp_name, workers_list, journal):
+    rp.join_workers(rp_name, workers_list, journal)
+
+    # The workers that could not join went back to the fleet, and others are
+    # picked in their place, so that the pool gets what was asked for
+    missing_cores, missing_mem = rp.get_missing_capacity(rp_name)
+    if missing_cores or missing_mem:
+        placement_result = rp.pick_fleet_servers(rp_name, missing_cores, missing_mem)
+        if placement_result is not None:
+            click.echo(
+                "Adding {} workers from the fleet in their place...".format(
+                    len(placement_result["servers"])
+                )
+            )
+            rp.add_workers_to_pool(rp_name, placement_result["servers"])
+            missing_cores, missing_mem = rp.get_missing_capacity(rp_name)
+
+    # The create fails here, rather than carrying on with a pool that is
+    # smaller than requested, so that it can be resumed once the fleet has
+    # enough servers that can join
+    joined = rp.get_servers(rp_name, "workers")
+    if not joined:
+        raise RuntimeError("No worker could join the pool")
+    if missing_cores or missing_mem:
+        raise RuntimeError(
+            "The workers that joined are {} cores and {} GB of RAM short of "
+            "what was requested".format(missing_cores, missing_mem)
+        )
+    return joined
+
 
-    # We sleep again here because the workers take about 10 seconds to be
-    # ready, and the dashboard is a k8s service that will need to be
-    # deployed to the workers.
-    time.sleep(15)
-    click.echo("Deploying cluster dashboard...")
-    rp.run_playbook("setup_k8s_dashboard", masters_file)
+def wait_for_workers(rp_name, workers_list):
+    # The dashboard is a k8s service that will need to be deployed to the
+    # workers, so they need to be Ready first.
+    click.echo("waiting for workers to be ready...")
+    waited = rp.wait_for_nodes(rp_name, workers_list)
+    click.echo("Workers were ready after {:.1f} seconds".format(waited))
 
 
 @cli.command("resize", short_help="Change pool specs")
 @click.argument("rp_name")
 @click.option("--cores", "-c", type=int)
 @click.option("--memory", "-m", type=int)
-def resize(rp_name, cores, memory):
+@click.option(
+    "--refresh", is_flag=True, help="Re-gather facts instead of using the cache"
+)
+@click.option(
+    "--drain-concurrency",
+    type=int,
+    default=rp.DRAIN_CONCURRENCY,
+    help="How many nodes to drain at once when shrinking",
+)
+@click.option("--yes", "-y", is_flag=True, help="Do not ask for confirmation")
+@click.option(
+    "--detach", is_flag=True, help="Do not wait for the service to finish the job"
+)
+# A plan that was already confirmed, passed on by the service to its job
+@click.option("--add-server", multiple=True, hidden=True)
+@click.option("--remove-server", multiple=True, hidden=True)
+@click.option("--reservation", hidden=True)
+def resize(
+    rp_name,
+    cores,
+    memory,
+    refresh,
+    drain_concurrency,
+    yes,
+    detach,
+    add_server,
+    remove_server,
+    reservation,
+):
     rp.verify_rp_name(rp_name)
+    client = get_service_client()
+
+    if add_server or remove_server:
+        # The servers to add were reserved by the service when it planned
+        # this, and are now transferred under its reservation
+        if reservation:
+            rp.set_reservation_token(reservation)
+        with rp.pool_lock(rp_name, "resize"):
+            try:
+                rp.verify_plan(rp_name, add_server, remove_server)
+            except rp.PlanError as exc:
+                click.echo(exc)
+                sys.exit(1)
+            resize_pool(
+                rp_name, add_server, remove_server, cores, memory, drain_concurrency
+            )
+        return
+
     if not cores and not memory:
         click.echo("You must specify cores or memory")
-        sys.exit()
-
-    total_cores_mem = rp.get_total_cores_mem(rp_name)
-    pool_core_count = total_cores_mem[0]
-    pool_mem_amount = total_cores_mem[1]
-
-    requested_cores = 0
-    requested_mem = 0
-    resize_type = "none"
-    core_resize_type = "none"
-    mem_resize_type = "none"
-
-    # Check whether the user is trying to increase or decrease the cpu/mem
-    # If they are trying to increase one and decrease the other, we cannot
-    # continue because this is requires an advanced algorithm that will be
-    # released in a future version.
-    if cores:
-        requested_cores = cores - pool_core_count
-        if requested_cores > 0:
-            core_resize_type = "increase"
-        elif requested_cores < 0:
-            core_resize_type = "decrease"
-        resize_type = core_resize_type
-        sorter = "cores"
-    if memory:
-        requested_mem = memory - pool_mem_amount
-        if requested_mem > 0:
-            mem_resize_type = "increase"
-        elif requested_mem < 0:
-            mem_resize_type = "decrease"
-        resize_type = mem_resize_type
-        sorter = "memory"
-    if cores and memory:
-        if core_resize_type != mem_resize_type:
-            click.echo(
-                "You have requested to increase one type of resource, and decrease the other. \
-                       This feature will not be supported until a future release."
+        sys.exit(1)
+
+    try:
+        if client is not None:
+            plan = client.plan_resize(rp_name, cores, memory, refresh)
+            if not yes and not has_resize_been_confirmed(rp_name, plan):
+                if plan["reservation"]:
+                    client.release_reservation(plan["reservation"])
+                return
+
+            argv = [
+                "resize",
+                rp_name,
+                "--yes",
+                "--drain-concurrency",
+                drain_concurrency,
+            ]
+            if cores:
+                argv += ["--cores", cores]
+            if memory:
+                argv += ["--memory", memory]
+            if plan["reservation"]:
+                argv += ["--reservation", plan["reservation"]]
+            for server in plan["add"]:
+                argv += ["--add-server", server]
+            for server in plan["remove"]:
+                argv += ["--remove-server", server]
+            run_job(client, argv, detach)
+            return
+
+        # The pool is locked from planning until it is resized, so that the
+        # plan cannot go stale because of another operation on this pool
+        with rp.pool_lock(rp_name, "resize"):
+            plan = rp.plan_resize(rp_name, cores, memory, refresh)
+            if not yes and not has_resize_been_confirmed(rp_name, plan):
+                return
+            resize_pool(
+                rp_name, plan["add"], plan["remove"], cores, memory, drain_concurrency
             )
-            sys.exit()
-        sorter = "both"
+    except (rp.PlanError, service.ServiceError) as exc:
+        click.echo(exc)
+        sys.exit(1)
+
+
+def has_resize_been_confirmed(rp_name, plan):
+    # Since cores and GB of memory are coupled together in real physical servers, we can't just add/delete exact numbers
+    # of resources. Therefore, the actual final specs may differ, and this can be very destructive when downsizing a pool.
+    # This is why we must warn the user here and get their confirmation.
+    warning = "Your requested {} may have resulted in a higher or lower number of total resources changes than expected.\n\n \
+               Servers added: {}, servers removed: {}\n \
+               Final core count for {} pool will be: {}\n \
+               Final memory amount for {} pool will be {} GB.\n".format(
+        plan["resize_type"],
+        len(plan["add"]),
+        len(plan["remove"]),
+        rp_name,
+        plan["cores"],
+        rp_name,
+        plan["mem"],
+    )
+
+    return has_user_confirmed(warning)
+
+
+def resize_pool(
+    rp_name, servers_to_add, servers_to_remove, cores, memory, drain_concurrency
+):
+    journal = rp.start_journal(
+        rp_name,
+        "resize",
+        {
+            "add": servers_to_add,
+            "remove": servers_to_remove,
+            "cores": cores,
+            "memory": memory,
+            "drain_concurrency": drain_concurrency,
+        },
+    )
+    run_resize(rp_name, journal)
+
+
+def run_resize(rp_name, journal):
+    servers_to_add = journal.args["add"]
+    servers_to_remove = journal.args["remove"]
+
+    # New servers are added first, so that a rebalanced pool never
+    # drops below its current capacity along the way.
+    phases = orchestrator.PhaseGraph(journal=journal)
+    depends_on = []
+    if servers_to_add:
+        phases.add(
+            "transfer servers",
+            lambda: rp.transfer_servers(servers_to_add, "fleet", rp_name),
+        )
+        phases.add(
+            "install workers",
+            lambda: rp.install_k8s(rp_name, "workers", servers_to_add),
+            depends_on=["transfer servers"],
+        )
+        phases.add(
+            "join workers",
+            lambda: rp.join_workers(rp_name, servers_to_add, journal),
+            depends_on=["install workers"],
+        )
+        depends_on = ["join workers"]
+    if servers_to_remove:
+        phases.add(
+            "return workers",
+            lambda: return_workers(
+                rp_name, servers_to_remove, journal.args["drain_concurrency"]
+            ),
+            depends_on=depends_on,
+        )
+        depends_on = ["return workers"]
+
+    # The reconciler keeps the pool at the size it was resized to
+    phases.add(
+        "set desired capacity",
+        lambda: rp.set_desired_capacity(
+            rp_name, journal.args["cores"], journal.args["memory"]
+        ),
+        depends_on=depends_on,
+    )
+    rp.run_phases(phases)
+
+
+def return_workers(rp_name, servers_to_remove, drain_concurrency):
+    # Servers that went back to the fleet before a resize was resumed are
+    # no longer in the pool
+    workers = set(rp.get_servers(rp_name, "workers"))
+    servers_to_remove = [server for server in servers_to_remove if server in workers]
+    if not servers_to_remove:
+        return []
+    return rp.return_workers_to_fleet(rp_name, servers_to_remove, drain_concurrency)
+
+
+@cli.command("resume", short_help="Continue a create or resize that failed")
+@click.argument("rp_name")
+@click.option(
+    "--detach", is_flag=True, help="Do not wait for the service to finish the job"
+)
+def resume(rp_name, detach):
+    rp.verify_rp_name(rp_name)
+
+    client = get_service_client()
+    if client is not None:
+        run_job(client, ["resume", rp_name], detach)
+        return
+
+    with rp.pool_lock(rp_name, "resume"):
+        journal = rp.load_journal(rp_name)
+        if journal is None or journal.is_finished:
+            click.echo("There is nothing to resume in the {} pool.".format(rp_name))
+            return
 
-    if resize_type == "none":
         click.echo(
-            "Your request is invalid. You specified resize parameters that equal the current state of the pool."
+            "Resuming the {} of the {} pool...".format(journal.operation, rp_name)
         )
-        sys.exit()
-    else:
-        specs = ""
-        if resize_type == "increase":
-            specs = rp.get_specs("fleet")
-        if resize_type == "decrease":
-            specs = rp.get_specs(rp_name)
-
-        # The absolute value is used here, which allows the majority of the logic
-        # to be used in both the increase and decrease scenarios. This helps to
-        # avoid writing duplicate code and too many if/else statements.
-        abs_requested_cores = abs(requested_cores)
-        abs_requested_mem = abs(requested_mem)
-
-        # Since a physical server will usually have more GB of ram than # of cores, we sort
-        # by cores first, when possible. My thinking here was the case where a user wants to
-        # reduce a pool by 24 cores. Let's say we have servers with 12 or 24 cores, and 256 GB
-        # of ram. It is better to removes 1x24 cores and 256 GB of ram, instead of 2x12 cores
-        # and 512GB of ram.
-        if sorter == "cores":
-            sorted_specs = sorted(
-                specs.items(), key=lambda tup: (tup[1]["cores"]), reverse=True
+        if journal.operation == "create":
+            provision_pool(
+                rp_name, journal.args["masters"], journal.args["workers"], journal
             )
-        if sorter == "memory":
-            sorted_specs = sorted(
-                specs.items(), key=lambda tup: (tup[1]["mem"]), reverse=True
+        else:
+            run_resize(rp_name, journal)
+
+
+@cli.command("prewarm", short_help="Install k8s on idle servers ahead of time")
+@click.option("--count", "-n", type=int, help="Only prewarm this many servers")
+@click.option(
+    "--background", is_flag=True, help="Keep prewarming after this command exits"
+)
+def prewarm(count, background):
+    # The service already runs its jobs in the background
+    client = get_service_client()
+    if client is not None:
+        argv = ["prewarm"]
+        if count:
+            argv += ["--count", count]
+        run_job(client, argv, background)
+        return
+
+    if background:
+        cmd = [sys.executable, os.path.abspath(__file__), "prewarm"]
+        if count:
+            cmd += ["--count", str(count)]
+
+        log_file = "{}/.prewarm.log".format(POOLS_DIR)
+        with open(log_file, "a") as log:
+            process = subprocess.Popen(
+                cmd, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
             )
-        if sorter == "both":
-            sorted_specs = sorted(
-                specs.items(),
-                key=lambda tup: (tup[1]["cores"], tup[1]["mem"]),
-                reverse=True,
+        click.echo(
+            "Prewarming in the background (pid {}), logging to {}".format(
+                process.pid, log_file
             )
+        )
+        return
+
+    idle_servers = rp.get_servers("fleet", "hosts")
+    prewarmed = set(rp.get_prewarmed(idle_servers))
+    cold_servers = [server for server in idle_servers if server not in prewarmed]
+    if count:
+        cold_servers = cold_servers[:count]
+
+    if not cold_servers:
+        click.echo("All idle servers are already prewarmed.")
+        return
+
+    click.echo("Prewarming {} idle servers...".format(len(cold_servers)))
+    installed = rp.install_k8s("fleet", "hosts", cold_servers)
+    click.echo(
+        "{} of {} servers now have kubernetes {} installed.".format(
+            len(installed), len(cold_servers), rp.K8S_VERSION
+        )
+    )
 
-        attempted_core_count = 0
-        attempted_mem_count = 0
-        attempted_servers_list = []
-
-        # Try to build a list of servers to meet the request
-        for i in sorted_specs:
-            if (cores and attempted_core_count < abs_requested_cores) or (
-                memory and attempted_mem_count < abs_requested_mem
-            ):
-                server = i[0]
-                specs = i[1]
-                server_cores = specs["cores"]
-                server_mem = specs["mem"]
-
-                attempted_servers_list.append(server)
-                attempted_core_count += server_cores
-                attempted_mem_count += server_mem
-
-        # Check if the request can actually be met, and proceed accordingly.
-        if (cores and attempted_core_count < abs_requested_cores) or (
-            memory and attempted_mem_count < abs_requested_mem
-        ):
-            if resize_type == "increase":
-                click.echo("The requested resources are not available:")
-                output_head = "Available"
-            if resize_type == "decrease":
-                click.echo(
-                    "The requested decrease would bring the number of resources below 0, consider using the destroy option:"
-                )
-                output_head = "Current"
-            if cores:
-                click.echo("{} cores: {}".format(output_head, attempted_core_count))
-                click.echo(
-                    "Requested {} in cores: {}".format(
-                        resize_type, attempted_core_count
-                    )
+
+@cli.command("reconcile", short_help="Keep pools at their desired capacity")
+@click.option(
+    "--interval",
+    type=int,
+    default=rp.RECONCILE_INTERVAL,
+    help="Seconds between checking the next batch of workers",
+)
+@click.option(
+    "--check-budget",
+    type=int,
+    default=rp.RECONCILE_CHECK_BUDGET,
+    help="Most workers to check in one pass",
+)
+@click.option(
+    "--failures",
+    type=int,
+    default=rp.RECONCILE_FAILURES,
+    help="Failed checks in a row before a worker is replaced",
+)
+@click.option("--once", is_flag=True, help="Run a single pass and exit")
+def reconcile(interval, check_budget, failures, once):
+    pool_reconciler = reconciler.Reconciler(
+        check_budget,
+        failures,
+        interval,
+        rp.EVENTS_FILE,
+        "{}/resource_pool_cli_reconciler.prom".format(rp.METRICS_TEXTFILE_DIR),
+    )
+    os.makedirs(rp.METRICS_TEXTFILE_DIR, exist_ok=True)
+
+    if once:
+        pool_reconciler.run_once()
+        return
+
+    # Like the service, the reconciler runs for too long to keep a trace
+    tracing.stop_trace()
+    pool_reconciler.run()
+
+
+@cli.command("plan", short_help="Plan pools against the fleet, without changing it")
+@click.argument("rp_name", required=False)
+@click.option("--cores", "-c", type=int)
+@click.option("--memory", "-m", type=int)
+@click.option("--site", "-s", help="Only use servers of this site")
+@click.option(
+    "--file",
+    "-f",
+    "requests_file",
+    type=click.File(),
+    help="Plan every '<pool> <cores> <memory> [site]' line of this file, - for stdin",
+)
+@click.option(
+    "--cumulative",
+    is_flag=True,
+    help="Plan the requests one after another, as if they were all run",
+)
+@click.option(
+    "--refresh", is_flag=True, help="Re-gather facts instead of using the cache"
+)
+@OUTPUT_OPTION
+def plan(rp_name, cores, memory, site, requests_file, cumulative, refresh, output):
+    requests = []
+    if rp_name:
+        requests.append((rp_name, cores, memory, site))
+    if requests_file:
+        requests += read_plan_requests(requests_file)
+
+    if not requests:
+        click.echo("You must specify a pool, or a file of requests")
+        sys.exit(1)
+    if any(request[0] == "fleet" for request in requests):
+        click.echo("The fleet cannot be planned")
+        sys.exit(1)
+    for request in requests:
+        rp.verify_site_name(request[3])
+
+    pool_planner = rp.get_planner(
+        set(request[0] for request in requests), refresh, cumulative
+    )
+    with tracing.span("plan requests", requests=len(requests)):
+        plans = [pool_planner.plan(*request) for request in requests]
+
+    if output == "ndjson":
+        for pool_plan in plans:
+            click.echo(json.dumps(pool_plan))
+        return
+    if output == "json":
+        click.echo(json.dumps({"plans": plans}, indent=2))
+        return
+
+    output_table = PrettyTable(
+        [
+            "Pool",
+            "Operation",
+            "Servers",
+            "Cores",
+            "GB of RAM",
+            "Fleet Cores Left",
+            "Fleet GB Left",
+        ]
+    )
+    for pool_plan in plans:
+        # New servers are marked with a +, and the ones going back with a -
+        servers = [pool_plan["error"]] if pool_plan["error"] else []
+        if pool_plan["master"]:
+            servers.append("+{} (master)".format(pool_plan["master"]))
+        servers += ["+{}".format(server) for server in pool_plan["add"]]
+        servers += ["-{}".format(server) for server in pool_plan["remove"]]
+        output_table.add_row(
+            [
+                pool_plan["pool"],
+                pool_plan["operation"],
+                "\n".join(servers),
+                pool_plan["cores"],
+                pool_plan["mem"],
+                pool_plan["fleet_cores"],
+                pool_plan["fleet_mem"],
+            ]
+        )
+    click.echo(output_table)
+
+
+def read_plan_requests(requests_file):
+    """
+    Returns the (pool, cores, memory, site) requests of a file with one
+    request per line. Cores or memory can be left out of a resize with a -,
+    the site can be left out, and blank lines and lines starting with # are
+    skipped.
+    """
+    requests = []
+    for line_number, line in enumerate(requests_file, 1):
+        fields = line.replace(",", " ").split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        try:
+            if len(fields) not in (3, 4):
+                raise ValueError
+            rp_name, cores, memory = fields[:3]
+            requests.append(
+                (
+                    rp_name,
+                    None if cores == "-" else int(cores),
+                    None if memory == "-" else int(memory),
+                    fields[3] if len(fields) == 4 else None,
                 )
-            if memory:
-                click.echo("{} memory: {} GB".format(output_head, attempted_mem_count))
-                click.echo(
-                    "Requested {} in memory: {} GB".format(
-                        resize_type, attempted_mem_count
-                    )
+            )
+        except ValueError:
+            raise click.ClickException(
+                "Line {} is not '<pool> <cores> <memory> [site]': {}".format(
+                    line_number, line.strip()
                 )
-        else:
-            servers_to_transfer = attempted_servers_list
-            if resize_type == "increase":
-                final_core_count = pool_core_count + attempted_core_count
-                final_mem_amount = pool_mem_amount + attempted_mem_count
-            if resize_type == "decrease":
-                final_core_count = pool_core_count - attempted_core_count
-                final_mem_amount = pool_mem_amount - attempted_mem_count
-
-            # Since cores and GB of memory are coupled together in real physical servers, we can't just add/delete exact numbers
-            # of resources. Therefore, the actual final specs may differ, and this can be very destructive when downsizing a pool.
-            # This is why we must warn the user here and get their confirmation.
-            warning = "Your requested {} may have resulted in a higher or lower number of total resources changes than expected.\n\n \
-                       Final core count for {} pool will be: {}\n \
-                       Final memory amount for {} pool will be {} GB.\n".format(
-                resize_type, rp_name, final_core_count, rp_name, final_mem_amount
             )
+    return requests
+
+
+@cli.command("quarantine", short_help="List or release quarantined servers")
+@click.option(
+    "--release",
+    "-r",
+    multiple=True,
+    help="Check this server again before it is next used, can be repeated",
+)
+def quarantine(release):
+    inventory_store = rp.get_inventory()
+    if release:
+        inventory_store.clear_checks(release)
+        click.echo("Released {} servers.".format(len(release)))
+        return
+
+    # Servers whose quarantine is over are checked again when next placed
+    checks = inventory_store.get_failing_hosts()
+    server_pools = inventory_store.get_server_pools(checks)
+    output_table = PrettyTable(["Server", "Pool", "Failures", "Until", "Reason"])
+    for server, check in checks.items():
+        output_table.add_row(
+            [
+                server,
+                server_pools.get(server),
+                check["failures"],
+                time.strftime(
+                    "%Y-%m-%d %H:%M:%S",
+                    time.localtime(rp.get_quarantined_until(check)),
+                ),
+                check["reason"],
+            ]
+        )
+    click.echo(output_table)
+
+
+@cli.command("destroy", short_help="Destroy pools")
+@click.argument("rp_names", nargs=-1, required=True)
+@click.option("--yes", "-y", is_flag=True, help="Do not ask for confirmation")
+@click.option(
+    "--detach", is_flag=True, help="Do not wait for the service to finish the job"
+)
+def destroy(rp_names, yes, detach):
+    # Every argument is a pool name or a glob, such as "test-*"
+    rp_names = rp.match_pool_names(rp_names)
+    warning = "You are attempting to destroy the {} resource pool{}.\nThis cannot be undone".format(
+        ", ".join(rp_names), "s" if len(rp_names) > 1 else ""
+    )
 
-            if has_user_confirmed(warning):
-                if resize_type == "increase":
-                    rp.add_workers_to_pool(rp_name, servers_to_transfer)
-                if resize_type == "decrease":
-                    rp.return_workers_to_fleet(rp_name, servers_to_transfer)
+    if yes or has_user_confirmed(warning):
+        client = get_service_client()
+        if client is not None:
+            run_job(client, ["destroy"] + rp_names + ["--yes"], detach)
+            return
+
+        with rp.pool_locks(rp_names, "destroy") as (locked, busy):
+            status = dict(busy)
+            if locked:
+                status.update(destroy_pools(locked))
+
+        output_table = PrettyTable(["Pool", "Status"])
+        for rp_name in rp_names:
+            output_table.add_row([rp_name, status[rp_name]])
+        click.echo(output_table)
+
+        # Pools another operation was holding were not destroyed, and the
+        # servers that could not be reset were only quarantined
+        if busy or any(status[rp_name] != "destroyed" for rp_name in locked):
+            sys.exit(1)
+    else:
+        click.echo("Your input did not match the validation string")
 
 
-@cli.command("destroy", short_help="Destroy pool")
-@click.argument("rp_name")
-def destroy(rp_name):
-    rp.verify_rp_name(rp_name)
-    warning = "You are attempting to destroy the {} resource pool.\nThis cannot be undone".format(
-        rp_name
+def destroy_pools(rp_names):
+    """
+    Destroys the given pools, and returns a dictionary of pool to status
+    """
+    pool_servers = {
+        rp_name: rp.get_servers(rp_name, "masters") + rp.get_servers(rp_name, "workers")
+        for rp_name in rp_names
+    }
+
+    # The masters and workers of every pool are reset by a single run, and
+    # the servers only go back to the fleet once it is done.
+    click.echo("Destroying {} clusters...".format(len(rp_names)))
+    phases = orchestrator.PhaseGraph()
+    # Servers that cannot be reset do not keep the pools from being destroyed
+    phases.add("reset servers", lambda: rp.reset_pools(rp_names, check=False))
+    phases.add(
+        "return servers",
+        lambda: rp.remove_pools(rp_names),
+        depends_on=["reset servers"],
     )
+    rp.run_phases(phases)
 
-    if has_user_confirmed(warning):
-        masters_yaml_file = "{}/{}/masters.yml".format(POOLS_DIR, rp_name)
-        workers_yaml_file = "{}/{}/workers.yml".format(POOLS_DIR, rp_name)
-
-        click.echo("Destroying cluster...")
-        rp.run_playbook("reset", masters_yaml_file)
-        rp.run_playbook("reset", workers_yaml_file)
+    click.echo("Cleaning up files...")
+    for rp_name in rp_names:
+        shutil.rmtree("{}/{}".format(POOLS_DIR, rp_name))
 
-        click.echo("Returning servers back to fleet...")
-        all_masters_list = get_all_servers_in_yaml_file(masters_yaml_file)
-        all_workers_list = get_all_servers_in_yaml_file(workers_yaml_file)
+    # Servers that could not be reset are quarantined in the fleet, so that
+    # they are checked again before they are next used
+    host_status = phases.results["reset servers"].host_status
+    status = {}
+    failed = {}
+    for rp_name, servers in pool_servers.items():
+        not_reset = [
+            server for server in servers if host_status.get(server, "failed") != "ok"
+        ]
+        for server in not_reset:
+            failed[server] = "kubeadm reset {}".format(
+                host_status.get(server, "failed")
+            )
 
-        rp.transfer_servers(all_masters_list, masters_yaml_file, FLEET_HOSTS_YAML_FILE)
-        rp.transfer_servers(all_workers_list, workers_yaml_file, FLEET_HOSTS_YAML_FILE)
+        status[rp_name] = "destroyed"
+        if not_reset:
+            status[rp_name] += ", {} of {} servers could not be reset".format(
+                len(not_reset), len(servers)
+            )
+    rp.get_inventory().record_checks([], failed)
 
-        click.echo("Cleaning up files...")
-        shutil.rmtree("{}/{}".format(POOLS_DIR, rp_name))
-    else:
-        click.echo("Your input did not match the validation string")
+    return status
 
 
 if __name__ == "__main__":
-    cli()
\ No newline at end of file
+    cli()
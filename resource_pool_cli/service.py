@@ -0,0 +1,446 @@
+#!/usr/bin/python3
+
+"""
+The resource pool service. It is a long running process that serves a
+local HTTP/JSON API on a unix socket, so that commands do not each have to
+start up, open the inventory and read specs on their own. Read only
+requests, like listing pools, are answered from the state it keeps warm.
+Creating, resizing and destroying pools run as jobs in the background, and
+clients poll a job for its output until it is done.
+
+    GET  /v1/health
+    GET  /v1/pools[?name=<pool>...][&refresh=1][&stream=1]
+    GET  /v1/pools/<pool>[?refresh=1]
+    POST /v1/pools/<pool>/resize-plan   {"cores", "memory", "refresh"}
+    DELETE /v1/reservations/<token>
+    GET  /v1/jobs
+    POST /v1/jobs                       {"argv": [<command>, <args>...]}
+    GET  /v1/jobs/<id>[?since=<line>]
+
+With stream=1, pools are sent as newline delimited json, one pool per line
+as soon as its specs are known, instead of as a single json document.
+
+Jobs run the cli itself in --local mode, so that each one has its own
+output, and keeps running even if the client that started it goes away.
+A resize plan reserves the servers it adds under a token of its own, which
+the client either hands to the resize job or releases if the user does not
+confirm the plan.
+"""
+
+import collections
+import http.client
+import json
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+import click
+
+import locks
+import pool_helpers as rp
+
+CLI_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "resource_pool_cli.py"
+)
+
+# The commands that can be run as jobs
+JOB_COMMANDS = ("create", "resize", "destroy", "prewarm", "resume")
+
+# Finished jobs are forgotten after this many newer ones have started
+JOBS_KEPT = 100
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Job:
+    def __init__(self, job_id, argv):
+        self.id = job_id
+        self.argv = argv
+        self.status = "running"
+        self.returncode = None
+        self.output = []
+        self.started = time.time()
+        self.finished = None
+
+    def to_dict(self, since=0):
+        return {
+            "id": self.id,
+            "argv": self.argv,
+            "status": self.status,
+            "returncode": self.returncode,
+            "started": self.started,
+            "finished": self.finished,
+            "output": self.output[since:],
+            "next": len(self.output),
+        }
+
+
+class PoolService:
+    def __init__(self):
+        self.jobs = collections.OrderedDict()
+        self._next_job_id = 1
+        self._lock = threading.Lock()
+
+    def handle(self, method, path, query, body):
+        """
+        Routes a request, and returns the status code and the json body of
+        the response
+        """
+        refresh = query.get("refresh", ["0"])[0] == "1"
+
+        if method == "GET" and path == ["v1", "health"]:
+            return 200, {"status": "ok", "pid": os.getpid()}
+
+        if method == "GET" and path == ["v1", "pools"]:
+            rp_names = query.get("name") or rp.get_pool_names()
+            if query.get("stream", ["0"])[0] == "1":
+                return self.stream_pools(rp_names, refresh)
+            return self.get_pools(rp_names, refresh)
+
+        if method == "GET" and len(path) == 3 and path[:2] == ["v1", "pools"]:
+            status, pools = self.get_pools([path[2]], refresh)
+            if status != 200:
+                return status, pools
+            return 200, pools["pools"][0]
+
+        if (
+            method == "POST"
+            and len(path) == 4
+            and path[:2] == ["v1", "pools"]
+            and path[3] == "resize-plan"
+        ):
+            return self.plan_resize(path[2], body)
+
+        if method == "DELETE" and len(path) == 3 and path[:2] == ["v1", "reservations"]:
+            rp.release_reservations(path[2])
+            return 200, {}
+
+        if method == "GET" and path == ["v1", "jobs"]:
+            with self._lock:
+                jobs = [
+                    job.to_dict(since=len(job.output)) for job in self.jobs.values()
+                ]
+            return 200, {"jobs": jobs}
+
+        if method == "POST" and path == ["v1", "jobs"]:
+            return self.start_job(body.get("argv") or [])
+
+        if method == "GET" and len(path) == 3 and path[:2] == ["v1", "jobs"]:
+            job = self.jobs.get(path[2])
+            if job is None:
+                return 404, {"error": "No job {}".format(path[2])}
+            since = int(query.get("since", ["0"])[0])
+            return 200, job.to_dict(since)
+
+        return 404, {"error": "No such resource: {} /{}".format(method, "/".join(path))}
+
+    def get_pools(self, rp_names, refresh):
+        status, pool_infos = self.stream_pools(rp_names, refresh)
+        if status != 200:
+            return status, pool_infos
+
+        pool_infos = {pool_info["name"]: pool_info for pool_info in pool_infos}
+        return 200, {"pools": [pool_infos[rp_name] for rp_name in rp_names]}
+
+    def stream_pools(self, rp_names, refresh):
+        """
+        Returns the status, and a generator of the pools as they are known
+        """
+        for rp_name in rp_names:
+            if not rp.get_inventory().pool_exists(rp_name):
+                return 404, {"error": "No pool named {}".format(rp_name)}
+
+        return 200, rp.iter_pool_infos(rp_names, refresh)
+
+    def plan_resize(self, rp_name, body):
+        if not rp.get_inventory().pool_exists(rp_name):
+            return 404, {"error": "No pool named {}".format(rp_name)}
+
+        # The pool is locked while it is planned, like it is by the cli, so
+        # that the plan is not made on a pool another operation is changing.
+        # The job that runs the plan checks it is still current under the
+        # lock again.
+        try:
+            with rp.get_locks().pool_lock(rp_name, "resize plan", rp.POOL_LOCK_TIMEOUT):
+                plan = rp.plan_resize(
+                    rp_name,
+                    body.get("cores"),
+                    body.get("memory"),
+                    body.get("refresh"),
+                    token=rp.randomString(16),
+                )
+        except (locks.LockBusy, rp.PlanError) as exc:
+            return 409, {"error": str(exc)}
+        return 200, plan
+
+    def start_job(self, argv):
+        if not argv or argv[0] not in JOB_COMMANDS:
+            return (
+                400,
+                {"error": "Jobs can only run {}".format(", ".join(JOB_COMMANDS))},
+            )
+
+        with self._lock:
+            job = Job(str(self._next_job_id), [str(arg) for arg in argv])
+            self._next_job_id += 1
+            self.jobs[job.id] = job
+
+            finished = [old.id for old in self.jobs.values() if old.finished]
+            for job_id in finished[: max(len(self.jobs) - JOBS_KEPT, 0)]:
+                del self.jobs[job_id]
+
+        threading.Thread(target=self._run_job, args=(job,), daemon=True).start()
+        return 202, job.to_dict()
+
+    def _run_job(self, job):
+        env = dict(os.environ)
+        env["PYTHONUNBUFFERED"] = "1"
+
+        process = subprocess.Popen(
+            [sys.executable, CLI_SCRIPT, "--local"] + job.argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+        )
+        for line in process.stdout:
+            job.output.append(line.decode(errors="replace").rstrip("\n"))
+
+        job.returncode = process.wait()
+        job.finished = time.time()
+        job.status = "succeeded" if job.returncode == 0 else "failed"
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = "resource_pool_service"
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        path = [part for part in url.path.split("/") if part]
+        query = urllib.parse.parse_qs(url.query)
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            status, data = self.server.pool_service.handle(method, path, query, body)
+        except (Exception, SystemExit):
+            # Helpers may exit on errors, which must not take down the service
+            traceback.print_exc()
+            status, data = 500, {"error": traceback.format_exc().splitlines()[-1]}
+
+        if not isinstance(data, dict):
+            self._stream(status, data)
+            return
+
+        response = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def _stream(self, status, records):
+        """
+        Sends every record as a line of json as soon as it is produced. The
+        response ends when the connection is closed, and an error that
+        happens along the way is sent as a last record.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        try:
+            for record in records:
+                self.wfile.write((json.dumps(record) + "\n").encode())
+                self.wfile.flush()
+        except (Exception, SystemExit):
+            traceback.print_exc()
+            error = {"error": traceback.format_exc().splitlines()[-1]}
+            self.wfile.write((json.dumps(error) + "\n").encode())
+
+    def log_message(self, format, *args):
+        # Requests come in over a unix socket, which has no client address
+        sys.stderr.write(
+            "{} {}\n".format(time.strftime("%Y-%m-%d %H:%M:%S"), format % args)
+        )
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, refresh_interval):
+    """
+    Runs the service on the given unix socket until it is interrupted.
+    Every refresh_interval seconds, the specs of servers whose cached specs
+    expired are gathered again, so that requests never have to wait for it,
+    and with RP_SSH_KEEP_WARM=1 the ssh connections to every server of every
+    pool are kept open.
+    """
+    if os.path.exists(socket_path):
+        if ServiceClient(socket_path).is_available():
+            raise click.ClickException(
+                "The service is already running on {}".format(socket_path)
+            )
+        os.remove(socket_path)
+
+    server = _UnixHTTPServer(socket_path, _RequestHandler)
+    server.pool_service = PoolService()
+    os.chmod(socket_path, 0o600)
+
+    def refresh_specs():
+        while True:
+            time.sleep(refresh_interval)
+            try:
+                rp.get_specs_for_pools(rp.get_pool_names())
+                if rp.SSH_KEEP_WARM:
+                    rp.keep_warm_connections()
+            except (Exception, SystemExit):
+                traceback.print_exc()
+
+    threading.Thread(target=refresh_specs, daemon=True).start()
+
+    # docker stop sends SIGTERM, and the socket should be removed on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    click.echo("Serving on {}".format(socket_path))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ServiceClient:
+    def __init__(self, socket_path, timeout=600):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _send(self, connection, method, path, body=None):
+        connection.request(
+            method,
+            path,
+            body=json.dumps(body) if body is not None else None,
+            headers={"Content-Type": "application/json"},
+        )
+        response = connection.getresponse()
+        if response.status >= 400:
+            data = json.loads(response.read() or b"{}")
+            raise ServiceError(response.status, data.get("error", "Request failed"))
+        return response
+
+    def request(self, method, path, body=None):
+        """
+        Sends a request to the service, and returns the json body of the
+        response. Raises ServiceError if the service answered with an error.
+        """
+        connection = _UnixHTTPConnection(self.socket_path, self.timeout)
+        try:
+            response = self._send(connection, method, path, body)
+            return json.loads(response.read() or b"{}")
+        finally:
+            connection.close()
+
+    def stream(self, path):
+        """
+        Sends a GET request for a stream, and yields every record of the
+        response as soon as it arrives
+        """
+        connection = _UnixHTTPConnection(self.socket_path, self.timeout)
+        try:
+            response = self._send(connection, "GET", path)
+            for line in response:
+                record = json.loads(line)
+                if "error" in record:
+                    raise ServiceError(500, record["error"])
+                yield record
+        finally:
+            connection.close()
+
+    def is_available(self):
+        try:
+            ServiceClient(self.socket_path, timeout=2).request("GET", "/v1/health")
+            return True
+        except (OSError, ServiceError, ValueError):
+            return False
+
+    def get_pools(self, rp_names, refresh=False):
+        query = [("name", rp_name) for rp_name in rp_names]
+        if refresh:
+            query.append(("refresh", "1"))
+        return self.request("GET", "/v1/pools?" + urllib.parse.urlencode(query))[
+            "pools"
+        ]
+
+    def iter_pools(self, rp_names, refresh=False):
+        query = [("name", rp_name) for rp_name in rp_names] + [("stream", "1")]
+        if refresh:
+            query.append(("refresh", "1"))
+        return self.stream("/v1/pools?" + urllib.parse.urlencode(query))
+
+    def plan_resize(self, rp_name, cores, memory, refresh=False):
+        try:
+            return self.request(
+                "POST",
+                "/v1/pools/{}/resize-plan".format(urllib.parse.quote(rp_name)),
+                {"cores": cores, "memory": memory, "refresh": refresh},
+            )
+        except ServiceError as exc:
+            if exc.status == 409:
+                raise rp.PlanError(str(exc))
+            raise
+
+    def release_reservation(self, token):
+        self.request("DELETE", "/v1/reservations/{}".format(urllib.parse.quote(token)))
+
+    def start_job(self, argv):
+        return self.request("POST", "/v1/jobs", {"argv": argv})
+
+    def get_job(self, job_id, since=0):
+        return self.request("GET", "/v1/jobs/{}?since={}".format(job_id, since))
+
+    def get_jobs(self):
+        return self.request("GET", "/v1/jobs")["jobs"]
+
+
+def get_client(socket_path):
+    """
+    Returns a client of the service, or None if it is not running
+    """
+    if not os.path.exists(socket_path):
+        return None
+
+    client = ServiceClient(socket_path)
+    return client if client.is_available() else None
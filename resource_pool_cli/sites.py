@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+
+"""
+Sites split the fleet by the data centre its servers are in. Every site
+has its own inventory, the servers that match its host patterns, and its
+own controller, the ansible workers that run the commands for its servers.
+A controller runs locally unless its site gives a command to start it
+with, such as docker exec into a container at that site, or ssh to a
+machine there, so that the ssh sessions to its servers start close to
+them. The workers speak json lines over stdin and stdout, so they work
+the same through any such command.
+
+Sites are described in SITES_FILE, in the order servers are matched:
+
+    east:
+      hosts: ["10.1.*", "east-*"]
+      controller: ["docker", "exec", "-i", "rp-controller-east"]
+      forks: 50
+    west:
+      hosts: ["10.2.*"]
+
+Servers that match no site are in the default site, which is run by the
+local controller. Without a sites file, every server is in it.
+
+The SiteCoordinator stands in for the executor. It splits every ansible
+command by the sites of its hosts, runs the part of every site on that
+site's controller at the same time, and merges their events into the
+one run the caller iterates over.
+"""
+
+import fnmatch
+import json
+import queue
+import threading
+
+import yaml
+
+import executor
+import inventory
+
+DEFAULT_SITE = "default"
+
+
+class SitesError(Exception):
+    """
+    Raised when the sites file is not valid. The message is meant to be
+    shown to the user as it is.
+    """
+
+
+class Site:
+    def __init__(self, name, hosts=(), controller=(), forks=None):
+        self.name = name
+        self.hosts = list(hosts)
+        self.controller = list(controller)
+        self.forks = forks
+
+    def matches(self, server):
+        return any(fnmatch.fnmatchcase(server, pattern) for pattern in self.hosts)
+
+
+def load_sites(sites_file):
+    """
+    Returns the sites of the given sites file, in the order servers are
+    matched, or an empty list if there is no sites file
+    """
+    try:
+        with open(sites_file) as stream:
+            sites_yaml = yaml.safe_load(stream) or {}
+    except FileNotFoundError:
+        return []
+
+    sites = []
+    for name, site_yaml in sites_yaml.items():
+        site_yaml = site_yaml or {}
+        if name == DEFAULT_SITE:
+            raise SitesError(
+                "There cannot be a {} site in {}, it is the site of the servers "
+                "that match no other site".format(DEFAULT_SITE, sites_file)
+            )
+        unknown = set(site_yaml) - {"hosts", "controller", "forks"}
+        if unknown:
+            raise SitesError(
+                "The {} site in {} has unknown keys: {}".format(
+                    name, sites_file, ", ".join(sorted(unknown))
+                )
+            )
+        sites.append(
+            Site(
+                str(name),
+                site_yaml.get("hosts") or [],
+                site_yaml.get("controller") or [],
+                site_yaml.get("forks"),
+            )
+        )
+    return sites
+
+
+def get_site(server, sites):
+    """
+    Returns the name of the first of the given sites the server matches
+    """
+    for site in sites:
+        if site.matches(server):
+            return site.name
+    return DEFAULT_SITE
+
+
+def group_by_site(servers, sites):
+    """
+    Returns a dictionary of site name to the given servers in that site, in
+    the order they were given, for the sites that have any
+    """
+    groups = {}
+    for server in servers:
+        groups.setdefault(get_site(server, sites), []).append(server)
+    return groups
+
+
+class SiteCoordinator(executor.AnsibleExecutor):
+    """
+    Runs every command on the executors of the sites its hosts are in, all
+    at once. site_executors holds the executor of every site, including
+    the default site.
+    """
+
+    def __init__(self, site_executors, sites):
+        # Nothing runs on the coordinator itself, so it has none of the
+        # state of an executor of its own
+        self.site_executors = site_executors
+        self.sites = sites
+
+    @property
+    def runs_started(self):
+        return sum(site.runs_started for site in self.site_executors.values())
+
+    @property
+    def processes_started(self):
+        return sum(site.processes_started for site in self.site_executors.values())
+
+    def run_lines(self, run):
+        hosts = run.request["limit"]
+        if hosts is None:
+            hosts = inventory.read_hosts_yaml_files(run.request["inventory"])
+        site_hosts = group_by_site(hosts, self.sites)
+        run.span.attributes["sites"] = len(site_hosts)
+
+        # Most commands only reach the servers of one pool, which are often
+        # all in one site, and need nothing merged
+        if len(site_hosts) <= 1:
+            site_name = next(iter(site_hosts), DEFAULT_SITE)
+            yield from self.site_executors[site_name].run_lines(run)
+            return
+
+        lines = queue.Queue()
+        site_runs = []
+        for site_name, servers in site_hosts.items():
+            site_run = _get_site_run(self.site_executors[site_name], run, servers)
+            site_runs.append(site_run)
+            threading.Thread(
+                target=_run_site, args=(site_run, lines), daemon=True
+            ).start()
+
+        # Every site ends its playbook with a summary of its own hosts, and
+        # the caller gets a single one for all of them
+        stats = None
+        running = len(site_runs)
+        while running:
+            line = lines.get()
+            if line is None:
+                running -= 1
+                continue
+
+            site_stats = _get_stats(line)
+            if site_stats is not None:
+                stats = dict(stats or {}, **site_stats)
+                continue
+            yield line
+
+        if stats is not None:
+            yield json.dumps({"event": "stats", "hosts": stats})
+        run.returncode = max(site_run.returncode for site_run in site_runs)
+
+    def is_apiserver_healthy(self, master_server):
+        site_name = get_site(master_server, self.sites)
+        return self.site_executors[site_name].is_apiserver_healthy(master_server)
+
+    def check_hosts(self, hosts, timeout, concurrency):
+        failed = {}
+        for site_failed in self._fan_out(
+            hosts, lambda site, servers: site.check_hosts(servers, timeout, concurrency)
+        ):
+            failed.update(site_failed)
+        return failed
+
+    def keep_warm(self, hosts, timeout, concurrency):
+        failed = {}
+        for site_failed in self._fan_out(
+            hosts, lambda site, servers: site.keep_warm(servers, timeout, concurrency)
+        ):
+            failed.update(site_failed)
+        return failed
+
+    def get_warm_hosts(self, hosts):
+        return [
+            host
+            for site_hosts in self._fan_out(
+                hosts, lambda site, servers: site.get_warm_hosts(servers)
+            )
+            for host in site_hosts
+        ]
+
+    def close(self):
+        for site_executor in self.site_executors.values():
+            site_executor.close()
+
+    def _fan_out(self, hosts, func):
+        """
+        Calls func with the executor and the servers of every site the given
+        hosts are in, all at once, and returns the list of what it returned
+        """
+        results = []
+        threads = []
+        for site_name, servers in group_by_site(hosts, self.sites).items():
+            thread = threading.Thread(
+                target=lambda site, servers: results.append(func(site, servers)),
+                args=(self.site_executors[site_name], servers),
+            )
+            threads.append(thread)
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+        return results
+
+
+def _get_site_run(site_executor, run, servers):
+    """
+    Returns a run of the same command as run, on the executor of a site,
+    limited to the servers of that site
+    """
+    request = run.request
+    if request["kind"] == "playbook":
+        return site_executor.playbook(
+            request["playbook"],
+            request["inventory"],
+            servers,
+            request["extra_vars"],
+        )
+    return site_executor.adhoc(
+        request["inventory"], request["module"], request["args"], servers
+    )
+
+
+def _run_site(site_run, lines):
+    try:
+        for line in site_run.executor.run_lines(site_run):
+            lines.put(line)
+    except Exception as exc:
+        # Shows up with the output ansible printed outside of its events
+        lines.put("The controller of a site failed: {}".format(exc))
+    finally:
+        if site_run.returncode is None:
+            site_run.returncode = 1
+        lines.put(None)
+
+
+def _get_stats(line):
+    """
+    Returns the hosts of the line if it is the stats event of a playbook,
+    or None if it is anything else
+    """
+    if not line.startswith("{") or '"stats"' not in line:
+        return None
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    return event["hosts"] if event.get("event") == "stats" else None
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+"""
+Ssh connection multiplexing that outlives the commands of the cli.
+
+Every command used to run in a container of its own, so the ssh control
+sockets ansible keeps in the home directory died with it, and every
+command connected to every server again. The control sockets are now kept
+in a directory on the volume shared by every container of the cli, and
+the master connections stay open for a configurable time after they were
+last used, so later commands, and the service, reuse them.
+
+The control path is built from the host, port and user only, unlike
+ansible's own, so that the ssh run by ansible, the health checks and the
+keep-warm pool all find the same connection, whichever container they
+run in.
+
+Keeping connections warm opens a master connection to every given server
+that has none, and runs a no-op through the ones that do, which resets
+their persist timer. The service does it for every server on every
+refresh, so that commands never have to wait for an ssh handshake.
+"""
+
+import concurrent.futures
+import getpass
+import os
+import re
+
+import health
+
+SSH_PORT = 22
+
+TIME_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_time(value):
+    """
+    Returns the seconds of a time in the format of ssh_config, such as 90,
+    30m or 1h30m
+    """
+    return sum(
+        int(amount) * TIME_UNITS[unit]
+        for amount, unit in re.findall(r"(\d+)([smhdw]?)", str(value).lower())
+    )
+
+
+def control_path(control_dir):
+    return os.path.join(control_dir, "%h-%p-%r")
+
+
+def ssh_options(control_dir, persist, master="auto"):
+    """
+    Returns the ssh options that share connections through control_dir,
+    keeping them open for persist after they were last used. A master of
+    "no" only uses connections that are already open.
+    """
+    options = [
+        "-o",
+        "ControlMaster={}".format(master),
+        "-o",
+        "ControlPath={}".format(control_path(control_dir)),
+    ]
+    if master != "no":
+        options += ["-o", "ControlPersist={}".format(persist)]
+    return options
+
+
+def ansible_env(control_dir, persist):
+    """
+    Returns the environment for ansible to share connections through
+    control_dir. Ansible does not add a control path of its own when its
+    ssh args already have one.
+    """
+    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+    return {"ANSIBLE_SSH_ARGS": " ".join(ssh_options(control_dir, persist))}
+
+
+def get_warm_hosts(hosts, control_dir, user=None):
+    """
+    Returns the given hosts that have a control socket, which are the ones
+    the next command connects to without a handshake
+    """
+    user = user or getpass.getuser()
+    return [
+        host
+        for host in hosts
+        if os.path.exists(
+            os.path.join(control_dir, "{}-{}-{}".format(host, SSH_PORT, user))
+        )
+    ]
+
+
+def keep_warm(hosts, control_dir, persist, timeout=10.0, concurrency=200):
+    """
+    Opens, or keeps open, a master connection to every given host. Returns
+    a dictionary of the hosts that could not be reached to the reason why.
+    """
+    if not hosts:
+        return {}
+
+    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+    options = ssh_options(control_dir, persist)
+
+    # The master connection is left running in the background, so ssh is
+    # run like the health checks run it, without reading what it prints
+    def _keep_warm(host):
+        try:
+            return health.run_ssh(
+                health.SSH_CMD + options + [host, "true"], timeout, read_errors=False
+            )
+        except Exception as exc:
+            return "ssh could not be run: {}".format(exc)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as threads:
+        reasons = list(threads.map(_keep_warm, hosts))
+
+    return {host: reason for host, reason in zip(hosts, reasons) if reason is not None}
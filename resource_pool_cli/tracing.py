@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+
+"""
+Records where the time goes in a command as a tree of spans. The command
+itself is the root span, and every phase, ansible run and helper step that
+it goes through is a span under it. The tasks of ansible runs are recorded
+per host, using the durations reported by the json_lines callback.
+
+Phases run on threads of their own, so a span is attached to the span that
+is current on its thread, unless it is given a parent explicitly.
+
+A finished trace can be written as json, as a Prometheus textfile collector
+file, or printed as a summary table.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+from prettytable import PrettyTable
+
+
+class Span:
+    def __init__(self, name, parent=None, start=None, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = start if start is not None else time.time()
+        self.end = None
+        self.children = []
+        self._lock = threading.Lock()
+
+        if parent is not None:
+            with parent._lock:
+                parent.children.append(self)
+
+    def finish(self, end=None):
+        self.end = end if end is not None else time.time()
+
+    @property
+    def duration(self):
+        end = self.end if self.end is not None else time.time()
+        return end - self.start
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "attributes": self.attributes,
+            "start": self.start,
+            "duration": self.duration,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+_local = threading.local()
+_root = None
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def start_trace(name, **attributes):
+    """
+    Starts a new trace, whose root span becomes the current span of this
+    thread and the parent of spans on threads that have none
+    """
+    global _root
+
+    _root = Span(name, **attributes)
+    _stack()[:] = [_root]
+    return _root
+
+
+def finish_trace():
+    """
+    Finishes the root span, and returns it, or None if no trace was started
+    """
+    if _root is not None and _root.end is None:
+        _root.finish()
+    return _root
+
+
+def stop_trace():
+    """
+    Stops recording, for processes that run for too long to keep a trace
+    """
+    global _root
+
+    _root = None
+    _stack()[:] = []
+
+
+def current_span():
+    stack = _stack()
+    return stack[-1] if stack else _root
+
+
+def start_span(name, parent=None, **attributes):
+    """
+    Returns a new span under parent, or under the current span. The span is
+    not made current, so this suits spans that are finished elsewhere, such
+    as by a generator.
+    """
+    return Span(name, parent or current_span(), **attributes)
+
+
+def record_span(name, start, end, parent=None, **attributes):
+    """
+    Records a span that already happened
+    """
+    span = Span(name, parent or current_span(), start=start, **attributes)
+    span.finish(end)
+    return span
+
+
+@contextlib.contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Records the enclosed block as a span, which is the current span of this
+    thread while the block runs
+    """
+    new_span = start_span(name, parent, **attributes)
+    stack = _stack()
+    stack.append(new_span)
+    try:
+        yield new_span
+    finally:
+        new_span.finish()
+        stack.pop()
+
+
+def traced(name):
+    """
+    Decorator that records every call of a function as a span
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def write_json(root, trace_file):
+    with open(trace_file, "w") as f:
+        json.dump(root.to_dict(), f, indent=2, default=str)
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _walk(span):
+    yield span
+    for child in span.children:
+        yield from _walk(child)
+
+
+def write_prometheus(root, metrics_file):
+    """
+    Writes the durations of a trace in the Prometheus text format. The file
+    is replaced at once, since the textfile collector may read it at any
+    time.
+    """
+    command = _label_value(root.name)
+    step_durations = {}
+    task_durations = {}
+
+    for span in _walk(root):
+        if span is root:
+            continue
+        if "host" in span.attributes:
+            # The slowest host is what holds up the run
+            task = span.name
+            task_durations[task] = max(task_durations.get(task, 0), span.duration)
+        else:
+            step_durations[span.name] = step_durations.get(span.name, 0) + span.duration
+
+    lines = [
+        "# HELP resource_pool_cli_command_duration_seconds Duration of the last run of a command.",
+        "# TYPE resource_pool_cli_command_duration_seconds gauge",
+        'resource_pool_cli_command_duration_seconds{{command="{}"}} {:.3f}'.format(
+            command, root.duration
+        ),
+        "# HELP resource_pool_cli_command_last_run_timestamp_seconds When a command last finished.",
+        "# TYPE resource_pool_cli_command_last_run_timestamp_seconds gauge",
+        'resource_pool_cli_command_last_run_timestamp_seconds{{command="{}"}} {:.3f}'.format(
+            command, root.end or time.time()
+        ),
+        "# HELP resource_pool_cli_step_duration_seconds Total duration of the phases and steps of the last run of a command.",
+        "# TYPE resource_pool_cli_step_duration_seconds gauge",
+    ]
+    for step, duration in sorted(step_durations.items()):
+        lines.append(
+            'resource_pool_cli_step_duration_seconds{{command="{}",step="{}"}} {:.3f}'.format(
+                command, _label_value(step), duration
+            )
+        )
+
+    lines += [
+        "# HELP resource_pool_cli_task_max_host_duration_seconds Duration of an ansible task on its slowest host, in the last run of a command.",
+        "# TYPE resource_pool_cli_task_max_host_duration_seconds gauge",
+    ]
+    for task, duration in sorted(task_durations.items()):
+        lines.append(
+            'resource_pool_cli_task_max_host_duration_seconds{{command="{}",task="{}"}} {:.3f}'.format(
+                command, _label_value(task), duration
+            )
+        )
+
+    _replace_file(metrics_file, lines)
+
+
+def write_gauges(metrics_file, gauges):
+    """
+    Writes gauges in the Prometheus text format, for processes that are not
+    traced as a single command. gauges is a list of (name, help, samples)
+    tuples, where samples is a list of (labels, value) tuples and labels is
+    a dictionary.
+    """
+    lines = []
+    for name, help_text, samples in gauges:
+        lines += [
+            "# HELP {} {}".format(name, help_text),
+            "# TYPE {} gauge".format(name),
+        ]
+        for labels, value in samples:
+            label_text = ",".join(
+                '{}="{}"'.format(key, _label_value(label))
+                for key, label in sorted(labels.items())
+            )
+            if label_text:
+                label_text = "{{{}}}".format(label_text)
+            lines.append("{}{} {:.3f}".format(name, label_text, value))
+
+    _replace_file(metrics_file, lines)
+
+
+def _replace_file(metrics_file, lines):
+    temp_file = "{}.{}.tmp".format(metrics_file, os.getpid())
+    with open(temp_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_file, metrics_file)
+
+
+def summary_table(root):
+    """
+    Returns a table of the trace as an indented tree. Spans with the same
+    name under the same parent, such as the per host results of a task, are
+    shown as one row with their count, the time from the first start to
+    the last end, and the longest single duration.
+    """
+    output_table = PrettyTable(["Span", "Count", "Wall (s)", "Max (s)"])
+    output_table.align["Span"] = "l"
+
+    def add_rows(spans, depth):
+        groups = {}
+        for span in spans:
+            groups.setdefault(span.name, []).append(span)
+
+        for name, group in sorted(
+            groups.items(), key=lambda item: min(span.start for span in item[1])
+        ):
+            wall = max(span.start + span.duration for span in group) - min(
+                span.start for span in group
+            )
+            output_table.add_row(
+                [
+                    "{}{}".format("  " * depth, name),
+                    len(group),
+                    "{:.2f}".format(wall),
+                    "{:.2f}".format(max(span.duration for span in group)),
+                ]
+            )
+            add_rows([child for span in group for child in span.children], depth + 1)
+
+    add_rows([root], 0)
+    return output_table
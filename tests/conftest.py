@@ -0,0 +1,139 @@
+"""
+Tests import the modules of the cli the way its scripts do, from the cli
+directory, and run the cli itself against a fake fleet in a directory of
+their own.
+"""
+
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_DIR = os.path.join(REPO_DIR, "resource_pool_cli")
+sys.path.insert(0, CLI_DIR)
+
+import fake_fleet
+import inventory
+import journal
+import service
+
+CLI = os.path.join(CLI_DIR, "resource_pool_cli.py")
+
+
+# Stands in for ssh, failing the login when any of its arguments mentions
+# "denied", and never answering when one mentions "slow"
+FAKE_SSH = """#!/bin/sh
+case "$*" in
+  *denied*) echo "Permission denied (publickey)." >&2; exit 255;;
+  *slow*) exec sleep 30;;
+esac
+exit 0
+"""
+
+
+@pytest.fixture
+def fake_ssh(tmp_path, monkeypatch):
+    ssh = tmp_path / "bin" / "ssh"
+    ssh.parent.mkdir()
+    ssh.write_text(FAKE_SSH)
+    ssh.chmod(ssh.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", "{}:{}".format(ssh.parent, os.environ["PATH"]))
+
+
+class FakeFleet:
+    """
+    A fake fleet of servers, with the cli set up to run against it
+    """
+
+    def __init__(self, ansible_dir, host_count):
+        self.ansible_dir = ansible_dir
+        self.pools_dir = os.path.join(ansible_dir, "pools")
+        fake_fleet.write_ansible_dir(
+            ansible_dir, os.path.join(REPO_DIR, "ansible"), host_count
+        )
+
+        self.env = dict(os.environ)
+        self.env.update(
+            {
+                "RP_ANSIBLE_DIR": ansible_dir,
+                "RP_ANSIBLE_BACKEND": "fake",
+                "RP_FAKE_SEED": "0",
+                "RP_TRACE_DIR": os.path.join(ansible_dir, "traces"),
+                "RP_SERVICE_SOCKET": os.path.join(ansible_dir, "no-service.sock"),
+                "RP_READY_TIMEOUT": "5",
+                "PYTHONUNBUFFERED": "1",
+            }
+        )
+
+    def run(self, *args, returncode=0, env=None):
+        """
+        Runs the cli, and returns its output. Fails the test if it does not
+        exit with returncode.
+        """
+        process = subprocess.run(
+            [sys.executable, CLI] + [str(arg) for arg in args],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=dict(self.env, **(env or {})),
+        )
+        output = process.stdout.decode(errors="replace")
+        assert process.returncode == returncode, output
+        return output
+
+    def show(self, rp_name):
+        return json.loads(self.run("show", rp_name, "-o", "json"))["pools"][0]
+
+    def inventory(self):
+        return inventory.InventoryStore(os.path.join(self.pools_dir, ".inventory.db"))
+
+    def journal(self, rp_name):
+        return journal.Journal.load(
+            os.path.join(self.pools_dir, rp_name, "journal.json")
+        )
+
+    def events(self):
+        events_file = os.path.join(self.pools_dir, ".events.log")
+        if not os.path.exists(events_file):
+            return []
+        with open(events_file) as f:
+            return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def fleet(tmp_path):
+    return FakeFleet(str(tmp_path / "ansible"), 12)
+
+
+@pytest.fixture
+def pool_service(fleet):
+    # Unix socket paths are short, so the socket cannot live in tmp_path
+    socket_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(socket_dir, "service.sock")
+    fleet.env["RP_SERVICE_SOCKET"] = socket_path
+
+    process = subprocess.Popen(
+        [sys.executable, CLI, "serve"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=fleet.env,
+    )
+    client = service.ServiceClient(socket_path)
+    deadline = time.monotonic() + 10
+    while not client.is_available():
+        assert time.monotonic() < deadline, "the service did not start"
+        time.sleep(0.05)
+
+    yield client
+
+    process.terminate()
+    process.wait()
+    shutil.rmtree(socket_dir)
@@ -0,0 +1,77 @@
+import pytest
+
+import capacity
+
+# Two sockets of 8 cores with hyperthreading, and 64 GB of memory
+PROBE = {"sockets": 2, "cores_per_socket": 8, "vcpus": 32, "mem_kb": 64 * 1024 * 1024}
+
+
+def test_cpu_accounting():
+    for cpu_accounting, cores in [("physical", 16), ("vcpus", 32), ("socket", 8)]:
+        policy = capacity.CapacityPolicy(cpu_accounting, allocatable=False)
+        specs = policy.get_specs(PROBE)
+
+        assert specs["cores"] == cores
+        assert specs["mem"] == 64
+        assert (specs["sockets"], specs["physical_cores"], specs["vcpus"]) == (
+            2,
+            16,
+            32,
+        )
+
+
+def test_allocatable_takes_every_reservation_off():
+    policy = capacity.CapacityPolicy(
+        kube_reserved="cpu=1,memory=2",
+        system_reserved="cpu=0.5,memory=1",
+        eviction_hard="memory=0.5",
+    )
+    specs = policy.get_specs(PROBE)
+
+    assert specs["cores"] == specs["allocatable_cores"] == 14.5
+    assert specs["mem"] == specs["allocatable_mem"] == 60.5
+    assert isinstance(capacity.CapacityPolicy().get_specs(PROBE)["cores"], int)
+
+
+def test_reservations_are_only_counted_when_allocatable():
+    policy = capacity.CapacityPolicy(allocatable=False, kube_reserved="cpu=4")
+    specs = policy.get_specs(PROBE)
+
+    assert specs["cores"] == 16
+    assert specs["allocatable_cores"] == 12
+
+
+def test_reservations_never_make_capacity_negative():
+    policy = capacity.CapacityPolicy(kube_reserved="cpu=100,memory=1000")
+    specs = policy.get_specs(PROBE)
+
+    assert (specs["cores"], specs["mem"]) == (0, 0)
+
+
+def test_virtual_machines_without_sockets_count_a_core_per_vcpu():
+    probe = {"sockets": 0, "cores_per_socket": 0, "vcpus": 4, "mem_kb": 8388608}
+
+    for cpu_accounting in capacity.CPU_ACCOUNTINGS:
+        policy = capacity.CapacityPolicy(cpu_accounting, allocatable=False)
+        assert policy.get_specs(probe)["cores"] == 4
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"cpu_accounting": "threads"},
+        {"kube_reserved": "gpu=1"},
+        {"system_reserved": "cpu=lots"},
+    ],
+)
+def test_invalid_policies_are_rejected(kwargs):
+    with pytest.raises(capacity.CapacityError):
+        capacity.CapacityPolicy(**kwargs)
+
+
+def test_parse_reserved():
+    assert capacity.parse_reserved(None) == {"cpu": 0.0, "memory": 0.0}
+    assert capacity.parse_reserved(" cpu=1, memory=2,cpu=0.5 ") == {
+        "cpu": 1.5,
+        "memory": 2.0,
+    }
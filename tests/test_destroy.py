@@ -0,0 +1,55 @@
+import os
+
+import fake_fleet
+
+
+def status_table(output):
+    # The rows of the table of pools printed by destroy
+    rows = {}
+    for line in output.splitlines():
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        if line.startswith("|") and len(cells) == 2:
+            rows[cells[0]] = cells[1]
+    return rows
+
+
+def test_globs_destroy_every_pool_they_match(fleet):
+    for rp_name in ("test-1", "test-2", "keep"):
+        fleet.run("create", rp_name, "-c", 8, "-m", 16)
+
+    output = fleet.run("destroy", "test-*", "-y")
+
+    assert status_table(output) == {
+        "Pool": "Status",
+        "test-1": "destroyed",
+        "test-2": "destroyed",
+    }
+    assert fleet.inventory().get_pool_names() == ["fleet", "keep"]
+
+
+def test_names_that_match_no_pool_destroy_nothing(fleet):
+    fleet.run("create", "p1", "-c", 8, "-m", 16)
+
+    for args in (["p1", "p2"], ["test-*"], ["fleet"]):
+        output = fleet.run("destroy", *args, "-y", returncode=1)
+        assert "There is no resource pool named {}.".format(args[-1]) in output
+
+    assert fleet.inventory().get_pool_names() == ["fleet", "p1"]
+
+
+def test_servers_that_could_not_be_reset_are_quarantined(fleet):
+    fleet.run("create", "p1", "-c", 20, "-m", 30)
+    fleet.run("create", "p2", "-c", 8, "-m", 16)
+    store = fleet.inventory()
+    servers = store.get_servers("p1")
+    down = store.get_servers("p1", "workers")[:1]
+    fake_fleet.mark_down(os.path.join(fleet.ansible_dir, ".fake_fleet.json"), down)
+
+    output = fleet.run("destroy", "p1", "p2", "-y", returncode=1)
+
+    assert status_table(output)["p1"] == (
+        "destroyed, 1 of {} servers could not be reset".format(len(servers))
+    )
+    assert status_table(output)["p2"] == "destroyed"
+    assert store.get_pool_names() == ["fleet"]
+    assert list(store.get_failing_hosts()) == down
@@ -0,0 +1,126 @@
+import json
+import os
+import sys
+
+import pytest
+import yaml
+
+import executor
+import pool_helpers as rp
+
+# Stands in for the drain and reset playbooks. Nodes of servers with
+# "stuck" in their name cannot be drained, and servers with "broken" in
+# their name cannot be reset.
+FAKE_ANSIBLE_PLAYBOOK = """#!{python}
+import json, os, sys
+
+args = sys.argv[1:]
+with open(os.environ["FAKE_ANSIBLE_LOG"], "a") as log:
+    log.write(json.dumps(args) + "\\n")
+
+def emit(host, task, status, **result):
+    print(json.dumps({{"event": "runner", "host": host, "task": task,
+                      "status": status, "result": result}}))
+
+if args[0].endswith("drain.yml"):
+    nodes = json.loads(args[args.index("--extra-vars") + 1])["nodes"]
+    lines = [
+        "{{}} {{}}".format("FAILED" if "stuck" in node else "DRAINED", node)
+        for node in nodes.split(",")
+    ]
+    emit("master", "drain nodes", "ok", stdout_lines=lines)
+else:
+    for host in args[args.index("--limit") + 1].split(","):
+        emit(host, "kubeadm reset", "failed" if "broken" in host else "ok")
+"""
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    pools_dir = tmp_path / "pools"
+    (pools_dir / "fleet").mkdir(parents=True)
+    servers = ["m1", "w1", "stuck1", "broken1", "w2"]
+    with open(str(pools_dir / "fleet" / "hosts.yml"), "w") as f:
+        yaml.dump({"all": {"hosts": {server: None for server in servers}}}, f)
+
+    playbook = tmp_path / "bin" / "ansible-playbook"
+    playbook.parent.mkdir()
+    playbook.write_text(FAKE_ANSIBLE_PLAYBOOK.format(python=sys.executable))
+    playbook.chmod(0o755)
+
+    monkeypatch.setenv("PATH", "{}:{}".format(playbook.parent, os.environ["PATH"]))
+    monkeypatch.setenv("FAKE_ANSIBLE_LOG", str(tmp_path / "ansible.log"))
+    monkeypatch.setattr(rp, "POOLS_DIR", str(pools_dir))
+    monkeypatch.setattr(
+        rp, "FLEET_HOSTS_YAML_FILE", str(pools_dir / "fleet" / "hosts.yml")
+    )
+    monkeypatch.setattr(rp, "INVENTORY_DB_FILE", str(pools_dir / ".inventory.db"))
+    monkeypatch.setattr(rp, "_inventory_store", None)
+    monkeypatch.setattr(rp, "ANSIBLE_BACKEND", executor.SUBPROCESS_BACKEND)
+    monkeypatch.setattr(rp, "_ansible_executor", None)
+
+    rp.init_pool("p1", ["m1"], servers[1:])
+    (pools_dir / "p1").mkdir()
+    return tmp_path
+
+
+def playbook_runs(tmp_path):
+    with open(str(tmp_path / "ansible.log")) as log:
+        return [json.loads(line) for line in log]
+
+
+def table_rows(out):
+    return [
+        [cell.strip() for cell in line.strip("|").split("|")]
+        for line in out.splitlines()
+        if line.startswith("|")
+    ]
+
+
+def test_only_drained_and_reset_servers_are_returned(pool, capsys):
+    with pytest.raises(RuntimeError) as error:
+        rp.return_workers_to_fleet("p1", ["w1", "stuck1", "broken1"], concurrency=3)
+
+    assert str(error.value) == "2 of 3 workers could not be returned to the fleet"
+    assert sorted(rp.get_servers("p1", "workers")) == ["broken1", "stuck1", "w2"]
+    assert "w1" in rp.get_servers("fleet", "hosts")
+
+    assert table_rows(capsys.readouterr().out) == [
+        ["Server", "Status"],
+        ["w1", "returned to fleet"],
+        ["stuck1", "drain failed"],
+        ["broken1", "reset failed"],
+    ]
+
+
+def test_every_node_is_drained_and_reset_in_one_run(pool):
+    with pytest.raises(RuntimeError):
+        rp.return_workers_to_fleet("p1", ["w1", "stuck1", "w2"], concurrency=2)
+
+    drain, reset = playbook_runs(pool)
+    extra_vars = json.loads(drain[drain.index("--extra-vars") + 1])
+    assert extra_vars["nodes"] == "ip-w1,ip-stuck1,ip-w2"
+    assert extra_vars["drain_concurrency"] == 2
+
+    # Nodes that were not drained are not reset
+    assert reset[reset.index("--limit") + 1] == "w1,w2"
+
+
+def test_playbooks_that_fail_raise_unless_the_caller_handles_hosts(pool):
+    workers_file = rp.get_inventory_file("p1", "workers")
+
+    with pytest.raises(rp.PlaybookFailed) as failed:
+        rp.run_playbook("reset", workers_file, limit=["w1", "broken1"])
+    assert failed.value.failed_hosts == ["broken1"]
+    assert str(failed.value) == "reset.yml failed on broken1"
+
+    reset_run = rp.run_playbook(
+        "reset", workers_file, limit=["w1", "broken1"], check=False
+    )
+    assert reset_run.ok_hosts == ["w1"]
+
+    # A playbook that fails before any host runs it always raises
+    with pytest.raises(rp.PlaybookFailed) as failed:
+        rp.run_playbook("reset", workers_file, check=False)
+    assert failed.value.failed_hosts == []
+    assert str(failed.value) == "reset.yml exited with code 1"
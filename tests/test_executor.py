@@ -0,0 +1,119 @@
+import json
+import sys
+
+import executor
+
+REQUEST = {"kind": "adhoc", "module": "raw"}
+
+
+def runner(host, task, status, **result):
+    return {
+        "event": "runner",
+        "host": host,
+        "task": task,
+        "status": status,
+        "duration": 0.5,
+        "time": 1000.0,
+        "result": result,
+    }
+
+
+def fake_ansible(events, returncode=0, noise=()):
+    # A command that prints the given events the way the json_lines
+    # callback does, mixed with lines that are not json
+    lines = list(noise) + [json.dumps(event) for event in events]
+    script = "import sys\nprint({!r})\nsys.exit({})".format(
+        "\n".join(lines), returncode
+    )
+    return [sys.executable, "-c", script]
+
+
+def ansible_run(cmd, **kwargs):
+    subprocess_executor = executor.AnsibleExecutor(
+        "callback_plugins", executor.SUBPROCESS_BACKEND
+    )
+    return executor.AnsibleRun(subprocess_executor, cmd, REQUEST, **kwargs)
+
+
+def test_a_run_tracks_the_status_of_every_host(capsys):
+    cmd = fake_ansible(
+        [
+            runner("a", "install", "ok"),
+            runner("b", "install", "ok"),
+            runner("a", "restart", "ok"),
+            runner("b", "restart", "failed", msg="service not found"),
+            runner("c", "install", "unreachable", msg="timed out"),
+        ],
+        returncode=4,
+    )
+
+    run = ansible_run(cmd).run()
+
+    assert run.returncode == 4
+    assert run.ok_hosts == ["a"]
+    assert sorted(run.failed_hosts) == ["b", "c"]
+    assert [event["host"] for event in run.failures] == ["b", "c"]
+    assert ("restart", "b", 0.5) in run.task_timings
+
+    err = capsys.readouterr().err
+    assert "b failed at 'restart': service not found" in err
+    assert "c unreachable at 'install': timed out" in err
+
+
+def test_results_of_captured_tasks_can_be_looked_up():
+    cmd = fake_ansible(
+        [
+            runner("m", "join token creation", "ok", stdout="kubeadm join ..."),
+            runner("m", "restart", "ok", stdout="ignored"),
+        ]
+    )
+
+    run = ansible_run(cmd, capture=["join token creation"]).run()
+
+    assert run.results_for("join token creation") == {
+        "m": {"stdout": "kubeadm join ..."}
+    }
+    assert run.results_for("restart") == {}
+
+
+def test_a_run_that_fails_before_any_task_shows_what_ansible_printed(capsys):
+    cmd = fake_ansible([], returncode=1, noise=["ERROR! the playbook is missing"])
+
+    run = ansible_run(cmd).run()
+
+    assert run.returncode == 1
+    assert run.host_status == {}
+    assert list(run.log_tail) == ["ERROR! the playbook is missing"]
+    assert "ERROR! the playbook is missing" in capsys.readouterr().err
+
+
+def test_commands_run_as_processes_when_a_worker_cannot_start(
+    tmp_path, monkeypatch, capsys
+):
+    monkeypatch.setattr(executor, "WORKER_SCRIPT", str(tmp_path / "missing.py"))
+    worker_executor = executor.AnsibleExecutor("callback_plugins")
+
+    run = executor.AnsibleRun(
+        worker_executor, fake_ansible([runner("a", "install", "ok")]), REQUEST
+    ).run()
+
+    assert run.ok_hosts == ["a"]
+    assert worker_executor.backend == executor.SUBPROCESS_BACKEND
+    assert "Could not start an ansible worker" in capsys.readouterr().err
+
+
+def test_parse_join_command():
+    stdout = (
+        "W1018 13:00:00 warnings are printed first\n"
+        "kubeadm join 10.0.0.1:6443 --token abcdef.0123456789abcdef "
+        "--discovery-token-ca-cert-hash sha256:1234 \n"
+    )
+
+    assert executor.parse_join_command(stdout) == {
+        "endpoint": "10.0.0.1:6443",
+        "token": "abcdef.0123456789abcdef",
+        "ca_cert_hash": "sha256:1234",
+    }
+    assert executor.parse_join_command("") is None
+    assert executor.parse_join_command("kubeadm join 10.0.0.1:6443 --token") is None
+    assert executor.parse_join_command("kubeadm join 10.0.0.1:6443 --token abc") is None
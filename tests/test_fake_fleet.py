@@ -0,0 +1,72 @@
+import json
+import os
+
+import fake_fleet
+
+
+def clusters(fleet):
+    with open(os.path.join(fleet.ansible_dir, ".fake_fleet.json")) as f:
+        return json.load(f)["clusters"]
+
+
+def pool_table(output):
+    # The rows of the pool tables printed by list and show
+    rows = {}
+    for line in output.splitlines():
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        if line.startswith("|") and len(cells) == 2:
+            rows[cells[0]] = cells[1]
+    return rows
+
+
+def test_fake_servers_always_have_the_same_specs():
+    servers = fake_fleet.get_fake_server_names(300)
+
+    assert servers[:2] == ["10.0.0.1", "10.0.0.2"]
+    assert servers[250] == "10.0.1.1"
+    assert len(set(servers)) == 300
+    assert [fake_fleet.get_fake_server_specs(server) for server in servers] == [
+        fake_fleet.get_fake_server_specs(server) for server in servers
+    ]
+
+
+def test_the_fleet_is_probed_for_its_specs(fleet):
+    specs = [
+        fake_fleet.get_fake_server_specs(server)
+        for server in fake_fleet.get_fake_server_names(12)
+    ]
+
+    table = pool_table(fleet.run("list"))
+
+    assert table["CPU Cores"] == str(
+        sum(probe["sockets"] * probe["cores_per_socket"] for probe in specs)
+    )
+    assert table["GB of RAM"] == str(sum(probe["mem_kb"] // 1024**2 for probe in specs))
+
+
+def test_a_created_pool_is_a_cluster_of_its_servers(fleet):
+    output = fleet.run("create", "p1", "-c", 20, "-m", 30)
+
+    assert "Workers were ready" in output
+    store = fleet.inventory()
+    (master,) = store.get_servers("p1", "masters")
+    workers = store.get_servers("p1", "workers")
+    assert sorted(clusters(fleet)[master]) == sorted([master] + workers)
+
+
+def test_prewarmed_servers_are_not_installed_again(fleet):
+    assert "12 of 12 servers now have kubernetes" in fleet.run("prewarm")
+
+    output = fleet.run("create", "p1", "-c", 20, "-m", 30)
+
+    assert "Skipping kubernetes install" in output
+    assert "ansible-playbook install_k8s.yml" not in fleet.run(
+        "--profile", "create", "p2", "-c", 8, "-m", 16
+    )
+
+
+def test_unreachable_servers_are_left_out_of_the_specs(fleet):
+    output = fleet.run("list", env={"RP_FAKE_FAILURE_RATE": "1"})
+
+    assert "Could not reach 10.0.0.1: Failed to connect to the host via ssh" in output
+    assert pool_table(output)["CPU Cores"] == "0"
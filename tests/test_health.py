@@ -0,0 +1,76 @@
+import socket
+import threading
+
+import pytest
+
+import health
+
+
+@pytest.fixture
+def ssh_port():
+    """
+    A port on localhost that answers every connection with an ssh banner
+    """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(50)
+
+    def serve():
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            connection.sendall(b"SSH-2.0-fake\r\n")
+            connection.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+
+def in_thread(func, *args, **kwargs):
+    """
+    Calls func on a thread of its own, like the service and the site
+    coordinator do, and returns what it returned
+    """
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func(*args, **kwargs)))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+def test_check_hosts(fake_ssh, ssh_port):
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+
+    assert health.check_hosts(["127.0.0.1"], port=ssh_port, timeout=5) == {}
+
+    failed = health.check_hosts(["127.0.0.1"], port=closed_port, timeout=5)
+    assert list(failed) == ["127.0.0.1"]
+    assert failed["127.0.0.1"].startswith("port {}".format(closed_port))
+
+
+def test_failed_logins_are_reasons_on_any_thread(fake_ssh, ssh_port):
+    failed = in_thread(
+        health.check_hosts,
+        ["127.0.0.1"],
+        port=ssh_port,
+        timeout=5,
+        ssh_options=["-o", "User=denied"],
+    )
+
+    assert failed == {"127.0.0.1": "Permission denied (publickey)."}
+
+
+def test_run_ssh(fake_ssh):
+    assert health.run_ssh(["ssh", "host"], 5) is None
+    assert health.run_ssh(["ssh", "denied"], 5) == "Permission denied (publickey)."
+    assert health.run_ssh(["ssh", "denied"], 5, read_errors=False) == (
+        "ssh exited with code 255"
+    )
+    assert health.run_ssh(["ssh", "slow"], 0.5) == "ssh timed out"
+    assert health.run_ssh(["no-such-ssh"], 5).startswith("ssh could not be run")
@@ -0,0 +1,176 @@
+import os
+
+import pytest
+import yaml
+
+import inventory
+
+FLEET = ["10.0.0.{}".format(index) for index in range(1, 9)]
+
+
+def write_hosts(hosts_file, servers):
+    with open(hosts_file, "w") as f:
+        yaml.dump({"all": {"hosts": {server: None for server in servers}}}, f)
+    # The fleet file is synced when its mtime changes, which is only as
+    # precise as the file system
+    mtime = os.stat(hosts_file).st_mtime
+    os.utime(hosts_file, (mtime, mtime + len(servers)))
+
+
+@pytest.fixture
+def store(tmp_path):
+    fleet_dir = tmp_path / "fleet"
+    fleet_dir.mkdir()
+    write_hosts(str(fleet_dir / "hosts.yml"), FLEET)
+
+    store = inventory.InventoryStore(str(tmp_path / ".inventory.db"))
+    store.sync_fleet_file(str(fleet_dir / "hosts.yml"))
+    return store
+
+
+def test_the_fleet_is_read_from_its_hosts_file(store):
+    assert store.get_pool_names() == ["fleet"]
+    assert sorted(store.get_servers("fleet")) == sorted(FLEET)
+
+
+def test_creating_a_pool_moves_its_servers_out_of_the_fleet(store):
+    store.create_pool("p1", FLEET[:1], FLEET[1:3])
+
+    assert store.get_pool_names() == ["fleet", "p1"]
+    assert store.get_servers("p1", "masters") == FLEET[:1]
+    assert sorted(store.get_servers("p1", "workers")) == FLEET[1:3]
+    assert len(store.get_servers("fleet")) == len(FLEET) - 3
+    assert store.get_server_pools(FLEET[:2]) == {FLEET[0]: "p1", FLEET[1]: "p1"}
+
+
+def test_a_failed_move_changes_nothing(store):
+    store.create_pool("p1", FLEET[:1], FLEET[1:3])
+
+    # One of the servers is not in the fleet any more
+    with pytest.raises(inventory.InventoryError):
+        store.transfer_servers(FLEET[2:5], "fleet", "p1", "workers")
+
+    assert sorted(store.get_servers("p1", "workers")) == FLEET[1:3]
+    assert store.get_server_pools(FLEET[3:5]) == {
+        FLEET[3]: "fleet",
+        FLEET[4]: "fleet",
+    }
+
+
+def test_deleting_a_pool_returns_its_servers_to_the_fleet(store):
+    store.create_pool("p1", FLEET[:1], FLEET[1:3])
+
+    moved = store.delete_pool("p1")
+
+    assert sorted(moved) == FLEET[:3]
+    assert store.get_pool_names() == ["fleet"]
+    assert sorted(store.get_servers("fleet")) == sorted(FLEET)
+
+
+def test_cached_probes_expire_and_are_dropped_when_a_server_moves(store):
+    probe = {"sockets": 1, "cores_per_socket": 8, "vcpus": 8, "mem_kb": 1}
+    store.save_probes({FLEET[0]: probe, FLEET[1]: probe})
+
+    assert store.get_cached_probes(FLEET[:3], max_age=60) == {
+        FLEET[0]: probe,
+        FLEET[1]: probe,
+    }
+    assert store.get_cached_probes(FLEET[:3], max_age=-1) == {}
+
+    store.create_pool("p1", FLEET[:1], [])
+    assert list(store.get_cached_probes(FLEET[:3], max_age=60)) == [FLEET[1]]
+
+
+def test_deleting_pools_returns_their_servers_to_the_fleet(store):
+    store.create_pool("p1", FLEET[:1], FLEET[1:3])
+    store.create_pool("p2", FLEET[3:4], FLEET[4:5])
+
+    moved = store.delete_pools(["p1", "p2"])
+
+    assert sorted(moved["p1"]) == FLEET[:3]
+    assert sorted(moved["p2"]) == FLEET[3:5]
+    assert store.get_pool_names() == ["fleet"]
+    assert sorted(store.get_servers("fleet")) == sorted(FLEET)
+
+
+def test_hosts_files_are_only_written_when_the_pool_changed(store, tmp_path):
+    pool_dir = tmp_path / "p1"
+    pool_dir.mkdir()
+    store.create_pool("p1", FLEET[:1], FLEET[1:3])
+
+    store.render_inventory("p1", str(pool_dir))
+    with open(str(pool_dir / "workers.yml")) as f:
+        assert sorted(yaml.safe_load(f)["all"]["hosts"]) == FLEET[1:3]
+
+    os.remove(str(pool_dir / "workers.yml"))
+    store.render_inventory("p1", str(pool_dir))
+    assert not os.path.exists(str(pool_dir / "workers.yml"))
+
+    store.transfer_servers(FLEET[3:4], "fleet", "p1", "workers")
+    store.render_inventory("p1", str(pool_dir))
+    with open(str(pool_dir / "workers.yml")) as f:
+        assert sorted(yaml.safe_load(f)["all"]["hosts"]) == FLEET[1:4]
+
+
+def test_editing_the_fleet_file_adds_and_removes_fleet_servers(store, tmp_path):
+    store.create_pool("p1", FLEET[:1], FLEET[1:2])
+
+    # The servers of pools are never touched, even if they are left out
+    fleet_file = str(tmp_path / "fleet" / "hosts.yml")
+    write_hosts(fleet_file, FLEET[3:] + ["10.0.1.1"])
+    store.sync_fleet_file(fleet_file)
+
+    assert sorted(store.get_servers("fleet")) == sorted(FLEET[3:] + ["10.0.1.1"])
+    assert store.get_servers("p1", "masters") == FLEET[:1]
+
+
+def test_a_pool_keeps_the_capacity_it_was_created_for(store):
+    store.create_pool("p1", FLEET[:1], FLEET[1:3], cores=8, mem=32)
+    store.create_pool("p2", FLEET[3:4], FLEET[4:5])
+
+    assert store.get_desired_capacities() == {
+        "p1": {"cores": 8, "mem": 32, "drift_since": None},
+        "p2": {"cores": None, "mem": None, "drift_since": None},
+    }
+
+    store.delete_pool("p1")
+    assert list(store.get_desired_capacities()) == ["p2"]
+
+
+def test_a_resource_given_as_none_keeps_its_desired_amount(store):
+    store.create_pool("p1", FLEET[:1], FLEET[1:3], cores=8, mem=32)
+
+    store.set_desired_capacity("p1", cores=4)
+    assert store.get_desired_capacities()["p1"]["cores"] == 4
+    assert store.get_desired_capacities()["p1"]["mem"] == 32
+
+    store.set_desired_capacity("p1", mem=16)
+    assert store.get_desired_capacities()["p1"]["cores"] == 4
+    assert store.get_desired_capacities()["p1"]["mem"] == 16
+
+
+def test_reserved_servers_can_only_be_moved_by_their_operation(store):
+    store.reserve(FLEET[:2], "p1", "token-1", ttl=60)
+
+    with pytest.raises(inventory.InventoryError):
+        store.reserve(FLEET[1:3], "p2", "token-2", ttl=60)
+    with pytest.raises(inventory.InventoryError):
+        store.create_pool("p2", FLEET[:1], FLEET[2:3], token="token-2")
+    assert store.get_pool_names() == ["fleet"]
+    assert store.get_reserved(FLEET[:3], "token-2") == set(FLEET[:2])
+
+    # Moving the servers is what they were reserved for
+    store.create_pool("p1", FLEET[:1], FLEET[1:2], token="token-1")
+    assert store.get_reserved(FLEET[:3]) == set()
+
+
+def test_reservations_are_released_or_expire(store):
+    store.reserve(FLEET[:2], "p1", "token-1", ttl=60)
+    store.reserve(FLEET[2:4], "p2", "token-2", ttl=0)
+
+    # An expired reservation does not hold the servers
+    assert store.get_reserved(FLEET[:4]) == set(FLEET[:2])
+    store.reserve(FLEET[2:4], "p3", "token-3", ttl=60)
+
+    store.release_reservations("token-1")
+    assert store.get_reserved(FLEET[:4]) == set(FLEET[2:4])
@@ -0,0 +1,32 @@
+# Every join fails, and the workers that failed are retried right away
+JOIN_ENV = {"RP_FAKE_FAILED_TASKS": "kubeadm join", "RP_JOIN_RETRY_DELAY": "0"}
+
+
+def test_only_the_workers_that_failed_to_join_are_retried(fleet):
+    env = dict(JOIN_ENV, RP_FAKE_FAILED_TASK_RUNS="1", RP_JOIN_BATCH_SIZE="1")
+
+    output = fleet.run("create", "p1", "-c", 60, "-m", 200, env=env)
+
+    workers = fleet.inventory().get_servers("p1", "workers")
+    assert len(workers) > 1
+    assert "Retrying to join 1 workers in 0 seconds..." in output
+    assert "could not join" not in output
+
+
+def test_workers_that_never_join_are_returned_to_the_fleet(fleet):
+    env = dict(JOIN_ENV, RP_JOIN_RETRIES="1")
+
+    output = fleet.run("create", "p1", "-c", 60, "-m", 200, env=env, returncode=1)
+
+    assert "These workers could not join the pool:" in output
+    assert "Phase join workers failed: No worker could join the pool" in output
+    rows = [
+        [cell.strip() for cell in line.strip("|").split("|")]
+        for line in output.splitlines()
+        if line.startswith("| 10.")
+    ]
+    assert rows and all(row[1:] == ["2", "failed"] for row in rows)
+    store = fleet.inventory()
+    assert store.get_servers("p1", "workers") == []
+    for server, _, _ in rows:
+        assert server in store.get_servers("fleet")
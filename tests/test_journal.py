@@ -0,0 +1,56 @@
+import journal
+
+
+def test_a_journal_is_kept_across_loads(tmp_path):
+    journal_file = str(tmp_path / "journal.json")
+    started = journal.Journal.start(journal_file, "p1", "create", {"masters": ["m"]})
+    started.mark_done("install master", ["m"])
+    started.set_host_status({"w1": "joined", "w2": "failed"})
+
+    loaded = journal.Journal.load(journal_file)
+
+    assert (loaded.rp_name, loaded.operation, loaded.args) == (
+        "p1",
+        "create",
+        {"masters": ["m"]},
+    )
+    assert loaded.is_done("install master")
+    assert not loaded.is_done("init master")
+    assert loaded.get_result("install master") == ["m"]
+    assert loaded.get_host_status("w1") == "joined"
+    assert loaded.get_host_status("w3") is None
+    assert not loaded.is_finished
+
+    loaded.finish()
+    assert journal.Journal.load(journal_file).is_finished
+
+
+def test_results_that_cannot_be_kept_as_json_are_dropped(tmp_path):
+    journal_file = str(tmp_path / "journal.json")
+    started = journal.Journal.start(journal_file, "p1", "resize", {})
+
+    started.mark_done("transfer servers", object())
+
+    loaded = journal.Journal.load(journal_file)
+    assert loaded.is_done("transfer servers")
+    assert loaded.get_result("transfer servers") is None
+
+
+def test_starting_an_operation_replaces_the_previous_journal(tmp_path):
+    journal_file = str(tmp_path / "journal.json")
+    journal.Journal.start(journal_file, "p1", "create", {}).finish()
+
+    journal.Journal.start(journal_file, "p1", "resize", {"cores": 4})
+
+    loaded = journal.Journal.load(journal_file)
+    assert loaded.operation == "resize"
+    assert not loaded.is_finished
+    assert loaded.state["phases"] == {}
+
+
+def test_a_missing_or_broken_journal_loads_as_none(tmp_path):
+    assert journal.Journal.load(str(tmp_path / "missing.json")) is None
+
+    broken = tmp_path / "broken.json"
+    broken.write_text("{")
+    assert journal.Journal.load(str(broken)) is None
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+import locks
+
+
+@pytest.fixture
+def lock_manager(fleet):
+    return locks.LockManager(os.path.join(fleet.pools_dir, ".locks"))
+
+
+def test_a_busy_pool_names_the_operation_holding_it(tmp_path):
+    lock_manager = locks.LockManager(str(tmp_path))
+
+    with lock_manager.pool_lock("p1", "resize"):
+        with pytest.raises(locks.LockBusy) as busy:
+            with lock_manager.pool_lock("p1", "destroy", timeout=0.1):
+                pass
+        assert "The p1 pool is busy with another operation: resize (pid {}".format(
+            os.getpid()
+        ) in str(busy.value)
+
+        # Other pools are not held up
+        with lock_manager.pool_lock("p2", "destroy"):
+            pass
+
+    with lock_manager.pool_lock("p1", "destroy"):
+        pass
+
+
+def test_operations_on_a_busy_pool_exit_non_zero(fleet, lock_manager):
+    fleet.run("create", "p1", "-c", 20, "-m", 30)
+    workers = fleet.inventory().get_servers("p1", "workers")
+
+    with lock_manager.pool_lock("p1", "reconcile"):
+        for args in (["resize", "p1", "-c", 40, "-y"], ["destroy", "p1", "-y"]):
+            output = fleet.run(*args, returncode=1)
+            assert "The p1 pool is busy with another operation: reconcile" in output
+
+        # Creating another pool still goes ahead
+        fleet.run("create", "p2", "-c", 8, "-m", 8)
+
+    assert fleet.inventory().get_servers("p1", "workers") == workers
+
+
+def test_a_stale_plan_is_not_run(fleet):
+    fleet.run("create", "p1", "-c", 20, "-m", 30)
+    fleet.run("create", "p2", "-c", 8, "-m", 8)
+    (taken,) = fleet.inventory().get_servers("p2", "masters")
+
+    output = fleet.run("resize", "p1", "-y", "--add-server", taken, returncode=1)
+
+    assert "The p1 pool changed since the resize was planned" in output
+    assert taken not in fleet.inventory().get_servers("p1", "workers")
+
+
+def test_the_service_does_not_plan_a_busy_pool(fleet, lock_manager, pool_service):
+    fleet.run("create", "p1", "-c", 20, "-m", 30)
+
+    with lock_manager.pool_lock("p1", "reconcile"):
+        output = fleet.run("resize", "p1", "-c", 40, "-y", returncode=1)
+
+    assert "The p1 pool is busy with another operation: reconcile" in output
+    assert fleet.run("resize", "p1", "-c", 40, "-y")
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+import orchestrator
+
+
+def recorder(order, name, result=None, delay=0):
+    def phase():
+        time.sleep(delay)
+        order.append(name)
+        return result
+
+    return phase
+
+
+def test_phases_run_after_their_dependencies_and_share_results():
+    order = []
+    graph = orchestrator.PhaseGraph()
+    graph.add("install", recorder(order, "install", "token"))
+    graph.add(
+        "join",
+        lambda: order.append("join") or graph.results["install"] * 2,
+        depends_on=["install"],
+    )
+    graph.add("dashboard", recorder(order, "dashboard"), depends_on=["join"])
+
+    graph.run()
+
+    assert order == ["install", "join", "dashboard"]
+    assert graph.results["join"] == "tokentoken"
+
+
+def test_a_phase_cannot_depend_on_an_unknown_phase():
+    graph = orchestrator.PhaseGraph()
+
+    with pytest.raises(ValueError):
+        graph.add("join", lambda: None, depends_on=["install"])
+
+
+def test_independent_phases_run_in_parallel():
+    # Each phase waits for the other to start, which only works if both
+    # are running at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    graph = orchestrator.PhaseGraph()
+    graph.add("install masters", barrier.wait)
+    graph.add("install workers", barrier.wait)
+    graph.add("join", lambda: None, depends_on=["install masters", "install workers"])
+
+    graph.run()
+
+    assert sorted(graph.results) == ["install masters", "install workers", "join"]
+
+
+def test_a_failed_phase_stops_its_dependents():
+    order = []
+    graph = orchestrator.PhaseGraph()
+    graph.add("init master", lambda: 1 / 0)
+    graph.add("install workers", recorder(order, "install workers", delay=0.1))
+    graph.add("join", recorder(order, "join"), depends_on=["init master"])
+    graph.add("dashboard", recorder(order, "dashboard"), depends_on=["install workers"])
+
+    with pytest.raises(orchestrator.PhaseFailed) as failed:
+        graph.run()
+
+    assert failed.value.phase_name == "init master"
+    assert isinstance(failed.value.error, ZeroDivisionError)
+    # Phases that were already running are waited for, but nothing new starts
+    assert order == ["install workers"]
+    assert "init master" in graph.timings and "join" not in graph.timings
+
+
+def test_the_critical_path_follows_the_dependencies_that_finished_last():
+    order = []
+    graph = orchestrator.PhaseGraph()
+    graph.add("install masters", recorder(order, "install masters"))
+    graph.add("install workers", recorder(order, "install workers", delay=0.2))
+    graph.add("init master", recorder(order, "init master"), ["install masters"])
+    graph.add(
+        "join",
+        recorder(order, "join"),
+        depends_on=["init master", "install workers"],
+    )
+
+    graph.run()
+
+    assert graph.critical_path() == ["install workers", "join"]
+
+    report = graph.report()
+    assert [name for name, _, _, _ in report][-1] == "join"
+    critical = {name for name, _, _, is_critical in report if is_critical}
+    assert critical == {"install workers", "join"}
+    durations = {name: duration for name, _, duration, _ in report}
+    assert durations["install workers"] >= 0.2
@@ -0,0 +1,47 @@
+import json
+
+
+def test_json_output_keeps_the_requested_order(fleet):
+    fleet.run("create", "p1", "-c", 8, "-m", 16)
+    fleet.run("create", "p2", "-c", 8, "-m", 16)
+
+    pools = json.loads(fleet.run("show", "p2", "p1", "-o", "json"))["pools"]
+
+    assert [pool["name"] for pool in pools] == ["p2", "p1"]
+    for pool in pools:
+        assert pool["desired_cores"] == 8 and pool["desired_mem"] == 16
+        assert pool["cores"] == sum(host["cores"] for host in pool["hosts"])
+        assert all(host["reachable"] for host in pool["hosts"])
+
+
+def test_ndjson_output_is_one_pool_per_line(fleet):
+    fleet.run("create", "p1", "-c", 8, "-m", 16)
+
+    lines = fleet.run("list", "-o", "ndjson").splitlines()
+    pools = [json.loads(line) for line in lines]
+
+    assert sorted(pool["name"] for pool in pools) == ["fleet", "p1"]
+    assert all(pool["hosts"] for pool in pools)
+
+
+def test_unreachable_hosts_are_listed_with_the_reason(fleet):
+    output = fleet.run(
+        "show", "fleet", "-o", "ndjson", env={"RP_FAKE_FAILURE_RATE": "1"}
+    )
+    # The hosts that could not be reached are also reported on stderr
+    (pool,) = [json.loads(line) for line in output.splitlines() if line[:1] == "{"]
+
+    assert pool["cores"] == 0
+    assert len(pool["hosts"]) == 12
+    for host in pool["hosts"]:
+        assert not host["reachable"]
+        assert "Failed to connect to the host via ssh" in host["reason"]
+
+
+def test_the_service_streams_the_same_pools(fleet, pool_service):
+    fleet.run("create", "p1", "-c", 8, "-m", 16)
+    local = json.loads(fleet.run("--local", "list", "-o", "json"))
+
+    streamed = sorted(pool_service.iter_pools(["fleet", "p1"]), key=lambda p: p["name"])
+
+    assert streamed == sorted(local["pools"], key=lambda pool: pool["name"])
@@ -0,0 +1,110 @@
+import placement
+
+
+def specs(**servers):
+    return {
+        server: {"cores": cores, "mem": mem} for server, (cores, mem) in servers.items()
+    }
+
+
+def test_picks_the_servers_that_fit_the_request_best():
+    candidates = specs(a=(8, 32), b=(16, 64), c=(12, 48))
+
+    result = placement.select_servers(candidates, 12, 48)
+    assert result["servers"] == ["c"]
+
+    # Filling the request greedily overshoots, and swapping servers fixes it
+    result = placement.select_servers(candidates, 20, 80)
+    assert sorted(result["servers"]) == ["a", "c"]
+    assert (result["cores"], result["mem"]) == (20, 80)
+
+
+def test_returns_none_when_the_request_cannot_be_met():
+    candidates = specs(a=(8, 32), b=(16, 64))
+
+    assert placement.select_servers(candidates, 25, 10) is None
+    assert placement.select_servers(candidates, 10, 100) is None
+    assert placement.select_servers(candidates, 1, 1, min_servers=3) is None
+
+
+def test_a_resource_that_is_not_requested_is_not_constrained():
+    candidates = specs(a=(8, 256), b=(16, 16))
+
+    result = placement.select_servers(candidates, 16, None)
+
+    assert result["servers"] == ["b"]
+
+
+def test_min_servers():
+    candidates = specs(a=(8, 32), b=(8, 32), c=(16, 64))
+
+    result = placement.select_servers(candidates, 4, 4, min_servers=2)
+
+    assert len(result["servers"]) == 2
+    assert "c" not in result["servers"]
+
+
+def test_prefers_preferred_servers_with_the_same_specs():
+    candidates = specs(a=(8, 32), b=(8, 32), c=(8, 32))
+
+    result = placement.select_servers(candidates, 8, 32, preferred=["b"])
+
+    assert result["servers"] == ["b"]
+    assert result["added"] == ["b"]
+
+
+def test_shrinking_keeps_current_servers_and_reports_the_removed_ones():
+    pool = specs(a=(8, 32), b=(8, 32), c=(8, 32), d=(8, 32))
+
+    result = placement.select_servers(pool, 16, 64, current=pool)
+
+    assert len(result["servers"]) == 2
+    assert result["added"] == []
+    assert sorted(result["removed"] + result["servers"]) == ["a", "b", "c", "d"]
+
+
+def test_a_pool_that_fits_is_not_reshuffled():
+    pool = specs(a=(8, 32), b=(8, 32))
+    candidates = dict(pool, **specs(c=(8, 32), d=(16, 64)))
+
+    result = placement.select_servers(candidates, 16, 64, current=pool)
+
+    assert sorted(result["servers"]) == ["a", "b"]
+    assert result["added"] == [] and result["removed"] == []
+
+
+def test_rebalancing_swaps_servers_rather_than_rebuilding_the_pool():
+    # The pool has enough cores, but needs more memory and fewer cores
+    pool = specs(a=(16, 16), b=(16, 16), c=(4, 16))
+    candidates = dict(pool, **specs(d=(4, 64), e=(4, 64)))
+
+    result = placement.select_servers(candidates, 20, 80, current=pool)
+
+    assert result["cores"] >= 20 and result["mem"] >= 80
+    assert "a" in result["servers"] or "b" in result["servers"]
+    assert result["added"] and result["removed"]
+
+
+def test_selecting_from_groups_matches_selecting_servers():
+    candidates = specs(a=(8, 32), b=(16, 64), c=(4, 16), d=(4, 16))
+    groups = placement.group_servers(candidates, preferred=["d"])
+
+    assert placement.select_from_groups(groups, 12, 48) == placement.select_servers(
+        candidates, 12, 48, preferred=["d"]
+    )
+
+
+def test_large_fleets_are_placed_within_one_server_of_the_request():
+    configs = [(8, 32), (16, 64), (32, 128), (4, 256)]
+    candidates = {
+        "server-{}".format(index): {
+            "cores": configs[index % 4][0],
+            "mem": configs[index % 4][1],
+        }
+        for index in range(10000)
+    }
+
+    result = placement.select_servers(candidates, 1000, 5000, time_budget=2)
+
+    assert 1000 <= result["cores"] < 1000 + 32
+    assert 5000 <= result["mem"] < 5000 + 256
@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+import planner
+
+
+def specs(**servers):
+    return {
+        server: {"cores": cores, "mem": mem} for server, (cores, mem) in servers.items()
+    }
+
+
+# The fleet in the order create goes through it, with the first of the
+# biggest servers as the master of a new pool
+FLEET = specs(a=(4, 16), m1=(8, 32), b=(4, 16), m2=(8, 32), c=(4, 16), d=(4, 16))
+
+
+@pytest.mark.parametrize(
+    "cores, memory, resize_type",
+    [
+        (16, 64, "increase"),
+        (16, None, "increase"),
+        (4, 16, "decrease"),
+        (0, 16, "decrease"),
+        (16, 16, "rebalance"),
+        (8, 32, None),
+        (None, None, None),
+    ],
+)
+def test_get_resize_type(cores, memory, resize_type):
+    assert planner.get_resize_type(8, 32, cores, memory) == resize_type
+
+
+def test_plans_a_new_pool_like_create():
+    fleet_planner = planner.Planner(FLEET, {})
+
+    plan = fleet_planner.plan("p1", 8, 32)
+
+    assert plan["operation"] == "create"
+    assert plan["error"] is None
+    assert plan["master"] == "m1"
+    assert (plan["cores"], plan["mem"]) == (8, 32)
+    assert "m1" not in plan["add"] and plan["remove"] == []
+    assert (plan["fleet_cores"], plan["fleet_mem"]) == (16, 64)
+
+    # Every request is planned against the fleet as it is
+    assert fleet_planner.plan("p2", 8, 32) == dict(plan, pool="p2")
+
+
+def test_a_cumulative_plan_takes_servers_out_of_the_fleet():
+    fleet_planner = planner.Planner(FLEET, {}, cumulative=True)
+
+    first = fleet_planner.plan("p1", 8, 32)
+    second = fleet_planner.plan("p2", 4, 16)
+
+    assert (first["master"], first["add"]) == ("m1", ["m2"])
+    assert second["master"] == "a"
+    assert len(second["add"]) == 1 and second["add"][0] in ("b", "c", "d")
+    assert (second["fleet_cores"], second["fleet_mem"]) == (8, 32)
+
+    # A master and 8 more cores are more than the fleet has left
+    third = fleet_planner.plan("p3", 8, 32)
+    assert third["error"] is not None
+    assert (third["fleet_cores"], third["fleet_mem"]) == (8, 32)
+
+
+def test_plans_an_existing_pool_like_resize():
+    pool_specs = {"p1": specs(w1=(4, 16), w2=(4, 16))}
+    fleet_planner = planner.Planner(FLEET, pool_specs, cumulative=True)
+
+    plan = fleet_planner.plan("p1", 12, 48)
+    assert plan["operation"] == "increase"
+    assert plan["master"] is None
+    assert (plan["cores"], plan["mem"]) == (12, 48)
+    assert (plan["fleet_cores"], plan["fleet_mem"]) == (28, 112)
+
+    plan = fleet_planner.plan("p1", 4, 16)
+    assert plan["operation"] == "decrease"
+    assert plan["add"] == [] and len(plan["remove"]) == 2
+    assert (plan["cores"], plan["mem"]) == (4, 16)
+    assert (plan["fleet_cores"], plan["fleet_mem"]) == (36, 144)
+
+    plan = fleet_planner.plan("p1", 4, 16)
+    assert plan["error"] == "The request equals the current state of the pool."
+
+
+def test_a_request_that_cannot_be_met_changes_nothing():
+    fleet_planner = planner.Planner(FLEET, {}, cumulative=True)
+
+    plan = fleet_planner.plan("p1", 100, 400)
+    assert plan["error"] is not None
+    assert plan["master"] is None and plan["add"] == []
+    assert (plan["fleet_cores"], plan["fleet_mem"]) == (32, 128)
+
+    assert fleet_planner.plan("p1", 8, 32)["error"] is None
+
+
+def test_pools_constrained_to_a_site_only_use_its_servers():
+    server_sites = {"a": "east", "b": "east", "c": "west", "d": "west", "w1": "west"}
+    fleet_planner = planner.Planner(
+        FLEET,
+        {"p1": specs(w1=(4, 16))},
+        server_sites=server_sites,
+        pool_sites={"p1": "west"},
+    )
+
+    plan = fleet_planner.plan("p2", 4, 16, site="east")
+    assert plan["site"] == "east"
+    assert set(plan["add"] + [plan["master"]]) <= {"a", "b"}
+
+    plan = fleet_planner.plan("p1", 12, 48)
+    assert plan["error"] is None
+    assert sorted(plan["add"]) == ["c", "d"]
+
+    plan = fleet_planner.plan("p1", 16, 64)
+    assert plan["error"] == "The requested resources are not available."
+
+    plan = fleet_planner.plan("p1", 8, 32, site="east")
+    assert plan["error"] == "The pool is not constrained to the east site."
+
+
+def test_resize_runs_the_plan_of_the_planner(fleet):
+    fleet.run("create", "p1", "-c", 20, "-m", 30)
+    workers = fleet.inventory().get_servers("p1", "workers")
+
+    (plan,) = json.loads(fleet.run("plan", "p1", "-c", 40, "-o", "json"))["plans"]
+    fleet.run("resize", "p1", "-c", 40, "-y")
+
+    assert sorted(fleet.inventory().get_servers("p1", "workers")) == sorted(
+        workers + plan["add"]
+    )
+    output = fleet.run("resize", "p1", "-c", 10000, "-y", returncode=1)
+    assert "The requested resources are not available." in output
+    assert "Available cores: {}".format(plan["fleet_cores"]) in output
@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+
+import pytest
+import yaml
+
+import executor
+import pool_helpers as rp
+
+# Stands in for install_k8s.yml, finishing the install on every limited host
+# except the ones with "broken" in their name
+FAKE_ANSIBLE_PLAYBOOK = """#!{python}
+import json, os, sys
+
+args = sys.argv[1:]
+with open(os.environ["FAKE_ANSIBLE_LOG"], "a") as log:
+    log.write(json.dumps(args) + "\\n")
+
+for host in args[args.index("--limit") + 1].split(","):
+    status = "failed" if "broken" in host else "ok"
+    print(json.dumps({{"event": "runner", "host": host, "task": "restart kubelet",
+                      "status": status, "result": {{}}}}))
+"""
+
+FLEET = ["s1", "s2", "s3", "broken1"]
+
+
+@pytest.fixture
+def fleet(tmp_path, monkeypatch):
+    pools_dir = tmp_path / "pools"
+    (pools_dir / "fleet").mkdir(parents=True)
+    with open(str(pools_dir / "fleet" / "hosts.yml"), "w") as f:
+        yaml.dump({"all": {"hosts": {server: None for server in FLEET}}}, f)
+
+    playbook = tmp_path / "bin" / "ansible-playbook"
+    playbook.parent.mkdir()
+    playbook.write_text(FAKE_ANSIBLE_PLAYBOOK.format(python=sys.executable))
+    playbook.chmod(0o755)
+
+    monkeypatch.setenv("PATH", "{}:{}".format(playbook.parent, os.environ["PATH"]))
+    monkeypatch.setenv("FAKE_ANSIBLE_LOG", str(tmp_path / "ansible.log"))
+    monkeypatch.setattr(rp, "POOLS_DIR", str(pools_dir))
+    monkeypatch.setattr(
+        rp, "FLEET_HOSTS_YAML_FILE", str(pools_dir / "fleet" / "hosts.yml")
+    )
+    monkeypatch.setattr(rp, "INVENTORY_DB_FILE", str(pools_dir / ".inventory.db"))
+    monkeypatch.setattr(rp, "_inventory_store", None)
+    monkeypatch.setattr(rp, "ANSIBLE_BACKEND", executor.SUBPROCESS_BACKEND)
+    monkeypatch.setattr(rp, "_ansible_executor", None)
+    return tmp_path
+
+
+def installed_on(tmp_path):
+    with open(str(tmp_path / "ansible.log")) as log:
+        runs = [json.loads(line) for line in log]
+    return [run[run.index("--limit") + 1] for run in runs]
+
+
+def test_only_servers_that_finished_the_install_are_prewarmed(fleet):
+    installed = rp.install_k8s("fleet", "hosts", ["s1", "broken1"])
+
+    assert installed == ["s1"]
+    assert rp.get_prewarmed(FLEET) == ["s1"]
+
+
+def test_prewarmed_servers_skip_the_install(fleet, capsys):
+    rp.install_k8s("fleet", "hosts", ["s1"])
+
+    installed = rp.install_k8s("fleet", "hosts", ["s1", "s2"])
+
+    assert sorted(installed) == ["s1", "s2"]
+    assert installed_on(fleet) == ["s1", "s2"]
+    assert (
+        "Skipping kubernetes install on 1 prewarmed servers" in capsys.readouterr().out
+    )
+
+    # Nothing is run when every server is prewarmed
+    rp.install_k8s("fleet", "hosts", ["s1", "s2"])
+    assert installed_on(fleet) == ["s1", "s2"]
+
+
+def test_a_new_kubernetes_version_is_installed_again(fleet, monkeypatch):
+    rp.install_k8s("fleet", "hosts", ["s1"])
+    monkeypatch.setattr(rp, "K8S_VERSION", "1.15.0-00")
+
+    assert rp.get_prewarmed(["s1"]) == []
+    rp.install_k8s("fleet", "hosts", ["s1"])
+    assert installed_on(fleet) == ["s1", "s1"]
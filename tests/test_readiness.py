@@ -0,0 +1,102 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+import readiness
+
+
+class HealthzHandler(http.server.BaseHTTPRequestHandler):
+    # Answers with the server's status codes, one per request, repeating the
+    # last one once the others are used up
+    def do_GET(self):
+        server = self.server
+        status = server.statuses[min(server.requests, len(server.statuses) - 1)]
+        server.requests += 1
+
+        body = b"ok" if status == 200 else b"etcd not ready"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def healthz():
+    servers = []
+
+    def start(*statuses):
+        server = http.server.HTTPServer(("127.0.0.1", 0), HealthzHandler)
+        server.statuses = statuses
+        server.requests = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, "http://127.0.0.1:{}/healthz".format(server.server_port)
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_a_healthy_apiserver_is_ready_right_away(healthz):
+    server, url = healthz(200)
+
+    assert readiness.is_apiserver_healthy(url)
+    assert readiness.wait_for(lambda: readiness.is_apiserver_healthy(url), 5) < 1
+    assert server.requests == 2
+
+
+def test_server_errors_are_retried_until_the_apiserver_is_healthy(healthz):
+    server, url = healthz(500, 503, 200)
+
+    assert not readiness.is_apiserver_healthy(url)
+    server.requests = 0
+
+    waited = readiness.wait_for(
+        lambda: readiness.is_apiserver_healthy(url), 5, initial_delay=0.01
+    )
+
+    assert server.requests == 3
+    # The delay doubles between attempts
+    assert 0.03 <= waited < 5
+
+
+def test_waiting_gives_up_after_the_timeout(healthz):
+    server, url = healthz(503)
+
+    with pytest.raises(readiness.ReadinessTimeout):
+        readiness.wait_for(
+            lambda: readiness.is_apiserver_healthy(url),
+            0.2,
+            initial_delay=0.01,
+            max_delay=0.05,
+        )
+    assert server.requests > 2
+
+
+def test_an_apiserver_that_is_not_listening_is_not_healthy(healthz):
+    server, url = healthz(200)
+    server.shutdown()
+    server.server_close()
+
+    assert not readiness.is_apiserver_healthy(url, request_timeout=0.5)
+
+
+def test_parse_node_readiness():
+    def node(name, ready):
+        condition = {"type": "Ready", "status": "True" if ready else "False"}
+        return {"metadata": {"name": name}, "status": {"conditions": [condition]}}
+
+    nodes = {"items": [node("ip-10-0-0-2", True), node("ip-10-0-0-3", False)]}
+
+    assert readiness.parse_node_readiness(json.dumps(nodes)) == {
+        "ip-10-0-0-2": True,
+        "ip-10-0-0-3": False,
+    }
+    assert readiness.parse_node_readiness("The connection was refused") == {}
@@ -0,0 +1,60 @@
+import os
+
+import fake_fleet
+import journal
+
+# A worker is down after a single failed check, so every test needs only
+# one pass to notice it
+RECONCILE_ENV = {"RP_RECONCILE_FAILURES": "1", "RP_RECONCILE_CHECK_BUDGET": "100"}
+
+
+def mark_down(fleet, servers):
+    fake_fleet.mark_down(os.path.join(fleet.ansible_dir, ".fake_fleet.json"), servers)
+
+
+def test_resize_then_reconcile_changes_nothing(fleet):
+    fleet.run("create", "p1", "-c", 40, "-m", 50)
+    fleet.run("resize", "p1", "-c", 20, "-y")
+    resized = fleet.show("p1")
+
+    # The memory was not given, and is kept at what the shrink left
+    assert resized["desired_cores"] == 20
+    assert resized["desired_mem"] == resized["mem"]
+
+    fleet.run("reconcile", "--once", env=RECONCILE_ENV)
+
+    assert fleet.show("p1")["hosts"] == resized["hosts"]
+    assert not [event for event in fleet.events() if event["pool"] == "p1"]
+
+
+def test_reconcile_replaces_a_worker_that_went_down(fleet):
+    fleet.run("create", "p1", "-c", 20, "-m", 30)
+    workers = fleet.inventory().get_servers("p1", "workers")
+    mark_down(fleet, workers[:1])
+
+    fleet.run("reconcile", "--once", env=RECONCILE_ENV)
+
+    pool = fleet.show("p1")
+    assert workers[0] not in fleet.inventory().get_servers("p1", "workers")
+    assert pool["cores"] >= 20 and pool["mem"] >= 30
+    events = [event["event"] for event in fleet.events()]
+    assert "workers_evicted" in events and "healed" in events
+
+
+def test_reconcile_skips_a_pool_whose_create_did_not_finish(fleet):
+    fleet.run("create", "p1", "-c", 20, "-m", 30)
+    workers = fleet.inventory().get_servers("p1", "workers")
+
+    # As if the create had stopped partway, before the master was set up
+    journal.Journal.start(
+        os.path.join(fleet.pools_dir, "p1", "journal.json"), "p1", "create", {}
+    )
+    mark_down(fleet, workers[:1])
+
+    output = fleet.run("reconcile", "--once", env=RECONCILE_ENV)
+
+    assert "pool_unfinished" in output
+    assert fleet.inventory().get_servers("p1", "workers") == workers
+    events = [event["event"] for event in fleet.events() if event["pool"] == "p1"]
+    assert "workers_evicted" not in events
+    assert "replacement_started" not in events
@@ -0,0 +1,105 @@
+import os
+
+
+def test_resume_create_after_init_master_failed(fleet):
+    # kubeadm init went through, and the master is left partly set up
+    output = fleet.run(
+        "create",
+        "p1",
+        "-c",
+        20,
+        "-m",
+        30,
+        returncode=1,
+        env={"RP_FAKE_FAILED_TASKS": "install flannel network plugin"},
+    )
+    assert "resume p1" in output
+    journal = fleet.journal("p1")
+    assert not journal.is_finished
+    assert not journal.is_done("init master")
+    assert journal.is_done("install master")
+
+    phases = journal.state["phases"]
+
+    fleet.run("resume", "p1")
+
+    # The phases that had finished are not run again
+    journal = fleet.journal("p1")
+    assert journal.is_finished
+    for phase_name, phase in phases.items():
+        assert journal.state["phases"][phase_name]["finished"] == phase["finished"]
+    with open(os.path.join(fleet.pools_dir, "p1", "join.yml")) as f:
+        join_playbook = f.read()
+    assert "MASTERIP" not in join_playbook and "CREDS" not in join_playbook
+
+    pool = fleet.show("p1")
+    assert pool["cores"] >= 20 and pool["mem"] >= 30
+    assert "nothing to resume" in fleet.run("resume", "p1")
+
+
+def test_a_failed_dashboard_fails_the_create(fleet):
+    output = fleet.run(
+        "create",
+        "p1",
+        "-c",
+        20,
+        "-m",
+        30,
+        returncode=1,
+        env={"RP_FAKE_FAILED_TASKS": "apply dashboard yamls"},
+    )
+
+    assert "Phase deploy dashboard failed" in output
+    assert not fleet.journal("p1").is_done("deploy dashboard")
+
+    fleet.run("resume", "p1")
+    assert fleet.journal("p1").is_finished
+
+
+def test_workers_that_could_not_join_are_replaced(fleet):
+    output = fleet.run(
+        "create",
+        "p1",
+        "-c",
+        20,
+        "-m",
+        30,
+        env={
+            "RP_FAKE_FAILED_TASKS": "kubeadm join",
+            "RP_FAKE_FAILED_TASK_RUNS": "1",
+            "RP_JOIN_BATCH_SIZE": "1",
+            "RP_JOIN_RETRIES": "0",
+        },
+    )
+
+    assert "These workers could not join the pool:" in output
+    assert "workers from the fleet in their place" in output
+    pool = fleet.show("p1")
+    assert pool["cores"] >= 20 and pool["mem"] >= 30
+
+
+def test_a_create_without_enough_workers_fails_and_can_be_resumed(fleet):
+    output = fleet.run(
+        "create",
+        "p1",
+        "-c",
+        20,
+        "-m",
+        30,
+        returncode=1,
+        env={
+            "RP_FAKE_FAILED_TASKS": "kubeadm join",
+            "RP_JOIN_RETRIES": "0",
+        },
+    )
+
+    assert "Phase join workers failed: No worker could join the pool" in output
+    assert "resume p1" in output
+    assert fleet.inventory().get_servers("p1", "workers") == []
+    assert not fleet.journal("p1").is_done("join workers")
+
+    fleet.run("resume", "p1")
+
+    assert fleet.journal("p1").is_finished
+    pool = fleet.show("p1")
+    assert pool["cores"] >= 20 and pool["mem"] >= 30
@@ -0,0 +1,47 @@
+def test_failures_exit_non_zero(fleet):
+    assert "You must specify cores and memory" in fleet.run(
+        "create", "p1", "-c", 8, returncode=1
+    )
+    assert "not enough resources" in fleet.run(
+        "create", "p1", "-c", 10000, "-m", 8, returncode=1
+    )
+    assert "There is no resource pool named p2." in fleet.run(
+        "resize", "p2", "-c", 8, returncode=1
+    )
+
+
+def test_commands_are_answered_by_the_service(fleet, pool_service):
+    assert fleet.run("list") == fleet.run("--local", "list")
+    assert [pool["name"] for pool in pool_service.get_pools(["fleet"])] == ["fleet"]
+
+
+def test_jobs_of_the_service_stream_their_output(fleet, pool_service):
+    output = fleet.run("create", "p1", "-c", 20, "-m", 30)
+
+    assert "Workers were ready" in output
+    assert fleet.inventory().pool_exists("p1")
+
+    output = fleet.run("resize", "p1", "-c", 40, "--yes")
+    assert "Moving servers from fleet to p1..." in output
+
+    create_job, resize_job = pool_service.get_jobs()
+    assert create_job["argv"][:2] == ["create", "p1"]
+    assert create_job["status"] == "succeeded"
+    # The client plans and confirms, and the job only runs the plan
+    assert "--add-server" in resize_job["argv"]
+
+
+def test_failed_jobs_exit_non_zero(fleet, pool_service):
+    output = fleet.run("create", "p1", "-c", 10000, "-m", 8, returncode=1)
+
+    assert "not enough resources" in output
+    assert [job["status"] for job in pool_service.get_jobs()] == ["failed"]
+
+    job = pool_service.start_job(["create", "p2", "-c", 10000, "-m", 8])
+    fleet.run("create", "p3", "-c", 8, "-m", 8, "--detach")
+    assert "failed" in fleet.run("jobs")
+    fleet.run("jobs", job["id"], returncode=1)
+
+
+def test_jobs_need_a_running_service(fleet):
+    assert "The resource pool service is not running" in fleet.run("jobs", returncode=1)
@@ -0,0 +1,88 @@
+import fnmatch
+import os
+
+import pytest
+
+import sites
+
+SITES_YAML = """
+east:
+  hosts: ["10.0.0.?"]
+  forks: 10
+west:
+  hosts: ["10.0.0.1?", "west-*"]
+  controller: ["env"]
+"""
+
+
+def write_sites(path, content=SITES_YAML):
+    with open(str(path), "w") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_load_sites(tmp_path):
+    east, west = sites.load_sites(write_sites(tmp_path / "sites.yml"))
+
+    assert (east.name, east.hosts, east.controller, east.forks) == (
+        "east",
+        ["10.0.0.?"],
+        [],
+        10,
+    )
+    assert (west.name, west.controller, west.forks) == ("west", ["env"], None)
+
+
+def test_without_a_sites_file_there_are_no_sites(tmp_path):
+    assert sites.load_sites(str(tmp_path / "sites.yml")) == []
+
+
+@pytest.mark.parametrize(
+    "content", ["default:\n  hosts: ['*']\n", "east:\n  host: ['10.*']\n"]
+)
+def test_invalid_sites_files_are_rejected(tmp_path, content):
+    with pytest.raises(sites.SitesError):
+        sites.load_sites(write_sites(tmp_path / "sites.yml", content))
+
+
+def test_servers_are_in_the_first_site_they_match(tmp_path):
+    site_list = sites.load_sites(write_sites(tmp_path / "sites.yml"))
+
+    assert sites.get_site("10.0.0.3", site_list) == "east"
+    assert sites.get_site("10.0.0.12", site_list) == "west"
+    assert sites.get_site("west-1", site_list) == "west"
+    assert sites.get_site("10.0.1.1", site_list) == sites.DEFAULT_SITE
+    assert sites.get_site("10.0.0.3", []) == sites.DEFAULT_SITE
+
+
+def test_group_by_site_keeps_the_order_of_the_servers(tmp_path):
+    site_list = sites.load_sites(write_sites(tmp_path / "sites.yml"))
+
+    groups = sites.group_by_site(
+        ["10.0.0.11", "10.0.0.2", "other", "10.0.0.10", "10.0.0.1"], site_list
+    )
+
+    assert groups == {
+        "west": ["10.0.0.11", "10.0.0.10"],
+        "east": ["10.0.0.2", "10.0.0.1"],
+        sites.DEFAULT_SITE: ["other"],
+    }
+
+
+def test_a_pool_constrained_to_a_site_only_uses_its_servers(fleet):
+    write_sites(os.path.join(fleet.ansible_dir, "sites.yml"))
+
+    fleet.run("create", "p1", "-c", 10, "-m", 10, "--site", "west")
+    pool = fleet.show("p1")
+    assert pool["site"] == "west"
+    servers = fleet.inventory().get_servers("p1")
+    assert servers and fnmatch.filter(servers, "10.0.0.1?") == servers
+
+    # It only grows within its site, which has three servers
+    fleet.run("resize", "p1", "-c", 1000, "-y", returncode=1)
+    assert sorted(fleet.inventory().get_servers("p1")) == sorted(servers)
+
+    output = fleet.run(
+        "create", "p2", "-c", 10, "-m", 10, "--site", "north", returncode=1
+    )
+    assert "There is no site named north" in output
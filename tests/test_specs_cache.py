@@ -0,0 +1,141 @@
+import os
+import sys
+
+import pytest
+import yaml
+
+import executor
+import pool_helpers as rp
+
+# Stands in for the raw capacity probe, printing a json_lines result for
+# every limited host, and logging which hosts it was asked about. Hosts with
+# "down" in their name are unreachable.
+FAKE_ANSIBLE = """#!{python}
+import json, os, sys
+
+args = sys.argv[1:]
+hosts = args[args.index("--limit") + 1].split(",")
+with open(os.environ["FAKE_ANSIBLE_LOG"], "a") as log:
+    log.write(",".join(hosts) + "\\n")
+print("[WARNING]: not json")
+for host in hosts:
+    event = {{"event": "runner", "host": host, "task": "raw"}}
+    if "down" in host:
+        event.update(status="unreachable", result={{"msg": "timed out"}})
+    else:
+        probe = {{"sockets": 2, "cores_per_socket": 4, "vcpus": 16, "mem_kb": 33554432}}
+        event.update(status="ok", result={{"stdout": json.dumps(probe) + "\\r\\n"}})
+    print(json.dumps(event))
+"""
+
+
+@pytest.fixture
+def pools(tmp_path, monkeypatch):
+    pools_dir = tmp_path / "pools"
+    (pools_dir / "fleet").mkdir(parents=True)
+    with open(str(pools_dir / "fleet" / "hosts.yml"), "w") as f:
+        yaml.dump({"all": {"hosts": {"s1": None, "s2": None}}}, f)
+
+    ansible = tmp_path / "bin" / "ansible"
+    ansible.parent.mkdir()
+    ansible.write_text(FAKE_ANSIBLE.format(python=sys.executable))
+    ansible.chmod(0o755)
+
+    monkeypatch.setenv("PATH", "{}:{}".format(ansible.parent, os.environ["PATH"]))
+    monkeypatch.setenv("FAKE_ANSIBLE_LOG", str(tmp_path / "ansible.log"))
+    monkeypatch.setattr(rp, "POOLS_DIR", str(pools_dir))
+    monkeypatch.setattr(
+        rp, "FLEET_HOSTS_YAML_FILE", str(pools_dir / "fleet" / "hosts.yml")
+    )
+    monkeypatch.setattr(rp, "INVENTORY_DB_FILE", str(pools_dir / ".inventory.db"))
+    monkeypatch.setattr(rp, "_inventory_store", None)
+    monkeypatch.setattr(rp, "ANSIBLE_BACKEND", executor.SUBPROCESS_BACKEND)
+    monkeypatch.setattr(rp, "_ansible_executor", None)
+    monkeypatch.setattr(rp, "FACTS_CACHE_TTL", 3600)
+    monkeypatch.setattr(rp, "_capacity_policy", None)
+    return pools_dir
+
+
+def gathered(pools):
+    log = pools.parent / "ansible.log"
+    if not log.exists():
+        return []
+    return log.read_text().split()
+
+
+def cores_mem(specs):
+    # Only the cores and memory placement fills requests with
+    return {
+        server: {"cores": server_specs["cores"], "mem": server_specs["mem"]}
+        for server, server_specs in specs.items()
+    }
+
+
+def test_specs_are_gathered_once_and_then_served_from_the_cache(pools):
+    expected = {"s1": {"cores": 8, "mem": 32}, "s2": {"cores": 8, "mem": 32}}
+
+    assert cores_mem(rp.get_specs("fleet")) == expected
+    assert cores_mem(rp.get_specs("fleet")) == expected
+    assert gathered(pools) == ["s1,s2"]
+
+    # No facts files are left behind
+    assert sorted(os.listdir(str(pools / "fleet"))) == ["hosts.yml"]
+
+
+def test_expired_and_refreshed_specs_are_gathered_again(pools):
+    rp.get_specs("fleet")
+
+    rp.get_specs("fleet", refresh=True)
+    assert gathered(pools) == ["s1,s2", "s1,s2"]
+
+    rp.get_specs_for_pools(["fleet"], max_age=-1)
+    assert gathered(pools) == ["s1,s2", "s1,s2", "s1,s2"]
+
+
+def test_only_servers_missing_from_the_cache_are_gathered(pools):
+    rp.get_specs("fleet")
+
+    # Moving a server is a good moment to re-check its hardware
+    rp.init_pool("p1", ["s1"], [])
+    rp.transfer_servers(["s1"], "p1", "fleet")
+
+    assert cores_mem(rp.get_specs("fleet"))["s1"] == {"cores": 8, "mem": 32}
+    assert gathered(pools) == ["s1,s2", "s1"]
+
+
+def test_several_pools_are_gathered_in_a_single_run(pools):
+    with open(str(pools / "fleet" / "hosts.yml"), "w") as f:
+        yaml.dump({"all": {"hosts": {n: None for n in ["s1", "s2", "w1", "w2"]}}}, f)
+    rp.get_specs("fleet")
+    (pools / "p1").mkdir()
+    rp.init_pool("p1", ["s2"], ["w1", "w2"])
+
+    all_specs = rp.get_specs_for_pools(["fleet", "p1"])
+
+    assert sorted(all_specs["fleet"]) == ["s1"]
+    assert sorted(all_specs["p1"]) == ["w1", "w2"]
+    assert gathered(pools) == ["s1,s2,w1,w2", "w1,w2"]
+    assert rp.get_total_cores_mem("p1", specs=all_specs["p1"]) == [16, 64]
+
+
+def test_unreachable_servers_are_left_out_and_reported(pools, capsys):
+    with open(str(pools / "fleet" / "hosts.yml"), "w") as f:
+        yaml.dump({"all": {"hosts": {"s1": None, "down1": None}}}, f)
+
+    assert cores_mem(rp.get_specs("fleet")) == {"s1": {"cores": 8, "mem": 32}}
+    assert "Could not reach down1: timed out" in capsys.readouterr().err
+    assert list(rp.get_inventory().get_cached_probes(["s1", "down1"], 60)) == ["s1"]
+
+
+def test_parse_capacity_probe():
+    probe = rp.parse_capacity_probe('noise\n{"vcpus": 4, "mem_kb": 1}\r\n')
+    assert probe == {"vcpus": 4, "mem_kb": 1}
+
+    assert rp.parse_capacity_probe("Shared connection closed\n") is None
+    assert rp.parse_capacity_probe("{not json") is None
+
+    # Without a socket layout, such as in some virtual machines, vcpus are counted
+    probe = {"sockets": 0, "cores_per_socket": 0, "vcpus": 6, "mem_kb": 8388608}
+    assert cores_mem({"vm": rp.get_server_specs(probe)}) == {
+        "vm": {"cores": 6, "mem": 8}
+    }
@@ -0,0 +1,63 @@
+import getpass
+import os
+import threading
+
+import ssh_mux
+
+
+def test_parse_time():
+    assert ssh_mux.parse_time(90) == 90
+    assert ssh_mux.parse_time("90s") == 90
+    assert ssh_mux.parse_time("30m") == 1800
+    assert ssh_mux.parse_time("1h30m") == 5400
+    assert ssh_mux.parse_time("1W2D") == 777600
+
+
+def test_ssh_options():
+    options = ssh_mux.ssh_options("/ssh", "30m")
+    assert options == [
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        "ControlPath=/ssh/%h-%p-%r",
+        "-o",
+        "ControlPersist=30m",
+    ]
+
+    # Only connections that are already open are used, and none are kept
+    options = ssh_mux.ssh_options("/ssh", None, master="no")
+    assert options == ["-o", "ControlMaster=no", "-o", "ControlPath=/ssh/%h-%p-%r"]
+
+
+def test_ansible_env(tmp_path):
+    control_dir = str(tmp_path / "ssh")
+
+    env = ssh_mux.ansible_env(control_dir, "30m")
+
+    assert os.path.isdir(control_dir)
+    assert env["ANSIBLE_SSH_ARGS"] == " ".join(ssh_mux.ssh_options(control_dir, "30m"))
+
+
+def test_get_warm_hosts(tmp_path):
+    open(str(tmp_path / "10.0.0.2-22-{}".format(getpass.getuser())), "w").close()
+    open(str(tmp_path / "10.0.0.3-22-someone-else"), "w").close()
+
+    warm = ssh_mux.get_warm_hosts(["10.0.0.1", "10.0.0.2", "10.0.0.3"], str(tmp_path))
+
+    assert warm == ["10.0.0.2"]
+
+
+def test_keep_warm_on_a_thread(fake_ssh, tmp_path):
+    # The service keeps connections warm from a thread of its own
+    control_dir = str(tmp_path / "ssh")
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(
+            ssh_mux.keep_warm(["host", "denied", "slow"], control_dir, "1m", timeout=1)
+        )
+    )
+    thread.start()
+    thread.join()
+
+    assert results == [{"denied": "ssh exited with code 255", "slow": "ssh timed out"}]
+    assert os.path.isdir(control_dir)
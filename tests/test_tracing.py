@@ -0,0 +1,131 @@
+import re
+import threading
+import time
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def trace():
+    root = tracing.start_trace("create", argv=["create", "p1"])
+    yield root
+    tracing.finish_trace()
+
+
+def test_spans_nest_under_the_current_span(trace):
+    with tracing.span("phase") as phase:
+        with tracing.span("step") as step:
+            time.sleep(0.05)
+        tracing.record_span("task", 100.0, 102.5, host="10.0.0.1")
+
+    assert tracing.current_span() is trace
+    assert [span.name for span in trace.children] == ["phase"]
+    assert [span.name for span in phase.children] == ["step", "task"]
+
+    assert step.duration >= 0.05
+    assert phase.duration >= step.duration
+    assert phase.children[1].duration == 2.5
+    assert phase.children[1].attributes == {"host": "10.0.0.1"}
+
+
+def test_spans_on_other_threads_attach_to_the_given_parent(trace):
+    with tracing.span("phases") as phases:
+        parent = tracing.current_span()
+
+        def phase(name):
+            with tracing.span(name, parent=parent):
+                # Spans started here nest under the phase of this thread
+                with tracing.span("{} step".format(name)):
+                    pass
+
+        threads = [threading.Thread(target=phase, args=(name,)) for name in ["a", "b"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert sorted(span.name for span in phases.children) == ["a", "b"]
+    for span in phases.children:
+        assert [child.name for child in span.children] == ["{} step".format(span.name)]
+
+
+def test_traced_functions_record_a_span_per_call(trace):
+    @tracing.traced("gather specs")
+    def gather():
+        return 42
+
+    assert gather() == 42
+    assert gather() == 42
+    assert [span.name for span in trace.children] == ["gather specs"] * 2
+    assert all(span.end is not None for span in trace.children)
+
+
+def test_a_finished_trace_keeps_its_duration(trace):
+    root = tracing.finish_trace()
+    duration = root.duration
+
+    time.sleep(0.02)
+
+    assert tracing.finish_trace().duration == duration
+    assert root.to_dict()["attributes"] == {"argv": ["create", "p1"]}
+
+
+def test_durations_are_written_in_the_prometheus_text_format(trace, tmp_path):
+    with tracing.span("join workers"):
+        tracing.record_span("kubeadm join", 100.0, 101.0, host="10.0.0.2")
+        tracing.record_span("kubeadm join", 100.0, 104.0, host="10.0.0.3")
+    tracing.record_span('say "hi"', 100.0, 100.5)
+    tracing.finish_trace()
+
+    metrics_file = str(tmp_path / "resource_pool_cli_create.prom")
+    tracing.write_prometheus(trace, metrics_file)
+
+    with open(metrics_file) as f:
+        lines = f.read().splitlines()
+
+    sample = re.compile(r'^[a-z_]+\{([a-z]+="([^"\\]|\\.)*",?)+\} [0-9]+\.[0-9]{3}$')
+    for line in lines:
+        assert (
+            line.startswith("# HELP ")
+            or line.startswith("# TYPE ")
+            or (sample.match(line))
+        ), line
+
+    samples = dict(line.rsplit(" ", 1) for line in lines if not line.startswith("#"))
+    assert (
+        samples[
+            'resource_pool_cli_task_max_host_duration_seconds{command="create",task="kubeadm join"}'
+        ]
+        == "4.000"
+    )
+    assert (
+        samples[
+            'resource_pool_cli_step_duration_seconds{command="create",step="say \\"hi\\""}'
+        ]
+        == "0.500"
+    )
+    assert 'resource_pool_cli_command_duration_seconds{command="create"}' in samples
+    assert "# TYPE resource_pool_cli_step_duration_seconds gauge" in lines
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_the_summary_groups_spans_with_the_same_name(trace):
+    with tracing.span("join workers"):
+        tracing.record_span("kubeadm join", 100.0, 101.0, host="10.0.0.2")
+        tracing.record_span("kubeadm join", 100.5, 104.0, host="10.0.0.3")
+
+    rows = [
+        [cell.strip() for cell in line.strip("|").split("|")]
+        for line in str(tracing.summary_table(trace)).splitlines()
+        if line.startswith("|")
+    ]
+
+    assert [row[0] for row in rows] == [
+        "Span",
+        "create",
+        "join workers",
+        "kubeadm join",
+    ]
+    assert rows[-1][1:] == ["2", "4.00", "3.50"]
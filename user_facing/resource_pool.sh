@@ -8,4 +8,10 @@ fi
 
 DIR_ANSIBLE="/etc/resource_pool/ansible"
 
-docker run -it -v ${DIR_ANSIBLE}:/etc/ansible -v ${DIR_ANSIBLE}/keys/:/root/.ssh/ glaracuente/resource_pool:latest ${RESOURCE_CLI_ARGS}
+# Commands are run in the service container when it is up, which saves
+# starting a new container for every command
+if [[ "$(docker inspect -f '{{.State.Running}}' resource_pool_service 2>/dev/null)" == "true" ]] ; then
+    docker exec -it resource_pool_service /etc/resource_pool_cli/resource_pool_cli.py ${RESOURCE_CLI_ARGS}
+else
+    docker run -it -v ${DIR_ANSIBLE}:/etc/ansible -v ${DIR_ANSIBLE}/keys/:/root/.ssh/ glaracuente/resource_pool:latest ${RESOURCE_CLI_ARGS}
+fi
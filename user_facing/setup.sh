@@ -17,6 +17,12 @@ for playbook in drain reset install_k8s setup_master setup_k8s_dashboard; do
     wget "${URL_ANSIBLE_PLAYBOOKS}/${playbook}.yml" -O "${DIR_ANSIBLE_PLAYBOOKS}/${playbook}.yml"
 done
 
+mkdir "${DIR_ANSIBLE}/callback_plugins"
+URL_CALLBACK_PLUGINS="${GIT_BASE_URL}/ansible/callback_plugins"
+for plugin in json_lines; do
+    wget "${URL_CALLBACK_PLUGINS}/${plugin}.py" -O "${DIR_ANSIBLE}/callback_plugins/${plugin}.py"
+done
+
 mkdir "${DIR_POOL_TEMPLATE}"
 URL_POOL_TEMPLATE="${GIT_BASE_URL}/ansible/pool_template"
 for template_file in join masters workers; do
@@ -40,6 +46,9 @@ chmod 400 ${DIR_ANSIBLE}/keys/*
 wget ${GIT_BASE_URL}/user_facing/resource_pool.sh -O "${DIR_RESOURCE_POOL}/resource_pool.sh"
 chmod 755 "${DIR_RESOURCE_POOL}/resource_pool.sh"
 
+# START THE RESOURCE POOL SERVICE, WHICH THE WRAPPER SCRIPT SENDS COMMANDS TO
+docker run -d --name resource_pool_service --restart unless-stopped -v ${DIR_ANSIBLE}:/etc/ansible -v ${DIR_ANSIBLE}/keys/:/root/.ssh/ ${DOCKER_IMG} serve
+
 # LET USER KNOW NEXT STEPS
 echo "The resource_pool utility is now available at /etc/resource_pool/resource_pool.sh. Before using, you should:"
 echo ""